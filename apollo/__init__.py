@@ -1,6 +1,42 @@
 from .storage import *
-from .time import *
-from .viz import *
+
+
+# The time and visualization APIs are reexported at the top-level, but they are
+# imported lazily on first access. This keeps `import apollo` from importing
+# Pandas, Matplotlib, and Cartopy, which dominate the startup time of the CLI.
+# The table must agree with the `__all__` of each module, as checked by tests.
+_LAZY_ATTRS = {
+    'Timestamp': 'time',
+    'DatetimeIndex': 'time',
+    'date_range': 'time',
+    'time_of_day': 'time',
+    'time_of_year': 'time',
+    'is_daylight': 'time',
+    'DAYS': 'viz',
+    'MONTHS': 'viz',
+    'MAP_FEATURES': 'viz',
+    'date_heatmap': 'viz',
+    'date_heatmap_figure': 'viz',
+    'nam_figure': 'viz',
+}
+
+
+def __getattr__(name):
+    '''Import the lazily reexported attributes on first access.
+    '''
+    module = _LAZY_ATTRS.get(name)
+    if module is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    import importlib
+    module = importlib.import_module(f'.{module}', __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRS))
 
 
 def _import_from_str(dotted):
@@ -78,36 +78,117 @@ def setup_logging(args):
 def iter_subcommands():
     '''Iterate over the available subcommands.
     '''
-    import pkgutil
     from pathlib import Path
-
     path = Path(__file__).parent
-    for modinfo in pkgutil.iter_modules([path]):
-        name = modinfo.name
-        if not name.startswith('_'):
-            yield name
+    yield from _iter_subcommands(path)
 
 
 def subcommand_description(name):
     '''Return the short description of a subcommand.
     '''
-    import pkgutil
-    prefix = __loader__.name
-    fullname = f'{prefix}.{name}'
-    loader = pkgutil.get_loader(fullname)
-    mod = loader.load_module()
-    desc = mod.description()
-    return desc.partition('\n')[0]  # Get the first line
+    from pathlib import Path
+    path = Path(__file__).parent
+    return _subcommand_description(__name__, path, name)
 
 
 def call_subcommand(name, argv):
     '''Call the subcommand with the given name.
     '''
+    _call_subcommand(__name__, name, argv)
+
+
+def _iter_subcommands(path):
+    '''Iterate over the subcommands in a package directory.
+    '''
     import pkgutil
-    prefix = __loader__.name
-    fullname = f'{prefix}.{name}'
-    loader = pkgutil.get_loader(fullname)
-    mod = loader.load_module()
+    for modinfo in pkgutil.iter_modules([str(path)]):
+        name = modinfo.name
+        if not name.startswith('_'):
+            yield name
+
+
+def _static_description(path):
+    '''Read the description of a subcommand without executing it.
+
+    The description is taken from a module-level ``SUMMARY`` string if there
+    is one. Otherwise the ``description`` function is evaluated statically,
+    which works when it returns a string literal, optionally wrapped in
+    :func:`textwrap.dedent`.
+
+    Arguments:
+        path (pathlib.Path):
+            The source file of the subcommand module.
+
+    Returns:
+        str or None:
+            The description, or ``None`` if it cannot be determined statically.
+    '''
+    import ast
+    import textwrap
+
+    try:
+        tree = ast.parse(path.read_text(), str(path))
+    except (OSError, SyntaxError, ValueError):
+        return None
+
+    def literal(node):
+        try:
+            val = ast.literal_eval(node)
+        except ValueError:
+            return None
+        return val if isinstance(val, str) else None
+
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 \
+                and isinstance(node.targets[0], ast.Name) and node.targets[0].id == 'SUMMARY':
+            return literal(node.value)
+
+    for node in tree.body:
+        if not (isinstance(node, ast.FunctionDef) and node.name == 'description'):
+            continue
+        body = [stmt for stmt in node.body if not isinstance(stmt, (ast.Import, ast.ImportFrom))]
+        if len(body) != 1 or not isinstance(body[0], ast.Return):
+            return None
+        value = body[0].value
+        if isinstance(value, ast.Call) and len(value.args) == 1 and not value.keywords:
+            func = value.func
+            func = func.attr if isinstance(func, ast.Attribute) else getattr(func, 'id', None)
+            if func != 'dedent':
+                return None
+            text = literal(value.args[0])
+            return None if text is None else textwrap.dedent(text)
+        return literal(value)
+
+    return None
+
+
+def _subcommand_description(package, path, name):
+    '''Return the short description of a subcommand in a package.
+
+    The description is read statically when possible, so that listing the
+    subcommands does not import every one of them. Otherwise the subcommand is
+    imported and its ``description`` function is called.
+    '''
+    import importlib
+
+    source = path / name / '__init__.py'
+    if not source.exists():
+        source = path / f'{name}.py'
+
+    desc = _static_description(source)
+    if desc is None:
+        mod = importlib.import_module(f'{package}.{name}')
+        desc = mod.description()
+    return desc.partition('\n')[0]  # Get the first line
+
+
+def _call_subcommand(package, name, argv):
+    '''Import a subcommand of a package and call it.
+
+    Only the chosen subcommand is imported.
+    '''
+    import importlib
+    mod = importlib.import_module(f'{package}.{name}')
     mod.main(argv)
 
 
@@ -1,5 +1,10 @@
+# The first line of the description, read by `apollo --help` without
+# importing this package.
+SUMMARY = 'Subcommands for working with NAM forecasts.'
+
+
 def description():
-    desc = 'Subcommands for working with NAM forecasts.\n\n'
+    desc = f'{SUMMARY}\n\n'
     desc += 'subcommands:\n'
     for cmd in iter_subcommands():
         desc += f'  {cmd:12} {subcommand_description(cmd)}\n'
@@ -34,37 +39,88 @@ def parse_args(argv):
 def iter_subcommands():
     '''Iterate over the available subcommands.
     '''
-    import pkgutil
     from pathlib import Path
-
+    from apollo.cli import _iter_subcommands
     path = Path(__file__).parent
-    for modinfo in pkgutil.iter_modules([path]):
-        name = modinfo.name
-        if not name.startswith('_'):
-            yield name
+    yield from _iter_subcommands(path)
 
 
 def subcommand_description(name):
     '''Return the short description of a subcommand.
     '''
-    import pkgutil
-    prefix = __loader__.name
-    fullname = f'{prefix}.{name}'
-    loader = pkgutil.get_loader(fullname)
-    mod = loader.load_module()
-    desc = mod.description()
-    return desc.partition('\n')[0]  # Get the first line
+    from pathlib import Path
+    from apollo.cli import _subcommand_description
+    path = Path(__file__).parent
+    return _subcommand_description(__name__, path, name)
 
 
 def call_subcommand(name, argv):
     '''Call the subcommand with the given name.
     '''
-    import pkgutil
-    prefix = __loader__.name
-    fullname = f'{prefix}.{name}'
-    loader = pkgutil.get_loader(fullname)
-    mod = loader.load_module()
-    mod.main(argv)
+    from apollo.cli import _call_subcommand
+    _call_subcommand(__name__, name, argv)
+
+
+def iter_reftimes(args, default='latest'):
+    '''Iterate over the reftimes specified by the command-line arguments.
+
+    Subcommands select forecasts with one of ``args.reftime``, ``args.range``,
+    or ``args.count``. Subcommands without a ``--reftime`` option may omit it.
+
+    Arguments:
+        args (argparse.Namespace):
+            The parsed arguments of the subcommand.
+        default ('latest' or 'all'):
+            The selection when no option is given, either the most recent
+            reftime or all forecasts in the local store.
+
+    Yields:
+        Timestamp:
+            A timestamp for the reftime.
+    '''
+    import pandas as pd
+
+    import apollo
+    from apollo import nam
+
+    import logging
+    logger = logging.getLogger(__name__)
+
+    # The ``reftime`` mode gives a single reftime.
+    if getattr(args, 'reftime', None) is not None:
+        reftime = apollo.Timestamp(args.reftime)
+        logger.info(f'selected the forecast for reftime {reftime}')
+        yield reftime
+
+    # The ``range`` mode gives the reftimes between two inclusive endpoints.
+    elif args.range is not None:
+        start = apollo.Timestamp(args.range[0])
+        stop = apollo.Timestamp(args.range[1])
+        step = pd.Timedelta(6, 'h')
+        logger.info(f'selected the forecasts between {start} and {stop} (inclusive)')
+        while start <= stop:
+            yield start
+            start += step
+
+    # The ``count`` mode gives the N most recent reftimes.
+    elif args.count is not None:
+        n = args.count
+        reftime = apollo.Timestamp('now').floor('6h')
+        step = pd.Timedelta(6, 'h')
+        logger.info(f'selected the {n} most recent forecasts (ending at {reftime})')
+        for _ in range(n):
+            yield reftime
+            reftime -= step
+
+    # The default gives either all available reftimes or the most recent.
+    elif default == 'all':
+        logger.info(f'selected all forecasts')
+        yield from nam.iter_available_forecasts()
+
+    else:
+        reftime = apollo.Timestamp('now').floor('6h')
+        logger.info(f'selected the most recent forecast ({reftime})')
+        yield reftime
 
 
 def main(argv):
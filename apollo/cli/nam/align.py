@@ -52,64 +52,27 @@ def parse_args(argv):
     return parser.parse_args(argv)
 
 
-def iter_reftimes(args):
-    '''Iterate over the reftimes specified by the command-line arguments.
-
-    Yields:
-        Timestamp:
-            A timestamp for the reftime.
-    '''
-    import pandas as pd
-
-    import apollo
-
-    import logging
-    logger = logging.getLogger(__name__)
-
-    # The ``range`` mode yields the reftimes between two inclusive endpoints.
-    if args.range is not None:
-        start = apollo.Timestamp(args.range[0])
-        stop = apollo.Timestamp(args.range[1])
-        step = pd.Timedelta(6, 'h')
-        logger.info(f'selected the forecasts between {start} and {stop} (inclusive)')
-        while start <= stop:
-            yield start
-            start += step
-
-    # The ``count`` mode yields the N most recent reftimes.
-    elif args.count is not None:
-        n = args.count
-        reftime = apollo.Timestamp('now').floor('6h')
-        step = pd.Timedelta(6, 'h')
-        logger.info(f'selected the {n} most recent forecasts (ending at {reftime})')
-        for _ in range(n):
-            yield reftime
-            reftime -= step
-
-    # The default yields all available reftimes.
-    else:
-        logger.info(f'selected all forecasts')
-        yield from nam.iter_available_forecasts()
-
-
 def main(argv):
     import sys
     from apollo import nam
+    from apollo.cli.nam import iter_reftimes
 
     import logging
     logger = logging.getLogger(__name__)
 
     args = parse_args(argv)
 
-    reftimes = sorted(iter_reftimes(args))
+    reftimes = sorted(iter_reftimes(args, default='all'))
     latest = nam.open(reftimes[-1]).load()
 
     for reftime in reftimes:
         logger.info(f'Checking forecast: {reftime}')
         try:
-            data = nam.open(reftime, on_miss='raise')
+            # Bypass the dataset cache, since the files are closed below.
+            data = nam.open(reftime, on_miss='raise', cache=False)
         except nam.CacheMiss:
             logger.warning(f'Missing forecast: {reftime}')
+            continue
         ok_x = (data.x.values == latest.x.values).all()
         ok_y = (data.y.values == latest.y.values).all()
         if ok_x and ok_y: continue
@@ -132,5 +95,5 @@ def main(argv):
             data['x'] = latest.x
             data['y'] = latest.y
             data.load().close()
-            data.to_netcdf(path)
+            nam.write_nc(data, path)
             print('done')
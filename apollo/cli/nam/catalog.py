@@ -0,0 +1,33 @@
+def description():
+    import textwrap
+    return textwrap.dedent('''\
+    Rebuild the catalog of NAM forecasts.
+
+    The catalog records every netCDF forecast in the local store so that
+    forecasts can be located without walking the filesystem. Apollo keeps the
+    catalog up to date, but it must be rebuilt if forecasts are added to or
+    removed from the store by other means.
+    ''')
+
+
+def parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description=description(),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    from apollo import nam
+
+    import logging
+    logger = logging.getLogger(__name__)
+
+    args = parse_args(argv)
+
+    logger.info(f'rebuilding {nam.catalog_path()}')
+    nam.rebuild_catalog()
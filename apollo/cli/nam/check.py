@@ -44,59 +44,13 @@ def parse_args(argv):
     return parser.parse_args(argv)
 
 
-
-def reftimes(args):
-    '''Iterate over the reftimes specified by the command-line arguments.
-
-    Yields:
-        Timestamp:
-            A timestamp for the reftime.
-    '''
-    import apollo
-    import pandas as pd
-
-    import logging
-    logger = logging.getLogger(__name__)
-
-    # The ``reftime`` mode gives a single reftime.
-    if args.reftime is not None:
-        reftime = apollo.Timestamp(args.reftime)
-        logger.info(f'selected the forecast for reftime {reftime}')
-        yield reftime
-
-    # The ``range`` mode gives the reftime between two inclusive endpoints.
-    elif args.range is not None:
-        start = apollo.Timestamp(args.range[0])
-        stop = apollo.Timestamp(args.range[1])
-        step = pd.Timedelta(6, 'h')
-        logger.info(f'selected the forecasts between {start} and {stop} (inclusive)')
-        while start <= stop:
-            yield start
-            start += step
-
-    # The ``count`` mode downloads the N most recent reftimes.
-    elif args.count is not None:
-        n = args.count
-        reftime = apollo.Timestamp('now').floor('6h')
-        step = pd.Timedelta(6, 'h')
-        logger.info(f'selected the {n} most recent forecasts (ending at {reftime})')
-        for _ in range(n):
-            yield reftime
-            reftime -= step
-
-    # The default is to use the most recent reftime.
-    else:
-        reftime = apollo.Timestamp('now').floor('6h')
-        logger.info(f'selected the most recent forecast ({reftime})')
-        yield reftime
-
-
 def local_reftimes(args):
     '''Iterate over the reftimes for which we have data.
     '''
     from apollo import nam
+    from apollo.cli.nam import iter_reftimes
 
-    for reftime in reftimes(args):
+    for reftime in iter_reftimes(args):
         try:
             nam.open(reftime)
         except nam.CacheMiss:
@@ -166,5 +120,5 @@ def main(argv=None):
                     ds = a.load()
                     ds = ds.assign_attrs(history=history)
                     ds = ds.drop(diff)
-                    ds.to_netcdf(path_a)
+                    nam.write_nc(ds, path_a)
                     assert path_a.exists()
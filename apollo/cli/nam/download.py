@@ -46,6 +46,37 @@ def parse_args(argv):
         help='do not delete grib files',
     )
 
+    parser.add_argument(
+        '-s',
+        '--subset',
+        action='store_true',
+        help='fetch only the GRIB messages used by Apollo (requires .idx inventories)',
+    )
+
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        metavar='N',
+        default=4,
+        help='download up to N forecast hours concurrently (default: 4)',
+    )
+
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        metavar='SECONDS',
+        default=10,
+        help='the network timeout for each request (default: 10)',
+    )
+
+    parser.add_argument(
+        '--store',
+        choices=['netcdf', 'zarr'],
+        default=None,
+        help='the backend of the local store (default: $APOLLO_NAM_STORE or netcdf)',
+    )
+
     selectors = parser.add_mutually_exclusive_group()
 
     selectors.add_argument(
@@ -74,56 +105,10 @@ def parse_args(argv):
     return parser.parse_args(argv)
 
 
-def reftimes(args):
-    '''Iterate over the reftimes specified by the command-line arguments.
-
-    Yields:
-        Timestamp:
-            A timestamp for the reftime.
-    '''
-    import pandas as pd
-
-    import apollo
-
-    import logging
-    logger = logging.getLogger(__name__)
-
-    # The ``reftime`` mode gives a single reftime.
-    if args.reftime is not None:
-        reftime = apollo.Timestamp(args.reftime)
-        logger.info(f'selected the forecast for reftime {reftime}')
-        yield reftime
-
-    # The ``range`` mode gives the reftime between two inclusive endpoints.
-    elif args.range is not None:
-        start = apollo.Timestamp(args.range[0])
-        stop = apollo.Timestamp(args.range[1])
-        step = pd.Timedelta(6, 'h')
-        logger.info(f'selected the forecasts between {start} and {stop} (inclusive)')
-        while start <= stop:
-            yield start
-            start += step
-
-    # The ``count`` mode downloads the N most recent reftimes.
-    elif args.count is not None:
-        n = args.count
-        reftime = apollo.Timestamp('now').floor('6h')
-        step = pd.Timedelta(6, 'h')
-        logger.info(f'selected the {n} most recent forecasts (ending at {reftime})')
-        for _ in range(n):
-            yield reftime
-            reftime -= step
-
-    # The default is to use the most recent reftime.
-    else:
-        reftime = apollo.Timestamp('now').floor('6h')
-        logger.info(f'selected the most recent forecast ({reftime})')
-        yield reftime
-
-
 def main(argv=None):
     import apollo
     from apollo import nam
+    from apollo.cli.nam import iter_reftimes
 
     import logging
     logger = logging.getLogger(__name__)
@@ -134,9 +119,21 @@ def main(argv=None):
     for arg, val in vars(args).items():
         logger.debug(f'  {arg}: {val}')
 
-    for reftime in reftimes(args):
+    # All forecasts share one pool of keep-alive connections,
+    # with one connection per download worker.
+    nam.http_session(pool_size=args.jobs)
+
+    for reftime in iter_reftimes(args):
         try:
-            nam.download(reftime, fail_fast=args.fail_fast, keep_gribs=args.keep_gribs)
+            nam.download(
+                reftime,
+                fail_fast=args.fail_fast,
+                keep_gribs=args.keep_gribs,
+                max_workers=args.jobs,
+                subset=args.subset,
+                timeout=args.timeout,
+                store=args.store,
+            )
         except Exception as e:
             logger.error(e)
             logger.error(f'Could not download data for {reftime}')
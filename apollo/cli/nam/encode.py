@@ -0,0 +1,121 @@
+def description():
+    import textwrap
+    return textwrap.dedent('''\
+    Re-encode NAM forecasts with the storage encoding policy.
+
+    Each forecast is rewritten in place with compression, chunking, and packing
+    applied to its data variables. This is useful to migrate forecasts written
+    by older versions of Apollo, or to apply a different policy to the archive.
+
+    Forecasts are selected by one of --reftime/-t, --range/-r, or --count/-n.
+    If none of those options are provided, all forecasts are selected.
+    ''')
+
+
+def parse_args(argv):
+    import argparse
+
+    from apollo import nam
+
+    policy = nam.ENCODING_POLICY
+
+    parser = argparse.ArgumentParser(
+        description=description(),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    parser.add_argument(
+        '-d',
+        '--dry-run',
+        action='store_true',
+        help='only print the forecasts that would be re-encoded'
+    )
+
+    parser.add_argument(
+        '--complevel',
+        type=int,
+        metavar='LEVEL',
+        default=policy['complevel'],
+        help=f'zlib compression level, 0 to disable (default: {policy["complevel"]})',
+    )
+
+    parser.add_argument(
+        '--no-shuffle',
+        dest='shuffle',
+        action='store_false',
+        help='disable the byte shuffle filter',
+    )
+
+    parser.add_argument(
+        '--pack',
+        choices=['float32', 'int16'],
+        default=policy['pack'],
+        help=f'on-disk type of data variables (default: {policy["pack"]})',
+    )
+
+    parser.add_argument(
+        '--tile',
+        type=int,
+        metavar='N',
+        default=policy['tile'],
+        help=f'chunk size along x and y (default: {policy["tile"]})',
+    )
+
+    selectors = parser.add_mutually_exclusive_group()
+
+    selectors.add_argument(
+        '-t',
+        '--reftime',
+        metavar='TIMESTAMP',
+        help='re-encode the forecast for the given reftime',
+    )
+
+    selectors.add_argument(
+        '-r',
+        '--range',
+        nargs=2,
+        metavar=('START', 'STOP'),
+        help='re-encode all forecasts on this range, inclusive'
+    )
+
+    selectors.add_argument(
+        '-n',
+        '--count',
+        type=int,
+        metavar='N',
+        help='re-encode the N most recent forecasts',
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    from apollo import nam
+    from apollo.cli.nam import iter_reftimes
+
+    import logging
+    logger = logging.getLogger(__name__)
+
+    args = parse_args(argv)
+
+    logger.debug('called with the following options:')
+    for arg, val in vars(args).items():
+        logger.debug(f'  {arg}: {val}')
+
+    policy = {
+        'complevel': args.complevel,
+        'shuffle': args.shuffle,
+        'pack': args.pack,
+        'tile': args.tile,
+    }
+
+    for reftime in iter_reftimes(args, default='all'):
+        path = nam.nc_path(reftime)
+        if not path.exists():
+            logger.warning(f'Missing forecast: {reftime}')
+            continue
+
+        print(f'Re-encoding: {reftime}')
+        if args.dry_run: continue
+
+        nam.reencode(path, **policy)
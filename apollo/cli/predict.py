@@ -22,6 +22,22 @@ def parse_args(argv):
         help='The model to execute.'
     )
 
+    parser.add_argument(
+        '--output',
+        '-o',
+        metavar='FILE',
+        help='Write predictions to a CSV file rather than stdout.'
+    )
+
+    parser.add_argument(
+        '--chunk',
+        dest='chunksize',
+        metavar='SIZE',
+        help='Predict in batches spanning this much time, e.g. 30D. '
+        'Each batch is written as soon as it is ready, and batches without '
+        'NAM data are skipped.'
+    )
+
     target_options = parser.add_mutually_exclusive_group()
 
     target_options.add_argument(
@@ -63,14 +79,14 @@ def load_model(args):
             print(f'Unknown model: {name}', file=sys.stderr)
             print(f'Hint: use `apollo ls models` to list models', file=sys.stderr)
             sys.exit(1)
-        return models.load_named_model(args.model)
+        return models.load_named_model(args.model, memmap=True)
 
     else:
         path = Path(args.model)
         if not path.exists():
             print(f'No such file: {path}', file=sys.stderr)
             sys.exit(1)
-        return models.load_model(args.model)
+        return models.load_model(args.model, memmap=True)
 
 
 def get_times(args):
@@ -101,9 +117,29 @@ def get_times(args):
 
 
 def main(argv):
+    import contextlib
     import sys
+
     args = parse_args(argv)
     model = load_model(args)
     times = get_times(args)
-    prediction = model.predict(times)
-    predictions.to_csv(sys.stdout)
+
+    if args.output is None:
+        out = contextlib.nullcontext(sys.stdout)
+    else:
+        out = open(args.output, 'w', newline='')
+
+    with out as fd:
+        # Without a chunk size, predict everything in one batch.
+        if args.chunksize is None:
+            predictions = model.predict(times)
+            predictions.to_csv(fd)
+            return
+
+        # Otherwise stream batches, writing the header only once.
+        # Batches without NAM data are skipped; other errors are raised.
+        header = True
+        for predictions in model.iter_predict(times, args.chunksize, errors='skip'):
+            predictions.to_csv(fd, header=header)
+            fd.flush()
+            header = False
@@ -0,0 +1,230 @@
+def description():
+    import textwrap
+    return textwrap.dedent('''\
+    Serve predictions from trained models over HTTP.
+
+    The server keeps named models from the Apollo database and recently used
+    NAM data in memory, so each request only pays for the prediction itself.
+    Models are loaded on first use and reloaded when their file changes.
+    Requests are handled concurrently.
+
+    The server listens on a TCP address by default, or on a Unix socket with
+    --socket. It provides the following endpoints:
+
+      GET /models
+          List the named models, as JSON.
+
+      GET /predict/NAME?start=START&stop=STOP[&format=csv|json]
+          Predict hourly from START to STOP, inclusive, with the named model.
+          STOP defaults to START. The default format is CSV. The JSON format
+          is an object with "index", "columns", and "data" arrays.
+    ''')
+
+
+def parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description=description(),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    parser.add_argument(
+        '--host',
+        metavar='HOST',
+        default='127.0.0.1',
+        help='the address to listen on (default: 127.0.0.1)',
+    )
+
+    parser.add_argument(
+        '-p',
+        '--port',
+        type=int,
+        metavar='PORT',
+        default=8000,
+        help='the port to listen on (default: 8000)',
+    )
+
+    parser.add_argument(
+        '-s',
+        '--socket',
+        metavar='PATH',
+        default=None,
+        help='listen on a Unix socket rather than a TCP address',
+    )
+
+    parser.add_argument(
+        '--preload',
+        action='store_true',
+        help='load every named model at startup',
+    )
+
+    return parser.parse_args(argv)
+
+
+class ModelRegistry:
+    '''A thread-safe cache of named models from the Apollo database.
+
+    Models are loaded on first use, and reloaded when the modification time
+    of their file changes.
+    '''
+
+    def __init__(self):
+        import threading
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def names(self):
+        from apollo import models
+        return sorted(models.list_models())
+
+    def get(self, name):
+        '''Get a named model.
+
+        Raises:
+            KeyError: The model does not exist.
+        '''
+        import apollo
+        from apollo import models
+
+        import logging
+        logger = logging.getLogger(__name__)
+
+        if name not in self.names():
+            raise KeyError(name)
+
+        path = apollo.path(f'models/{name}.model')
+        mtime = path.stat().st_mtime_ns
+        with self._lock:
+            entry = self._models.get(name)
+            if entry is None or entry[0] != mtime:
+                logger.info(f'loading model {name}')
+                # Served models are never trained, so their arrays can be
+                # memory-mapped and shared with the page cache.
+                entry = (mtime, models.load_named_model(name, memmap=True))
+                self._models[name] = entry
+        return entry[1]
+
+
+def make_server(args, registry):
+    '''Construct the HTTP server described by the command-line arguments.
+    '''
+    import http.server
+    import json
+    import socketserver
+    import urllib.parse
+
+    import apollo
+    from apollo import nam
+
+    import logging
+    logger = logging.getLogger(__name__)
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+        def address_string(self):
+            # Unix sockets have no client address.
+            return str(self.client_address[0]) if self.client_address else 'unix'
+
+        def log_message(self, fmt, *args):
+            logger.info(f'{self.address_string()} {fmt % args}')
+
+        def send_body(self, status, body, content_type):
+            body = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_error_json(self, status, message):
+            body = json.dumps({'error': message})
+            self.send_body(status, body, 'application/json')
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            query = urllib.parse.parse_qs(url.query)
+            parts = [p for p in url.path.split('/') if p]
+
+            try:
+                if parts == ['models']:
+                    body = json.dumps(registry.names())
+                    self.send_body(200, body, 'application/json')
+                elif len(parts) == 2 and parts[0] == 'predict':
+                    self.predict(parts[1], query)
+                else:
+                    self.send_error_json(404, f'not found: {url.path}')
+            except Exception as e:
+                logger.exception(f'failed to handle {self.path}')
+                self.send_error_json(500, str(e))
+
+        def predict(self, name, query):
+            fmt = query.get('format', ['csv'])[0]
+            if fmt not in ('csv', 'json'):
+                return self.send_error_json(400, f'unknown format: {fmt}')
+
+            try:
+                start = query['start'][0]
+                stop = query.get('stop', [start])[0]
+                times = apollo.date_range(start, stop, freq='1h')
+            except (KeyError, ValueError) as e:
+                return self.send_error_json(400, f'invalid time range: {e}')
+
+            try:
+                model = registry.get(name)
+            except KeyError:
+                return self.send_error_json(404, f'unknown model: {name}')
+
+            try:
+                predictions = model.predict(times)
+            except nam.CacheMiss as e:
+                return self.send_error_json(404, str(e))
+
+            if fmt == 'json':
+                body = predictions.to_json(orient='split', date_format='iso')
+                self.send_body(200, body, 'application/json')
+            else:
+                body = predictions.to_csv()
+                self.send_body(200, body, 'text/csv')
+
+    if args.socket is None:
+        class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+            daemon_threads = True
+        return Server((args.host, args.port), Handler)
+
+    else:
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+        return Server(args.socket, Handler)
+
+
+def main(argv):
+    import os
+
+    import logging
+    logger = logging.getLogger(__name__)
+
+    args = parse_args(argv)
+    registry = ModelRegistry()
+
+    if args.preload:
+        for name in registry.names():
+            registry.get(name)
+
+    if args.socket is not None and os.path.exists(args.socket):
+        os.unlink(args.socket)
+
+    server = make_server(args, registry)
+    if args.socket is None:
+        logger.info(f'listening on http://{args.host}:{args.port}')
+    else:
+        logger.info(f'listening on {args.socket}')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.unlink(args.socket)
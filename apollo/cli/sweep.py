@@ -0,0 +1,181 @@
+def description():
+    import textwrap
+    return textwrap.dedent('''\
+    Train several models in parallel.
+
+    Each template is trained against the same training data. Models whose
+    templates share the same feature spec (e.g. NAM features, center, and
+    shape) load their feature data once, and the models are then trained in
+    parallel across a pool of processes.
+
+    Each model keeps the name given by its template, or is named after the
+    template if it has none, and it is saved to the Apollo database. Names
+    must be unique. The path of each trained model is printed as it completes.
+    ''')
+
+
+def parse_args(argv):
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(
+        description=description(),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    parser.add_argument(
+        '-t',
+        dest='named_template',
+        action='store_true',
+        help='load builtin templates rather than template files',
+    )
+
+    parser.add_argument(
+        '-o',
+        metavar='DIR',
+        dest='dest',
+        default=None,
+        help='output directory for the models, defaults to the Apollo database',
+    )
+
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        metavar='N',
+        default=os.cpu_count(),
+        help='the number of models to train at once, each on a single thread '
+             '(default: number of CPUs)',
+    )
+
+    parser.add_argument(
+        '-d',
+        '--data',
+        metavar='DATA',
+        dest='data_file',
+        required=True,
+        help='the training data (a CSV, or - for stdin)',
+    )
+
+    parser.add_argument(
+        'templates',
+        metavar='TEMPLATE',
+        nargs='+',
+        help='paths to template files or the names of builtin templates',
+    )
+
+    return parser.parse_args(argv)
+
+
+# The state shared with the worker processes, set by `_init_worker`.
+# With the fork start method this is inherited without being copied.
+_shared = None
+
+
+def _init_worker(shared):
+    from threadpoolctl import threadpool_limits
+
+    global _shared
+    _shared = shared
+
+    # The workers already occupy the CPUs, so each trains on a single thread.
+    # Otherwise the BLAS and OpenMP pools of every worker oversubscribe them.
+    threadpool_limits(1)
+
+
+def _train(i, dest):
+    '''Train the i-th model in a worker process and save it.
+    '''
+    from pathlib import Path
+
+    (models, specs, features, targets) = _shared
+    model = models[i]
+    data = features.get(specs[i])
+    model.fit(targets, data=data)
+    if dest is not None:
+        dest = Path(dest) / f'{model.name}.model'
+    return model.save(dest)
+
+
+def load_template(template, named=False):
+    '''Load a template, naming it after its file if it has no name.
+
+    Returns:
+        dict:
+            The template.
+    '''
+    import json
+    from pathlib import Path
+
+    import apollo
+
+    path = apollo.path(f'templates/{template}.json') if named else Path(template)
+    with path.open('r') as fd:
+        template = json.load(fd)
+    template.setdefault('name', path.stem)
+    return template
+
+
+def main(argv):
+    import sys
+    from collections import Counter
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from pathlib import Path
+
+    import pandas as pd
+
+    from apollo import models
+
+    import logging
+    logger = logging.getLogger(__name__)
+
+    args = parse_args(argv)
+
+    logger.info('instantiating models from templates')
+    sweep = []
+    for template in args.templates:
+        template = load_template(template, named=args.named_template)
+        sweep.append(models.from_template(template))
+
+    # Models with the same name would overwrite each other.
+    counts = Counter(model.name for model in sweep)
+    duplicates = sorted(name for (name, n) in counts.items() if 1 < n)
+    if duplicates:
+        print(f'Duplicate model names: {", ".join(duplicates)}', file=sys.stderr)
+        sys.exit(1)
+
+    logger.info('reading training data')
+    data_file = sys.stdin if args.data_file == '-' else args.data_file
+    targets = pd.read_csv(data_file, parse_dates=True, index_col=0)
+
+    # Load the feature data once per distinct spec.
+    # Models without a spec load their own data in the worker.
+    specs = [model.data_spec for model in sweep]
+    features = {}
+    for (model, spec) in zip(sweep, specs):
+        if spec is not None and spec not in features:
+            logger.info(f'loading features for {model.name}')
+            features[spec] = model.load_data(targets.index)
+    logger.info(f'loaded {len(features)} distinct feature sets for {len(sweep)} models')
+
+    if args.dest is not None:
+        Path(args.dest).mkdir(parents=True, exist_ok=True)
+
+    shared = (sweep, specs, features, targets)
+    jobs = max(1, min(args.jobs, len(sweep)))
+    with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(shared,)) as pool:
+        futures = {pool.submit(_train, i, args.dest): sweep[i].name for i in range(len(sweep))}
+        failed = False
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                path = future.result()
+            except Exception as e:
+                logger.error(f'failed to train {name}: {e}')
+                failed = True
+            else:
+                logger.info(f'trained model {name}')
+                print(path, flush=True)
+
+    if failed:
+        sys.exit(1)
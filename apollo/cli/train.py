@@ -32,6 +32,15 @@ def parse_args(argv):
         help='output path for the model, defaults to the Apollo database',
     )
 
+    parser.add_argument(
+        '--chunk',
+        metavar='SIZE',
+        dest='chunksize',
+        default=None,
+        help='train out-of-core over chunks of this much time, e.g. 30D '
+             '(requires an estimator with partial_fit)',
+    )
+
     parser.add_argument(
         'template',
         metavar='TEMPLATE',
@@ -73,6 +82,6 @@ def main(argv):
     targets = pd.read_csv(args.data_file, parse_dates=True, index_col=0)
 
     logger.info(f'training model with name {model.name}')
-    model.fit(targets)
+    model.fit(targets, chunksize=args.chunksize)
     path = model.save(args.dest)
     print(path)
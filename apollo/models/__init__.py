@@ -1,2 +1,10 @@
 from .core import *
-from .nam_model import NamModel
+
+
+def __getattr__(name):
+    # The concrete models import the NAM and Scikit-learn stacks,
+    # so we only import them when they are first used.
+    if name == 'NamModel':
+        from .nam_model import NamModel
+        return NamModel
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,197 @@
+'''The model archive format.
+
+A model archive is a single file storing a pickled model with its large
+buffers, like the arrays of the estimator and scalers, out-of-band. The
+buffers are written raw and aligned, so an archive can be memory-mapped on
+load and the arrays used in place without being copied or decoded.
+
+The layout of an archive is:
+
+- 8 bytes: the magic string :data:`MAGIC`.
+- 8 bytes: the length of the header, a little-endian unsigned integer.
+- The header, a JSON object describing the model and the data section.
+- Padding up to a multiple of :data:`ALIGN` bytes.
+- The data section: the pickle stream, followed by each buffer. Every item
+  starts at a multiple of :data:`ALIGN` bytes.
+
+The header records the class and name of the model, its JSON-serializable
+configuration, and the offset and length of each item in the data section,
+relative to the start of the data section. The header can be read with
+:func:`read_header` without loading the model.
+'''
+
+import io
+import json
+import logging
+import mmap
+import os
+import struct
+from pathlib import Path
+
+import numpy as np
+import pickle5 as pickle
+
+
+logger = logging.getLogger(__name__)
+
+
+#: The magic string at the start of every model archive.
+MAGIC = b'APOLLOM\x01'
+
+#: The alignment of items in the data section, in bytes.
+ALIGN = 64
+
+
+def _align(n):
+    return -(-n // ALIGN) * ALIGN
+
+
+def _config(model):
+    '''The public attributes of a model which can be encoded as JSON.
+    '''
+    config = {}
+    for (key, val) in vars(model).items():
+        if key.startswith('_'): continue
+        try:
+            json.dumps(val)
+        except (TypeError, ValueError):
+            continue
+        config[key] = val
+    return config
+
+
+class _Pickler(pickle.Pickler):
+    '''A pickler which writes the data of every plain array out-of-band.
+    '''
+
+    def reducer_override(self, obj):
+        # Non-contiguous arrays, like the transposed coefficients of many
+        # estimators, are otherwise pickled in-band.
+        if type(obj) is np.ndarray and not obj.dtype.hasobject \
+                and not (obj.flags.c_contiguous or obj.flags.f_contiguous):
+            return np.ascontiguousarray(obj).__reduce_ex__(5)
+        return NotImplemented
+
+
+def is_archive(path):
+    '''Test if a file is a model archive.
+
+    Arguments:
+        path (str or pathlib.Path):
+            The path to test.
+
+    Returns:
+        bool:
+            True if the file starts with :data:`MAGIC`.
+    '''
+    with Path(path).open('rb') as fd:
+        return fd.read(len(MAGIC)) == MAGIC
+
+
+def dump(model, path):
+    '''Write a model archive.
+
+    The archive is written to a temporary file which is then moved into place,
+    so readers never see a partial archive.
+
+    Arguments:
+        model (apollo.models.Model):
+            The model to write.
+        path (str or pathlib.Path):
+            The destination.
+    '''
+    path = Path(path)
+    buffers = []
+    payload = io.BytesIO()
+    _Pickler(payload, protocol=5, buffer_callback=buffers.append).dump(model)
+    items = [payload.getbuffer()] + [b.raw() for b in buffers]
+
+    offset = 0
+    layout = []
+    for item in items:
+        layout.append([offset, item.nbytes])
+        offset = _align(offset + item.nbytes)
+
+    cls = type(model)
+    header = {
+        'format': 1,
+        'class': f'{cls.__module__}.{cls.__qualname__}',
+        'name': model.name,
+        'config': _config(model),
+        'pickle': layout[0],
+        'buffers': layout[1:],
+    }
+    header = json.dumps(header).encode('utf-8')
+    start = _align(len(MAGIC) + 8 + len(header))
+
+    logger.debug(f'dump: writing {len(buffers)} out-of-band buffers to {path}')
+    tmp = path.with_name(f'{path.name}.part')
+    with tmp.open('wb') as fd:
+        fd.write(MAGIC)
+        fd.write(struct.pack('<Q', len(header)))
+        fd.write(header)
+        for (item, (off, _)) in zip(items, layout):
+            fd.seek(start + off)
+            fd.write(item)
+        fd.truncate()
+    os.replace(tmp, path)
+
+
+def _read_header(fd):
+    magic = fd.read(len(MAGIC))
+    if magic != MAGIC:
+        raise ValueError(f'{fd.name} is not an Apollo model archive')
+    (n,) = struct.unpack('<Q', fd.read(8))
+    header = json.loads(fd.read(n).decode('utf-8'))
+    start = _align(len(MAGIC) + 8 + n)
+    return header, start
+
+
+def read_header(path):
+    '''Read the header of a model archive.
+
+    Arguments:
+        path (str or pathlib.Path):
+            The path to the archive.
+
+    Returns:
+        dict:
+            The header, including the ``class``, ``name``, and ``config`` of
+            the model.
+    '''
+    with Path(path).open('rb') as fd:
+        header, _ = _read_header(fd)
+    return header
+
+
+def load(path, memmap=False):
+    '''Load a model from an archive.
+
+    Arguments:
+        path (str or pathlib.Path):
+            The path to the archive.
+        memmap (bool):
+            If true, the archive is memory-mapped and the out-of-band buffers
+            are used in place. Arrays backed by these buffers are read-only,
+            so the model can make predictions but must not be trained further,
+            e.g. with :meth:`~apollo.models.Model.partial_fit`. Otherwise the
+            archive is read into writable memory. The default is false.
+
+    Returns:
+        apollo.models.Model:
+            The model.
+    '''
+    with Path(path).open('rb') as fd:
+        header, start = _read_header(fd)
+        if memmap:
+            data = memoryview(mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ))
+        else:
+            fd.seek(0)
+            data = memoryview(bytearray(fd.read()))
+
+    def view(item):
+        (off, n) = item
+        return data[start+off : start+off+n]
+
+    buffers = [view(item) for item in header['buffers']]
+    return pickle.loads(view(header['pickle']), buffers=buffers)
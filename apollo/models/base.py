@@ -5,18 +5,26 @@ from pathlib import Path
 
 import numpy as np
 import pandas as pd
-import pickle5 as pickle
 
 import sklearn
 from sklearn.preprocessing import StandardScaler
 
 import apollo
-from apollo.models import make_estimator
+from apollo.models import archive, make_estimator
 
 
 logger = logging.getLogger(__name__)
 
 
+def _nanoseconds(index):
+    '''Nanoseconds since the epoch of each time in a UTC datetime index.
+
+    Unlike ``index.asi8``, this does not depend on the unit of the index, so
+    indices of different units may be compared.
+    '''
+    return np.asarray(index.values, dtype='datetime64[ns]').astype('int64')
+
+
 class Model(ABC):
     '''Base class for all Apollo models.
 
@@ -78,6 +86,11 @@ class Model(ABC):
     - :meth:`postprocess`: This method transforms the "raw predictions"
       returned by the estimator into a fully-fledged DataFrame. The default
       implementation simply delegates to the DataFrame constructor.
+
+    Models can also be trained out-of-core by passing a ``chunksize`` to
+    :meth:`fit`, or updated incrementally with :meth:`partial_fit`. Both
+    require an estimator with a ``partial_fit`` method, and a
+    :meth:`preprocess` that supports the ``partial`` argument.
     '''
 
     def __init__(
@@ -129,11 +142,33 @@ class Model(ABC):
         '''
         pass
 
-    def preprocess(self, features, targets=None, fit=False):
+    @property
+    def learns_transforms(self):
+        '''Whether :meth:`preprocess` learns transforms when ``fit`` is true.
+
+        When fitting in chunks, learnable transforms are fit in a separate
+        pass over the data before the estimator sees any of it. The default
+        is false.
+        '''
+        return False
+
+    @property
+    def data_spec(self):
+        '''A hashable description of the data returned by :meth:`load_data`.
+
+        Models with equal, non-null specs load identical feature data for
+        the same index, so the data may be loaded once and shared between
+        them, e.g. by ``apollo sweep``. The default is ``None``, meaning the
+        data cannot be shared.
+        '''
+        return None
+
+    def preprocess(self, features, targets=None, fit=False, partial=False,
+            return_index=False):
         '''Convert structured data into raw data for the estimator.
 
         The default implementation passes both the features and targets to
-        :func:`numpy.asanyarray`.
+        :func:`numpy.asanyarray`, keeping every row.
 
         Arguments:
             features:
@@ -142,15 +177,25 @@ class Model(ABC):
                 The target data passed into :meth:`fit`.
             fit (bool):
                 If true, fit lernable transforms against this target data.
+            partial (bool):
+                If true and ``fit`` is true, update the learnable transforms
+                incrementally rather than fitting them from scratch.
+            return_index (bool):
+                If true, also return the index of the rows which were kept.
 
         Returns:
             pair of ndarray:
                 A pair of arrays ``(raw_features, raw_targets)`` containint
                 processed feature data and processed target data respectivly.
                 The ``raw_targets`` will be ``None`` if no ``target`` was given.
+                If ``return_index`` is true, the index of the rows of
+                ``raw_features`` is returned as a third value. It is ``None``
+                if the features have no index.
         '''
         raw_features = np.asanyarray(features)
-        raw_targets = np.asanyarray(raw_targets) or None
+        raw_targets = None if targets is None else np.asanyarray(targets)
+        if return_index:
+            return raw_features, raw_targets, getattr(features, 'index', None)
         return raw_features, raw_targets
 
     def postprocess(self, raw_predictions, index):
@@ -171,12 +216,21 @@ class Model(ABC):
         '''
         return pd.DataFrame(raw_predictions, index=index)
 
-    def fit(self, targets, **kwargs):
+    def fit(self, targets, chunksize=None, data=None, **kwargs):
         '''Fit the models to some target data.
 
         Arguments:
             targets (pandas.DataFrame):
                 The data to fit against.
+            chunksize (str or pandas.Timedelta or None):
+                If given, fit out-of-core over chunks of the target index
+                spanning this much time, e.g. ``'30D'``. Only one chunk of
+                feature data is held in memory at a time. The estimator must
+                support ``partial_fit``.
+            data:
+                Feature data previously returned by :meth:`load_data` for
+                the target index, possibly by another model with the same
+                :attr:`data_spec`. If given, :meth:`load_data` is not called.
             **kwargs:
                 Additional arguments are forwarded to :meth:`load_data`.
 
@@ -184,35 +238,186 @@ class Model(ABC):
             Model:
                 self
         '''
-        data = self.load_data(targets.index, **kwargs)
+        if chunksize is not None:
+            if data is not None:
+                raise ValueError('cannot fit in chunks with preloaded data')
+            return self._fit_chunked(targets, chunksize, **kwargs)
+
+        if data is None:
+            data = self.load_data(targets.index, **kwargs)
         raw_data, raw_targets = self.preprocess(data, targets, fit=True)
         logger.debug('fit: fitting estimator')
         self.estimator.fit(raw_data, raw_targets)
         return self
 
-    def predict(self, index, **kwargs):
+    def _fit_chunked(self, targets, chunksize, **kwargs):
+        '''Fit the model over chunks of the target data.
+
+        Chunks without feature data, or with no usable rows after
+        preprocessing, are skipped. See :meth:`fit`.
+        '''
+        from apollo import nam
+
+        if not hasattr(self.estimator, 'partial_fit'):
+            raise ValueError('fitting in chunks requires an estimator with partial_fit')
+
+        index = apollo.DatetimeIndex(targets.index)
+        keys = index.floor(chunksize)
+        chunks = [(k, targets[keys == k]) for k in keys.unique().sort_values()]
+        logger.debug(f'fit: fitting over {len(chunks)} chunks of {chunksize}')
+
+        def load_chunk(key, chunk, fit, partial):
+            # Returns None if the chunk should be skipped.
+            try:
+                data = self.load_data(chunk.index, **kwargs)
+            except nam.CacheMiss as e:
+                logger.debug(f'fit: skipping chunk starting at {key}: {e}')
+                return None
+            raw_data, raw_targets = self.preprocess(data, chunk, fit=fit, partial=partial)
+            if len(raw_data) == 0:
+                logger.debug(f'fit: skipping chunk starting at {key}: no rows')
+                return None
+            return raw_data, raw_targets
+
+        # Start from a fresh estimator, like `estimator.fit` would.
+        self._estimator = sklearn.base.clone(self.estimator)
+
+        # Learnable transforms must be complete before the estimator sees
+        # any data, so they get their own pass. Transforms are fit from
+        # scratch on the first chunk with data and updated on the rest.
+        two_pass = self.learns_transforms
+        if two_pass:
+            logger.debug('fit: fitting transforms')
+            fitted = False
+            for (key, chunk) in chunks:
+                if load_chunk(key, chunk, fit=True, partial=fitted) is not None:
+                    fitted = True
+            if not fitted:
+                raise ValueError('no chunk has any data to fit')
+
+        logger.debug('fit: fitting estimator')
+        fitted = False
+        for (key, chunk) in chunks:
+            raw = load_chunk(key, chunk, fit=(not two_pass), partial=fitted)
+            if raw is None: continue
+            self.estimator.partial_fit(*raw)
+            fitted = True
+        if not fitted:
+            raise ValueError('no chunk has any data to fit')
+        return self
+
+    def partial_fit(self, targets, **kwargs):
+        '''Update the model incrementally with some target data.
+
+        Learnable transforms are updated with the new data before it is passed
+        to the ``partial_fit`` method of the estimator.
+
+        Arguments:
+            targets (pandas.DataFrame):
+                The data to fit against.
+            **kwargs:
+                Additional arguments are forwarded to :meth:`load_data`.
+
+        Returns:
+            Model:
+                self
+        '''
+        data = self.load_data(targets.index, **kwargs)
+        raw_data, raw_targets = self.preprocess(data, targets, fit=True, partial=True)
+        logger.debug('partial_fit: updating estimator')
+        self.estimator.partial_fit(raw_data, raw_targets)
+        return self
+
+    def predict(self, index, chunksize=None, **kwargs):
         '''Generate a prediction from this model.
 
+        The predictions are indexed by the rows kept by :meth:`preprocess`,
+        which may omit times for which no usable feature data is available.
+
         Arguments:
             index (pandas.Index):
                 Make predictions for this index.
+            chunksize (str or pandas.Timedelta or None):
+                If given, predict in batches spanning this much time, e.g.
+                ``'30D'``. Only one batch of feature data is held in memory
+                at a time. See :meth:`iter_predict`.
             **kwargs:
                 Additional arguments are forwarded to :meth:`load_data`.
 
         Returns:
             pandas.DataFrame:
-                A data frame of predicted values.
+                A data frame of predicted values. When predicting in batches,
+                it is empty if no batch could be predicted.
         '''
+        if chunksize is not None:
+            batches = list(self.iter_predict(index, chunksize, **kwargs))
+            if len(batches) == 0:
+                # Every batch was skipped, or the index is empty.
+                index = apollo.DatetimeIndex([], name='time')
+                return pd.DataFrame(index=index, columns=self.columns, dtype='float64')
+            return pd.concat(batches)
+
         data = self.load_data(index, **kwargs)
-        raw_data, _ = self.preprocess(data)
+        raw_data, _, kept = self.preprocess(data, return_index=True)
         logger.debug('predict: executing estimator')
         raw_predictions = self.estimator.predict(raw_data)
-        prediction = self.postprocess(raw_predictions, index)
+        index = index if kept is None else kept
+        predictions = self.postprocess(raw_predictions, index)
         return predictions
 
+    def iter_predict(self, index, chunksize, errors='raise', **kwargs):
+        '''Generate predictions in batches over time.
+
+        The index is split into windows spanning ``chunksize`` and a data
+        frame of predictions is yielded for each window, in order. Memory use
+        is bounded by the size of one batch, regardless of the length of the
+        index.
+
+        Arguments:
+            index (pandas.DatetimeIndex):
+                Make predictions for this index.
+            chunksize (str or pandas.Timedelta):
+                The span of each batch, e.g. ``'30D'``.
+            errors (str):
+                If ``'raise'``, errors in any batch are raised. If
+                ``'skip'``, batches without feature data, i.e. those which
+                raise :class:`apollo.nam.CacheMiss`, are logged and skipped.
+                Other errors are always raised.
+            **kwargs:
+                Additional arguments are forwarded to :meth:`load_data`.
+
+        Yields:
+            pandas.DataFrame:
+                A data frame of predicted values for each batch.
+        '''
+        # Validate eagerly, rather than when the first batch is requested.
+        if errors not in ('raise', 'skip'):
+            raise ValueError(f"errors must be 'raise' or 'skip', got {errors!r}")
+        return self._iter_predict(index, chunksize, errors, **kwargs)
+
+    def _iter_predict(self, index, chunksize, errors, **kwargs):
+        '''The generator behind :meth:`iter_predict`.
+        '''
+        from apollo import nam
+
+        index = apollo.DatetimeIndex(index)
+        keys = index.floor(chunksize)
+        for key in keys.unique().sort_values():
+            batch = index[keys == key]
+            logger.debug(f'predict: batch of {len(batch)} starting at {key}')
+            try:
+                yield self.predict(batch, **kwargs)
+            except nam.CacheMiss as e:
+                if errors == 'raise': raise
+                logger.warning(f'Skipping batch starting at {key}: {e}')
+
     def save(self, path=None):
         '''Persist a model to disk.
 
+        The model is written in the archive format of
+        :mod:`apollo.models.archive`, which stores large arrays out-of-band so
+        that they can be memory-mapped when the model is loaded.
+
         Arguments:
             path (str or pathlib.Path or None):
                 The path at which to save the model. The default is a path
@@ -229,8 +434,7 @@ class Model(ABC):
             path = Path(path)
 
         logger.debug(f'save: writing model to {path}')
-        fd = path.open('wb')
-        pickle.dump(self, fd, protocol=5)
+        archive.dump(self, path)
         return path
 
 
@@ -290,83 +494,130 @@ class IrradianceModel(Model):
         self.feature_scaler = StandardScaler(copy=False)
         self.target_scaler = StandardScaler(copy=False)
 
-    def preprocess(self, data, targets=None, fit=False):
+    @property
+    def learns_transforms(self):
+        '''Whether :meth:`preprocess` learns transforms when ``fit`` is true.
+
+        This is true when the data is standardized.
+        '''
+        return self.standardize
+
+    def preprocess(self, data, targets=None, fit=False, partial=False,
+            return_index=False):
         '''Process feature data into a numpy array.
+
+        This is computed in a single pass over the underlying arrays. Rows
+        are masked and aligned by integer position, and the output is written
+        into one preallocated buffer, including the time features.
         '''
         # If we're fitting, we record the column names.
         # Otherwise we ensure the targets have the expected columns.
-        if fit:
+        if fit and (not partial or self.columns is None):
             logger.debug('preprocess: recording columns')
             self.columns = list(targets.columns)
         elif targets is not None:
             logger.debug('preprocess: checking columns')
             assert set(targets.columns) == set(self.columns)
 
-        # Drop NaNs and infinities.
-        logger.debug('preprocess: dropping NaNs and infinities')
-        data = data.replace([np.inf, -np.inf], np.nan).dropna()
-        if targets is not None:
-            targets = targets.replace([np.inf, -np.inf], np.nan).dropna()
+        # Rows with NaNs or infinities are ignored.
+        logger.debug('preprocess: masking NaNs and infinities')
+        raw_data = data.to_numpy()
+        times = apollo.DatetimeIndex(data.index, name='time')
+        rows = np.isfinite(raw_data).all(axis=1)
 
-        # We only support 1-hour frequencies.
-        # For overlapping targets, take the mean.
         if targets is not None:
+            raw_targets = targets[self.columns].to_numpy()
+            if not np.issubdtype(raw_targets.dtype, np.floating):
+                raw_targets = raw_targets.astype('float64')
+            valid = np.isfinite(raw_targets).all(axis=1)
+            raw_targets = raw_targets[valid]
+            hours = apollo.DatetimeIndex(targets.index[valid]).floor('1h')
+            hours = _nanoseconds(hours)
+
+            # We only support 1-hour frequencies.
+            # For overlapping targets, take the mean.
             logger.debug('preprocess: aggregating targets')
-            targets = targets.groupby(targets.index.floor('1h')).mean()
-
-        # Ignore targets at night (optionally).
-        if targets is not None and self.daylight_only:
-            logger.debug('preprocess: dropping night time targets')
-            times = targets.index
-            (lat, lon) = self.center
-            targets = targets[apollo.is_daylight(times, lat, lon)]
-
-        # The indices for the data and targets may not match.
-        # We can only consider their intersection.
-        if targets is not None:
+            order = np.argsort(hours, kind='stable')
+            hours = hours[order]
+            starts = np.flatnonzero(np.diff(hours, prepend=hours[:1] - 1))
+            counts = np.diff(starts, append=len(hours))
+            hours = hours[starts]
+            if len(starts) != len(order):
+                raw_targets = np.add.reduceat(raw_targets[order], starts, axis=0) / counts[:, None]
+            else:
+                raw_targets = raw_targets[order]
+
+            # Ignore targets at night (optionally).
+            if self.daylight_only:
+                logger.debug('preprocess: masking night time targets')
+                (lat, lon) = self.center
+                day = apollo.is_daylight(hours, lat, lon).to_numpy()
+                hours = hours[day]
+                raw_targets = raw_targets[day]
+
+            # The indices for the data and targets may not match.
+            # We can only consider their intersection.
             logger.debug('preprocess: joining features and targets')
-            index = data.index.intersection(targets.index)
-            data = data.loc[index]
-            targets = targets.loc[index]
+            if len(hours) == 0:
+                rows[:] = False
+                pos = np.zeros(len(rows), dtype='int64')
+            else:
+                stamps = _nanoseconds(times)
+                pos = np.searchsorted(hours, stamps).clip(0, len(hours) - 1)
+                rows &= (hours[pos] == stamps)
+            rows = np.flatnonzero(rows)
+            raw_targets = raw_targets[pos[rows]]
         else:
-            index = data.index
+            raw_targets = None
+            rows = np.flatnonzero(rows)
+
+        index = times[rows]
+
+        # Allocate the output, with room for the time features.
+        n = raw_data.shape[1]
+        extra = 2 * self.add_time_of_day + 2 * self.add_time_of_year
+        dtype = np.result_type(raw_data.dtype, np.float32)
+        out = np.empty((len(rows), n + extra), dtype=dtype)
+        out[:, :n] = raw_data if len(rows) == len(raw_data) else raw_data[rows]
 
         # Scale the feature data (optionally).
-        if self.standardize:
+        # The scalers reject empty arrays, which need no scaling anyway.
+        if self.standardize and len(rows):
             logger.debug('preprocess: scaling features')
-            cols = list(data.columns)
-            raw_data = data[cols].to_numpy()
-            if fit: self.feature_scaler.fit(raw_data)
-            data[cols] = self.feature_scaler.transform(raw_data)
+            block = out[:, :n]
+            if fit and partial: self.feature_scaler.partial_fit(block)
+            elif fit: self.feature_scaler.fit(block)
+            block[...] = self.feature_scaler.transform(block)
 
         # Scale the target data (optionally).
-        if self.standardize and targets is not None:
+        if self.standardize and raw_targets is not None and len(rows):
             logger.debug('preprocess: scaling targets')
-            cols = self.columns
-            raw_targets = targets[cols].to_numpy()
-            if fit: self.target_scaler.fit(raw_targets)
-            targets[cols] = self.target_scaler.transform(raw_targets)
+            if fit and partial: self.target_scaler.partial_fit(raw_targets)
+            elif fit: self.target_scaler.fit(raw_targets)
+            raw_targets = self.target_scaler.transform(raw_targets)
 
         # Compute additional features (optionally).
         if self.add_time_of_day:
             logger.debug('preprocess: computing time-of-day')
-            data = data.join(apollo.time_of_day(index))
+            out[:, n:n+2] = apollo.time_of_day(index).to_numpy()
+            n += 2
         if self.add_time_of_year:
             logger.debug('preprocess: computing time-of-year')
-            data = data.join(apollo.time_of_year(index))
+            out[:, n:n+2] = apollo.time_of_year(index).to_numpy()
+            n += 2
 
         # We always return both, even if targets was not given.
-        # We must return numpy arrays.
-        logger.debug('preprocess: casting to numpy')
-        return data.to_numpy(), targets.to_numpy()
+        if return_index:
+            return out, raw_targets, index
+        return out, raw_targets
 
-    def postprocess(self, times, raw_predictions):
-        '''
+    def postprocess(self, raw_predictions, index):
+        '''Convert raw predictions into a :class:`pandas.DataFrame`.
         '''
         # Reconstruct the data frame.
         logger.debug('postprocess: constructing data frame')
-        cols = self.cols
-        index = apollo.DatetimeIndex(times, name='time')
+        cols = self.columns
+        index = apollo.DatetimeIndex(index, name='time')
         predictions = pd.DataFrame(raw_predictions, index=index, columns=cols)
 
         # Unscale the predictions.
@@ -378,7 +629,7 @@ class IrradianceModel(Model):
         if self.daylight_only:
             logger.debug('postprocess: setting night time to zero')
             (lat, lon) = self.center
-            night = not apollo.is_daylight(index, lat, lon)
-            predictions.loc[night, :] = 0
+            night = ~apollo.is_daylight(index, lat, lon)
+            predictions.loc[night.to_numpy(), :] = 0
 
         return predictions
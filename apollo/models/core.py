@@ -39,7 +39,7 @@ def list_models():
     '''
     base = apollo.path('models')
     base.mkdir(parents=True, exist_ok=True)
-    model_paths = base.glob('*.pickle')
+    model_paths = base.glob('*.model')
     model_stems = [p.stem for p in model_paths]
     return model_stems
 
@@ -99,25 +99,39 @@ def make_estimator(e):
     return estimator
 
 
-def load_model(path):
+def load_model(path, memmap=False):
     '''Load a model from a file.
 
+    Both model archives, see :mod:`apollo.models.archive`, and models pickled
+    by older versions of Apollo can be loaded.
+
     Arguments:
         path (str or pathlib.Path):
             A path to a model.
+        memmap (bool):
+            If true, the arrays of a model archive are memory-mapped rather
+            than read into memory. Memory-mapped arrays are read-only, so
+            this is only suitable for models which will not be trained
+            further. The default is false.
 
     Returns:
         apollo.models.Model:
             The model.
     '''
+    from apollo.models import archive
+    from apollo.models.base import Model
+
     path = Path(path)
-    fd = path.open('rb')
-    model = pickle.load(fd)
+    if archive.is_archive(path):
+        model = archive.load(path, memmap=memmap)
+    else:
+        with path.open('rb') as fd:
+            model = pickle.load(fd)
     assert isinstance(model, Model), f'{path} is not an Apollo model'
     return model
 
 
-def load_named_model(name):
+def load_named_model(name, **kwargs):
     '''Load a model from the Apollo database.
 
     Models in the Apollo database can be listed with :func:`list_models`
@@ -126,13 +140,15 @@ def load_named_model(name):
     Arguments:
         name (str):
             The name of the model.
+        **kwargs:
+            Forwarded to :func:`load_model`.
 
     Returns:
         apollo.models.Model:
             The model.
     '''
     path = apollo.path(f'models/{name}.model')
-    return load(path)
+    return load_model(path, **kwargs)
 
 
 def from_template(template, **kwargs):
@@ -203,4 +219,4 @@ def from_named_template(template_name, **kwargs):
             An untrained model.
     '''
     template = apollo.path(f'templates/{template_name}.json')
-    return from_template(template)
+    return from_template(template, **kwargs)
@@ -1,7 +1,13 @@
+import hashlib
+import json
 import logging
+import os
+import threading
+import zipfile
 
 import numpy as np
 import pandas as pd
+import xarray as xr
 
 import sklearn
 from sklearn.pipeline import make_pipeline
@@ -15,6 +21,35 @@ from apollo.models.base import IrradianceModel
 logger = logging.getLogger(__name__)
 
 
+# The layout of cached feature shards. Shards with a different layout, or
+# written before the layout was recorded, are recomputed.
+#
+# - 1: Columns named by the projected coordinates ``(variable, *z, y, x)``.
+# - 2: Columns named by cell offsets ``(variable, *z, dy, dx)``.
+_SHARD_FORMAT = 2
+
+
+def _plain(value):
+    '''Convert a numpy scalar to the equivalent Python scalar.
+    '''
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _source_signature(reftime):
+    '''The size and modification time of the netCDF file for a reftime.
+
+    Returns:
+        numpy.ndarray or None:
+            An array ``[size, mtime_ns]``, or ``None`` if the forecast is not
+            stored as a netCDF file.
+    '''
+    try:
+        stat = nam.nc_path(reftime).stat()
+    except FileNotFoundError:
+        return None
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype='int64')
+
+
 class NamModel(IrradianceModel):
     '''A concrete irradiance model using NAM forecasts.
     '''
@@ -24,6 +59,7 @@ class NamModel(IrradianceModel):
         features=nam.PLANAR_FEATURES,
         center=nam.ATHENS_LATLON,
         shape=12000,
+        feature_cache=True,
         **kwargs,
     ):
         '''Initialize a model.
@@ -36,6 +72,10 @@ class NamModel(IrradianceModel):
             shape (float or pair of float):
                 The height and width of the geographic area, measured in meters.
                 If a scalar, both height and width are the same size.
+            feature_cache (bool):
+                If true, the features extracted from each forecast are cached
+                in the Apollo database and shared by all models with the same
+                ``features``, ``center``, and ``shape``.
             **kwargs:
                 Forwarded to :class:`IrradianceModel` and :class:`Model`.
         '''
@@ -43,6 +83,151 @@ class NamModel(IrradianceModel):
         self.features = list(features)
         self.center = center
         self.shape = shape
+        self.feature_cache = feature_cache
+
+    @property
+    def data_spec(self):
+        '''The feature spec of this model, as a JSON string.
+
+        Models with the same ``features``, ``center``, and ``shape`` load the
+        same feature data.
+        '''
+        spec = {
+            'features': self.features,
+            'center': np.ravel(self.center).tolist(),
+            'shape': np.ravel(self.shape).tolist(),
+        }
+        return json.dumps(spec, sort_keys=True)
+
+    @property
+    def feature_cache_dir(self):
+        '''The directory of cached features for this model's feature spec.
+
+        Cached features are stored as one NPZ shard per reftime. Each shard
+        holds the sliced features of one forecast, before forecasts are
+        deduplicated, along with the size and modification time of its source
+        netCDF file. A shard is recomputed when its source or layout changes.
+        '''
+        key = hashlib.sha1(self.data_spec.encode()).hexdigest()
+        return apollo.path(f'NAM-NMM/features/{key}')
+
+    def _shard_path(self, reftime):
+        reftime = apollo.Timestamp(reftime)
+        return self.feature_cache_dir / f'{reftime:%Y%m%dT%H}.npz'
+
+    def _read_shard(self, reftime):
+        '''Read the cached features for a reftime, if they are up to date.
+
+        Returns:
+            tuple or None:
+                A tuple ``(forecast, matrix, columns)``, or ``None`` if the
+                cache has no valid shard for this reftime.
+        '''
+        source = _source_signature(reftime)
+        path = self._shard_path(reftime)
+        if source is None or not path.exists():
+            return None
+
+        try:
+            with np.load(path) as shard:
+                layout = int(shard['format']) if 'format' in shard else 1
+                if layout != _SHARD_FORMAT or not np.array_equal(shard['source'], source):
+                    logger.debug(f'load: stale features for {reftime}')
+                    return None
+                forecast = shard['forecast']
+                matrix = shard['matrix']
+                columns = [tuple(c) for c in json.loads(str(shard['columns']))]
+        except (OSError, EOFError, KeyError, ValueError, zipfile.BadZipFile) as e:
+            logger.warning(f'Ignoring unreadable feature cache {path}: {e}')
+            return None
+
+        return forecast, matrix, columns
+
+    def _write_shard(self, reftime, forecast, matrix, columns):
+        '''Write the features for a reftime to the cache.
+        '''
+        source = _source_signature(reftime)
+        if source is None:
+            return
+
+        path = self._shard_path(reftime)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.part')
+        with tmp.open('wb') as fd:
+            np.savez(
+                fd,
+                format=np.array(_SHARD_FORMAT),
+                source=source,
+                forecast=forecast,
+                matrix=matrix,
+                columns=np.array(json.dumps(columns)),
+            )
+        os.replace(tmp, path)
+
+    def _extract_features(self, reftimes):
+        '''Extract the features of each forecast.
+
+        Features are read from the cache when possible. Otherwise they are
+        extracted from the NAM store, and written to the cache if enabled.
+
+        Each feature is named by a tuple ``(variable, *z, dy, dx)``, where
+        ``z`` are any vertical coordinates of the variable and ``dy`` and
+        ``dx`` are the integer offsets of the grid cell from the center of the
+        area, as in :func:`apollo.nam.extract_sites`. The names do not depend
+        on the projected coordinates of the grid, so forecasts on grids that
+        differ by rounding noise share the same features.
+
+        Arguments:
+            reftimes (apollo.DatetimeIndex):
+                The reftimes of the forecasts.
+
+        Returns:
+            dict:
+                A mapping from reftime to a tuple ``(forecast, matrix,
+                columns)``, where ``matrix`` has the shape ``(forecast,
+                feature)``. Missing forecasts are omitted.
+        '''
+        use_cache = getattr(self, 'feature_cache', False)
+        shards = {}
+        missing = []
+        for reftime in reftimes:
+            shard = self._read_shard(reftime) if use_cache else None
+            if shard is None: missing.append(reftime)
+            else: shards[apollo.Timestamp(reftime)] = shard
+
+        logger.debug(f'load: {len(shards)} cached forecasts, {len(missing)} to extract')
+        if len(missing) == 0:
+            return shards
+
+        # Load the xarray data one forecast at a time, so that forecasts on
+        # slightly different grids are never aligned against each other.
+        # Only the features in the geographic area are read from disk.
+        logger.debug('load: loading netcdf')
+        region = (self.center, self.shape)
+        for reftime in missing:
+            try:
+                data = nam.open(reftime, variables=self.features, region=region, cache=False)
+            except nam.CacheMiss:
+                continue
+            data = data.astype('float32')
+            if 'time' in data.coords:
+                data = data.drop('time')
+
+            # Flatten the forecast into a (forecast, feature) matrix.
+            # The projected coordinates are replaced by cell offsets,
+            # so each column is named by a tuple `(variable, *z, dy, dx)`.
+            ny, nx = data.dims['y'], data.dims['x']
+            data = data.assign_coords(y=np.arange(ny) - ny // 2, x=np.arange(nx) - nx // 2)
+            forecast = data.isel(reftime=0).rename(forecast='time')
+            matrix, columns = nam.feature_matrix(forecast)
+            columns = [tuple(_plain(c) for c in col) for col in columns]
+            hours = forecast.time.values.astype('timedelta64[ns]')
+            reftime = apollo.Timestamp(reftime)
+            shards[reftime] = (hours, matrix, columns)
+            if use_cache:
+                self._write_shard(reftime, hours, matrix, columns)
+
+        return shards
 
     def load_data(self, index, dedupe_strategy='best'):
         '''Load input data for the given times.
@@ -50,73 +235,63 @@ class NamModel(IrradianceModel):
         Arguments:
             index (pandas.DatetimeIndex):
                 The times to forecast.
-            dedupe_strategy (str or int):
-                The strategy for selecting between duplicate forecasts.
-                **TODO:** Better documentation.
+            dedupe_strategy (str or int or dict):
+                The strategy for selecting between duplicate forecasts. This
+                is either ``'best'`` for the most recent forecast, an integer
+                ``k`` for the forecast made between ``6k`` and ``6k+6`` hours
+                prior, or a dict mapping such integers to weights for a
+                blend. See :func:`apollo.nam.select_forecasts`.
 
         Returns:
             pandas.DataFrame:
-                A data fram indexed by the forecast time.
+                A data fram indexed by the forecast time. The columns are
+                named by ``(variable, *z, dy, dx)`` tuples, see
+                :meth:`_extract_features`. Earlier versions named them by
+                projected coordinates instead. The order of the columns is
+                unchanged, so saved models remain valid.
         '''
         index = apollo.DatetimeIndex(index)
         index = index.floor('1h').unique()
 
-        # Load the xarray data.
-        logger.debug('load: loading netcdf')
-        reftimes = nam.times_to_reftimes(index)
-        data = nam.open(reftimes, on_miss='skip')
-        data = data[self.features]
-        data = data.astype('float32')
-
-        # Select geographic area.
-        logger.debug('load: slicing geographic area')
-        data = nam.slice_geo(data, center=self.center, shape=self.shape)
-
-        # Create a data frame.
-        # This will have a multi-index of `(reftime, forecast, x, y, *z)`,
-        # where `*z` is all of the different z-axes in the dataset.
-        logger.debug('load: converting to dataframe')
-        data = data.to_dataframe().drop(['lat', 'lon'], axis=1)
-
-        # Replace `reftime` and `forecast` levels with `time`.
-        logger.debug('load: reindex by time')
-        old_index = data.index
-        data = data.set_index('time', append=True)
-        data = data.reorder_levels(['time', *old_index.names])
-        data = data.reset_index('reftime', drop=True)
-        data = data.reset_index('forecast', drop=False)
-
-        # Filter to only the times requested.
-        data = data.loc[index]
-
-        # Handle duplicates.
+        # Get a (forecast, feature) matrix for each forecast.
+        reftimes = nam.times_to_reftimes(index, available_only=True)
+        shards = self._extract_features(reftimes)
+        if len(shards) == 0:
+            raise nam.CacheMiss('No applicable forecasts were found')
+
+        reftimes = sorted(shards)
+        columns = shards[reftimes[0]][2]
+        for reftime in reftimes:
+            if shards[reftime][2] != columns:
+                raise ValueError(f'features of forecast {reftime} do not match the others')
+
+        # Stack the forecasts into a (reftime, forecast, feature) array.
+        # Forecasts with missing hours are padded with NaN.
+        logger.debug('load: stacking forecasts')
+        features = xr.concat(
+            [
+                xr.DataArray(matrix, dims=('forecast', 'feature'), coords={'forecast': hours})
+                for (hours, matrix, _) in (shards[r] for r in reftimes)
+            ],
+            dim=pd.Index(apollo.DatetimeIndex(reftimes).tz_convert(None), name='reftime'),
+        )
+
+        # Select one forecast per time.
+        # This replaces the `reftime` and `forecast` dimensions with `time`.
         logger.debug(f'load: selecting forecast hour (dedupe_strategy={dedupe_strategy})')
-        if dedupe_strategy == 'best':
-            data = data.groupby(data.index) \
-                .apply(lambda g: g[g.forecast == g.forecast.min()]) \
-                .droplevel(0)
-        elif isinstance(dedupe_strategy, int) and dedupe_strategy < 6:
-            delta = pd.Timedelta('6h')
-            lo = delta * dedupe_strategy
-            hi = lo + delta
-            data = data.groupby(data.index) \
-                .apply(lambda g: g[(lo <= g.forecast) & (g.forecast < hi)]) \
-                .droplevel(0)
-        else:
-            raise ValueError(f'invalid dedupe_strategy {repr(dedupe_strategy)}')
-
-        # We no longer need the forecast hour.
-        data = data.drop('forecast', axis=1)
-
-        # Unstack until we're indexed by time alone, then flatten the columns.
-        logger.debug('load: unstacking geographic indices')
-        while 2 < len(data.index.levels):
-            data = data.unstack()
-        data = data.unstack()
-        data.columns = data.columns.to_flat_index()
-
-        # The index has lost its timezone information. Fix it.
-        data.index = apollo.DatetimeIndex(data.index)
+        data = nam.select_forecasts(features.to_dataset(name='features'), index, dedupe_strategy)
+        matrix = np.ascontiguousarray(data['features'].values, dtype='float32')
+        index = apollo.DatetimeIndex(data.time.values, name='time')
+
+        # Drop times with missing data, so that every row can be predicted.
+        complete = np.isfinite(matrix).all(axis=1)
+        if not complete.all():
+            logger.debug(f'load: dropping {(~complete).sum()} incomplete rows')
+            matrix = matrix[complete]
+            index = index[complete]
+
+        columns = pd.Index(columns, tupleize_cols=False)
+        data = pd.DataFrame(matrix, index=index, columns=columns, copy=False)
 
         # We're done.
         return data
@@ -15,7 +15,8 @@ The dataset lives remotely. A live feed is provided by NCEP and an 11
 month archive is provided by NCDC (both are divisions of NOAA). This
 module caches the data locally, allowing us to build a larger archive.
 The remote dataset is provided in GRIB format, while this module uses
-the netCDF format for its local storage.
+the netCDF format for its local storage. Alternatively, the local store may
+be a single Zarr store holding every reftime; see :func:`zarr_path`.
 
 This module provides access to only a subset of the NAM-NMM dataset.
 The geographic region is reduced and centered around Georgia, and only
@@ -29,17 +30,28 @@ measuring the axis, e.g. ``z_ISBL`` for isobaric pressure levels.
 
 import builtins
 import contextlib
+import hashlib
+import json
 import logging
-from functools import reduce
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache, partial, reduce
 from pathlib import Path
 from time import sleep
 from tempfile import TemporaryDirectory
 
-import cartopy.crs as ccrs
+import netCDF4
 import numpy as np
 import pandas as pd
 import requests
 import xarray as xr
+from xarray.backends.locks import HDF5_LOCK
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 import apollo
 
@@ -61,25 +73,41 @@ FULL_FORECAST_PERIOD = tuple(range(36)) + tuple(range(36, 85, 3))
 FORECAST_PERIOD = FULL_FORECAST_PERIOD[:37]
 
 
-#: A Lambert conformal map projection of NAM grid 218.
-#:
-#: NOAA numbers the differnt maps used by their their products. The specific
-#: map used by NAM forecasts is number 218.
-#:
-#: This is a Lambert conformal conic projection over a spherical globe covering
-#: the contiguous United States.
-#:
-#: .. seealso::
-#:     `Master List of NCEP Storage Grids <http://www.nco.ncep.noaa.gov/pmb/docs/on388/tableb.html#GRID218>`_
-NAM218 = ccrs.LambertConformal(
-    central_latitude=25,
-    central_longitude=265,
-    standard_parallels=(25, 25),
-
-    # The default cartopy globe is WGS 84, but
-    # NAM assumes a spherical globe with radius 6,371.229 km
-    globe=ccrs.Globe(ellipse=None, semimajor_axis=6371229, semiminor_axis=6371229),
-)
+@lru_cache(maxsize=None)
+def _nam218():
+    '''A Lambert conformal map projection of NAM grid 218.
+
+    NOAA numbers the differnt maps used by their their products. The specific
+    map used by NAM forecasts is number 218.
+
+    This is a Lambert conformal conic projection over a spherical globe covering
+    the contiguous United States. It is available as :data:`NAM218`, and it is
+    constructed on first use so that Cartopy is only imported when needed.
+
+    .. seealso::
+        `Master List of NCEP Storage Grids <http://www.nco.ncep.noaa.gov/pmb/docs/on388/tableb.html#GRID218>`_
+
+    Returns:
+        cartopy.crs.LambertConformal:
+            The projection.
+    '''
+    import cartopy.crs as ccrs
+    return ccrs.LambertConformal(
+        central_latitude=25,
+        central_longitude=265,
+        standard_parallels=(25, 25),
+
+        # The default cartopy globe is WGS 84, but
+        # NAM assumes a spherical globe with radius 6,371.229 km
+        globe=ccrs.Globe(ellipse=None, semimajor_axis=6371229, semiminor_axis=6371229),
+    )
+
+
+def __getattr__(name):
+    # `NAM218` is constructed lazily, see `_nam218`.
+    if name == 'NAM218':
+        return _nam218()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 #: The latitude and longitude of a solar array in Athens, GA.
@@ -113,6 +141,73 @@ PLANAR_FEATURES = (
 )
 
 
+#: The variables kept from the raw GRIB files, and their names in Apollo.
+#:
+#: The keys are the names assigned by PyNIO when reading NAM GRIBs and the
+#: values are the normalized names used in the local store.
+GRIB_FEATURES = {
+    # Data variables
+    'DLWRF_P0_L1_GLC0':  'DLWRF_SFC',    'DSWRF_P0_L1_GLC0':   'DSWRF_SFC',
+    'PRES_P0_L1_GLC0':   'PRES_SFC',
+    'PRES_P0_L6_GLC0':   'PRES_MWSL',    'PRES_P0_L7_GLC0':    'PRES_TRO',
+    'TCDC_P0_L200_GLC0': 'TCC_EATM',     'TMP_P0_2L108_GLC0':  'TMP_SPDY',
+    'TMP_P0_L1_GLC0':    'TMP_SFC',      'TMP_P0_L100_GLC0':   'TMP_ISBL',
+    'TMP_P0_L103_GLC0':  'TMP_HTGL',     'TMP_P0_L7_GLC0':     'TMP_TRO',
+    'RH_P0_2L104_GLC0':  'RH_SIGY',      'RH_P0_2L108_GLC0':   'RH_SPDY',
+    'RH_P0_L100_GLC0':   'RH_ISBL',
+    'RH_P0_L4_GLC0':     'RH_0DEG',      'UGRD_P0_2L108_GLC0': 'UGRD_SPDY',
+    'UGRD_P0_L100_GLC0': 'UGRD_ISBL',    'UGRD_P0_L103_GLC0':  'UGRD_HTGL',
+    'UGRD_P0_L220_GLC0': 'UGRD_TOA',     'UGRD_P0_L6_GLC0':    'UGRD_MWSL',
+    'UGRD_P0_L7_GLC0':   'UGRD_TRO',     'VGRD_P0_2L108_GLC0': 'VGRD_SPDY',
+    'VGRD_P0_L100_GLC0': 'VGRD_ISBL',    'VGRD_P0_L103_GLC0':  'VGRD_HTGL',
+    'VGRD_P0_L220_GLC0': 'VGRD_TOA',     'VGRD_P0_L6_GLC0':    'VGRD_MWSL',
+    'VGRD_P0_L7_GLC0':   'VGRD_TRO',     'VIS_P0_L1_GLC0':     'VIS_SFC',
+    'LHTFL_P0_L1_GLC0':  'LHTFL_SFC',    'SHTFL_P0_L1_GLC0':   'SHTFL_SFC',
+    'REFC_P0_L200_GLC0': 'REFC_EATM',    'REFD_P0_L103_GLC0':  'REFD_HTGL',
+    'REFD_P0_L105_GLC0': 'REFD_HYBL',    'VVEL_P0_L100_GLC0':  'VVEL_ISBL',
+    'HGT_P0_L1_GLC0':    'HGT_SFC',      'HGT_P0_L100_GLC0':   'HGT_ISBL',
+    'HGT_P0_L2_GLC0':    'HGT_CBL',      'HGT_P0_L220_GLC0':   'HGT_TOA',
+    'HGT_P0_L245_GLC0':  'HGT_LLTW',     'HGT_P0_L4_GLC0':     'HGT_0DEG',
+    'PWAT_P0_L200_GLC0': 'PWAT_EATM',    'TKE_P0_L100_GLC0':   'TKE_ISBL',
+
+    # Coordinate variables
+    'lv_HTGL1':  'z_HTGL1',    'lv_HTGL3':  'z_HTGL2',
+    'lv_HTGL6':  'z_HTGL3',    'lv_ISBL0':  'z_ISBL',
+    'lv_SPDL2':  'z_SPDY',
+    'xgrid_0':   'x',          'ygrid_0':   'y',
+    'gridlat_0': 'lat',        'gridlon_0': 'lon',
+}
+
+
+#: Patterns matching the level descriptions used in NOMADS ``.idx`` inventories.
+#:
+#: The keys are the GRIB2 level codes that appear in PyNIO variable names, e.g.
+#: the ``L100`` in ``TMP_P0_L100_GLC0`` for isobaric levels. A ``2`` prefix
+#: marks a layer between two levels.
+IDX_LEVELS = {
+    'L1':    r'surface',
+    'L2':    r'cloud base',
+    'L4':    r'0C isotherm',
+    'L6':    r'max wind',
+    'L7':    r'tropopause',
+    'L100':  r'[\d.]+ mb',
+    'L103':  r'[\d.]+ m above ground',
+    'L105':  r'\d+ hybrid level',
+    'L200':  r'entire atmosphere.*',
+    'L220':  r'planetary boundary layer',
+    'L245':  r'lowest level of the wet bulb zero',
+    '2L104': r'[\d.]+-[\d.]+ sigma layer',
+    '2L108': r'\d+-\d+ mb above ground',
+}
+
+
+# PyNIO numbers the distinct sets of levels for these level types, giving
+# coordinates like ``lv_HTGL6``. The numbering depends on every variable in
+# the file, so subset downloads must keep all messages of these types for the
+# coordinate names in :data:`GRIB_FEATURES` to remain valid.
+_NUMBERED_LEVELS = ('L100', 'L103', '2L108')
+
+
 def proj_coords(lats, lons):
     '''Transform geographic coordinates into the NAM218 projection.
 
@@ -138,19 +233,111 @@ def proj_coords(lats, lons):
             A pair of arrays ``(x, y)`` that give the x and y coordinates
             respectivly, measured in meters.
     '''
+    import cartopy.crs as ccrs
     lats = np.asarray(lats)
     lons = np.asarray(lons)
     unproj = ccrs.PlateCarree()
-    coords = NAM218.transform_points(unproj, lons.flatten(), lats.flatten())
+    coords = _nam218().transform_points(unproj, lons.flatten(), lats.flatten())
     x, y = coords[...,0], coords[...,1]
     x = x.reshape(lats.shape)
     y = y.reshape(lats.shape)
     return x, y
 
 
+# The process-level memo of slice windows computed by :func:`slice_indices`,
+# keyed by the grid hash, center, and shape. It is backed by the slices table
+# of the catalog. The lock is held while a missing window is looked up,
+# computed, and persisted, so each window is computed and written only once.
+_slice_cache = {}
+_slice_cache_lock = threading.Lock()
+
+
+def _grid_hash(x, y):
+    '''Compute a hash identifying a grid by its x and y coordinates.
+    '''
+    grid = hashlib.sha1()
+    grid.update(np.asarray(x, dtype='float64').tobytes())
+    grid.update(np.asarray(y, dtype='float64').tobytes())
+    return grid.hexdigest()
+
+
+def _compute_slice_indices(x, y, center, shape):
+    '''Compute the integer window of a geographic area on a grid.
+
+    See :func:`slice_indices`.
+    '''
+    # Convert the center from lat-lon to x-y.
+    lat, lon = center
+    cx, cy = proj_coords(lat, lon)
+
+    # Round x and y to the nearest grid point.
+    cx = x[np.abs(x - cx).argmin()]
+    cy = y[np.abs(y - cy).argmin()]
+
+    # Compute the slice bounds from the shape.
+    # The distance between grid cells (axes x and y) may not be exactly 12km.
+    # We add 1.5km to the deltas to ensure we select the full area.
+    x_shape, y_shape = shape
+    x_delta = x_shape / 2 + 1500
+    y_delta = y_shape / 2 + 1500
+
+    def window(coord, c, delta):
+        i = np.flatnonzero((c - delta <= coord) & (coord <= c + delta))
+        return int(i.min()), int(i.max()) + 1
+
+    return window(x, cx, x_delta) + window(y, cy, y_delta)
+
+
+def slice_indices(data, center, shape):
+    '''Compute the integer window of a geographic area within a dataset.
+
+    The window depends only on the grid, the center, and the shape. It is
+    computed once per grid and memoized, both in-process and in the catalog of
+    the local store, so it can be reused against any dataset on the same grid.
+    Looking up the catalog never scans the store, so this is safe to call
+    while datasets are being opened in parallel.
+
+    Arguments:
+        data (xarray.Dataset):
+            A dataset with coordinates ``x`` and ``y`` measured in meters
+            relative to the NAM218 projection.
+        center (pair of float):
+            The center of the slice, as a latitude-longited pair.
+        shape (float or pair of float):
+            The height and width of the geographic area, measured in meters. If
+            a scalar, both height and width are the same size.
+
+    Returns:
+        dict:
+            A mapping from ``'x'`` and ``'y'`` to :class:`slice` objects,
+            suitable for :meth:`xarray.Dataset.isel`.
+    '''
+    if np.isscalar(shape): shape = (shape, shape)
+    x = np.asarray(data.indexes['x'])
+    y = np.asarray(data.indexes['y'])
+    grid = _grid_hash(x, y)
+    key = (grid, float(center[0]), float(center[1]), float(shape[0]), float(shape[1]))
+
+    with _slice_cache_lock:
+        bounds = _slice_cache.get(key)
+        if bounds is None:
+            bounds = _load_slice_indices(key)
+        if bounds is None:
+            logger.debug(f'computing slice indices for grid {grid[:8]}')
+            bounds = _compute_slice_indices(x, y, center, shape)
+            _save_slice_indices(key, bounds)
+        _slice_cache[key] = bounds
+
+    (x_start, x_stop, y_start, y_stop) = bounds
+    return {'x': slice(x_start, x_stop), 'y': slice(y_start, y_stop)}
+
+
 def slice_geo(data, center, shape):
     '''Slice a dataset along geographic coordinates.
 
+    The slice is taken by integer position using the memoized window from
+    :func:`slice_indices`.
+
     Arguments:
         data (xarray.Dataset):
             The dataset to slice. It should have coordinates ``x`` and ``y``
@@ -165,27 +352,7 @@ def slice_geo(data, center, shape):
         Dataset:
             The sliced dataset.
     '''
-    # Convert the center from lat-lon to x-y.
-    lat, lon = center
-    x, y = proj_coords(lat, lon)
-
-    # Round x and y to the nearest index.
-    center_data = data.sel(x=x, y=y, method='nearest')
-    x = center_data.x.values
-    y = center_data.y.values
-
-    # Compute the slice bounds from the shape.
-    # The distance between grid cells (axes x and y) may not be exactly 12km.
-    # We add 1.5km to the deltas to ensure we select the full area.
-    if np.isscalar(shape): shape = (shape, shape)
-    x_shape, y_shape = shape
-    x_delta = x_shape / 2 + 1500
-    y_delta = y_shape / 2 + 1500
-    x_slice = slice(x - x_delta, x + x_delta)
-    y_slice = slice(y - y_delta, y + y_delta)
-
-    # Perform the selection.
-    return data.sel(x=x_slice, y=y_slice)
+    return data.isel(slice_indices(data, center, shape))
 
 
 class CacheMiss(Exception):
@@ -224,7 +391,7 @@ def grib_url(reftime, forecast):
     return url_fmt.format(ref=reftime, forecast=forecast)
 
 
-def grib_path(reftime, forecast):
+def grib_path(reftime, forecast, subset=False):
     '''The path to a GRIB for the given reference and forecast times.
 
     GRIB forecasts are downloaded to this path and may be deleted once the
@@ -235,6 +402,10 @@ def grib_path(reftime, forecast):
             The reference time.
         forecast (int):
             The forecast hour.
+        subset (bool):
+            If true, return the path for a GRIB holding only the messages
+            used by Apollo. Subsets are kept apart from complete GRIBs so that
+            one is never mistaken for the other.
 
     Returns:
         pathlib.Path:
@@ -242,7 +413,10 @@ def grib_path(reftime, forecast):
     '''
     reftime = apollo.Timestamp(reftime).floor('6h')
     prefix_fmt = 'nam.{ref.year:04d}{ref.month:02d}{ref.day:02d}'
-    filename_fmt = 'nam.t{ref.hour:02d}z.awphys{forecast:02d}.tm00.grib'
+    if subset:
+        filename_fmt = 'nam.t{ref.hour:02d}z.awphys{forecast:02d}.tm00.subset.grib'
+    else:
+        filename_fmt = 'nam.t{ref.hour:02d}z.awphys{forecast:02d}.tm00.grib'
     prefix = prefix_fmt.format(forecast=forecast, ref=reftime)
     filename = filename_fmt.format(forecast=forecast, ref=reftime)
     return apollo.path(f'NAM-NMM/{prefix}/{filename}')
@@ -268,9 +442,925 @@ def nc_path(reftime):
     return apollo.path(f'NAM-NMM/{prefix}/{filename}')
 
 
-def _download_grib(reftime, forecast, max_tries=8, timeout=10, fail_fast=False):
+#: The default storage encoding policy for netCDF files in the local store.
+#:
+#: - ``complevel``: The zlib compression level, 0 to 9. Zero disables
+#:   compression.
+#: - ``shuffle``: Whether to apply the HDF5 byte shuffle filter before
+#:   compression.
+#: - ``pack``: The on-disk type of data variables, either ``'float32'`` or
+#:   ``'int16'``. The latter linearly packs each variable into 16 bits using
+#:   the ``scale_factor`` and ``add_offset`` attributes.
+#: - ``tile``: The chunk size along the x and y axes. Chunks always span every
+#:   forecast hour of a single reftime and z-level, matching our access pattern
+#:   of reading all forecasts for a small geographic window.
+ENCODING_POLICY = {
+    'complevel': 4,
+    'shuffle': True,
+    'pack': 'float32',
+    'tile': 16,
+}
+
+
+def storage_encoding(ds, **policy):
+    '''Compute the netCDF encoding of a dataset under the storage policy.
+
+    Only data variables are encoded; coordinates use the xarray defaults.
+
+    Arguments:
+        ds (xarray.Dataset):
+            The dataset to be written.
+        **policy:
+            Overrides for :data:`ENCODING_POLICY`.
+
+    Returns:
+        dict:
+            An ``encoding`` argument for :meth:`xarray.Dataset.to_netcdf`.
+    '''
+    policy = {**ENCODING_POLICY, **policy}
+    pack = policy['pack']
+    if pack not in ('float32', 'int16'):
+        raise ValueError(f'Unknown packing: {repr(pack)}')
+
+    encoding = {}
+    for name, var in ds.data_vars.items():
+        chunks = []
+        for (dim, size) in zip(var.dims, var.shape):
+            if dim == 'forecast': chunks.append(size)
+            elif dim in ('x', 'y'): chunks.append(min(size, policy['tile']))
+            else: chunks.append(1)
+
+        enc = {
+            'zlib': 0 < policy['complevel'],
+            'complevel': policy['complevel'],
+            'shuffle': policy['shuffle'],
+            'chunksizes': tuple(chunks),
+            'dtype': 'float32',
+        }
+
+        # Packing maps [lo, hi] onto [-32767, 32767], reserving -32768 as the
+        # fill value for missing data.
+        if pack == 'int16':
+            lo = float(var.min())
+            hi = float(var.max())
+            if not np.isfinite(lo) or not np.isfinite(hi): lo = hi = 0.0
+            enc['dtype'] = 'int16'
+            enc['add_offset'] = (hi + lo) / 2
+            enc['scale_factor'] = (hi - lo) / 65534 or 1.0
+            enc['_FillValue'] = np.int16(-32768)
+
+        encoding[name] = enc
+    return encoding
+
+
+def write_nc(ds, path, **policy):
+    '''Write a dataset to the local store under the storage policy.
+
+    The file is written next to its destination then renamed into place, so
+    a dataset may be rewritten to the path it was read from once it has been
+    loaded into memory.
+
+    The ``time`` coordinate is not persisted because :func:`open`
+    reconstructs it from ``reftime`` and ``forecast``.
+
+    Arguments:
+        ds (xarray.Dataset):
+            The dataset to write.
+        path (str or pathlib.Path):
+            The destination.
+        **policy:
+            Overrides for :data:`ENCODING_POLICY`.
+    '''
+    path = Path(path)
+    part = path.with_name(path.name + '.part')
+    if 'time' in ds.coords:
+        ds = ds.drop('time')
+    encoding = storage_encoding(ds, **policy)
+    logger.info(f'writing {path}')
+    ds.to_netcdf(part, encoding=encoding)
+    part.rename(path)
+
+    # Keep the catalog and dataset cache in sync when writing into the store.
+    if ds.reftime.size == 1:
+        reftime = apollo.Timestamp(ds.reftime.values.reshape(-1)[0])
+        if nc_path(reftime) == path.resolve():
+            update_catalog(reftime)
+            clear_cache(reftime)
+
+
+def reencode(path, **policy):
+    '''Rewrite a netCDF file in place under the storage policy.
+
+    The file is loaded into memory and closed before it is rewritten with
+    :func:`write_nc`, so this is safe for any file in the local store.
+
+    Arguments:
+        path (str or pathlib.Path):
+            The file to rewrite.
+        **policy:
+            Overrides for :data:`ENCODING_POLICY`.
+    '''
+    path = Path(path)
+    ds = _open_dataset([path])
+    ds = ds.load()
+    ds.close()
+    write_nc(ds, path, **policy)
+
+
+def _get_store(store=None):
+    '''Resolve the backend of the local store.
+
+    Arguments:
+        store ('netcdf' or 'zarr' or None):
+            The backend. If ``None``, it is read from the ``APOLLO_NAM_STORE``
+            environment variable, defaulting to ``'netcdf'``.
+
+    Returns:
+        str:
+            Either ``'netcdf'`` or ``'zarr'``.
+    '''
+    store = store or os.environ.get('APOLLO_NAM_STORE', 'netcdf')
+    if store not in ('netcdf', 'zarr'):
+        raise ValueError(f'Unknown NAM store: {repr(store)}')
+    return store
+
+
+def zarr_path():
+    '''The path to the Zarr store.
+
+    The Zarr store is an alternative to the netCDF store, holding every
+    reftime in a single appendable array store. It is used when the store
+    is set to ``'zarr'``, e.g. with the ``APOLLO_NAM_STORE`` environment
+    variable. This store does not necessarily exist.
+
+    Returns:
+        pathlib.Path:
+            The local path to the Zarr store, which may not exist.
+    '''
+    return apollo.path('NAM-NMM.zarr')
+
+
+def _zarr_reftimes():
+    '''List the reftimes in the Zarr store.
+
+    Returns:
+        apollo.DatetimeIndex:
+            The reftimes in the order they are stored.
+    '''
+    path = zarr_path()
+    if not path.exists():
+        return apollo.DatetimeIndex([], name='reftime')
+    with xr.open_zarr(str(path)) as ds:
+        return apollo.DatetimeIndex(ds.reftime.values, name='reftime')
+
+
+def _zarr_write(ds, **policy):
+    '''Write a forecast into the Zarr store.
+
+    The forecast is appended along the reftime dimension. If the store already
+    holds the reftime, that region is overwritten instead.
+
+    Arguments:
+        ds (xarray.Dataset):
+            A dataset for a single reftime, as written by :func:`download`.
+        **policy:
+            Overrides for :data:`ENCODING_POLICY`. Only the ``tile`` size is
+            used; Zarr applies its own compressor.
+    '''
+    path = zarr_path()
+    if 'time' in ds.coords:
+        ds = ds.drop('time')
+
+    # Drop the netCDF encoding, which does not apply to Zarr.
+    ds = ds.copy()
+    for var in ds.data_vars.values():
+        var.encoding = {
+            k: v for k, v in var.encoding.items()
+            if k in ('units', 'calendar', 'dtype', '_FillValue')
+        }
+
+    if not path.exists():
+        logger.info(f'creating {path}')
+        encoding = {
+            name: {'chunks': enc['chunksizes']}
+            for name, enc in storage_encoding(ds, **policy).items()
+        }
+        ds.to_zarr(str(path), mode='w-', encoding=encoding)
+        return
+
+    reftime = apollo.Timestamp(ds.reftime.values[0])
+    clear_cache(reftime)
+    existing = _zarr_reftimes()
+    if reftime in existing:
+        logger.info(f'overwriting {reftime} in {path}')
+        i = existing.get_loc(reftime)
+        ds = ds.drop([v for v in ds.variables if 'reftime' not in ds[v].dims])
+        ds.to_zarr(str(path), region={'reftime': slice(i, i+1)})
+    else:
+        logger.info(f'appending {reftime} to {path}')
+        ds.to_zarr(str(path), append_dim='reftime')
+
+
+def _open_zarr(reftimes, chunks=None):
+    '''Open the given reftimes from the Zarr store.
+
+    Arguments:
+        reftimes (list of timestamp):
+            The reftimes to open. They must exist in the store.
+        chunks (dict or None):
+            The dask chunk sizes for each dimension. The default is to use
+            the chunks on disk.
+
+    Returns:
+        xarray.Dataset:
+            The dataset, sorted by reftime.
+    '''
+    ds = xr.open_zarr(str(zarr_path()), chunks=chunks or 'auto')
+    index = pd.DatetimeIndex(reftimes).tz_convert(None)
+    return ds.sel(reftime=index).sortby('reftime')
+
+
+def catalog_path():
+    '''The path to the catalog of the netCDF store.
+
+    The catalog is an SQLite database recording every netCDF forecast in the
+    local store with its path, variables, grid hash, and size. It allows
+    reftimes to be resolved without walking the store. The catalog is built
+    on first use by scanning the store, and is kept up to date by
+    :func:`download` and :func:`write_nc`. Entries for files removed by other
+    means are dropped when they are listed, and files added by other means are
+    cataloged when they are opened. It can be rebuilt at any time with
+    :func:`rebuild_catalog` or ``apollo nam catalog``.
+
+    Returns:
+        pathlib.Path:
+            The local path to the catalog, which may not exist.
+    '''
+    return apollo.path('NAM-NMM/catalog.sqlite')
+
+
+def _hours(reftime):
+    '''Convert a reftime into hours since the Unix epoch, as in the store.
+    '''
+    return apollo.Timestamp(reftime).floor('6h').value // (3600 * 10**9)
+
+
+# The schema of the catalog. The slices table is independent of the store,
+# so it may exist before the forecasts table is built.
+_FORECASTS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS forecasts (
+        reftime   INTEGER PRIMARY KEY,  -- hours since 1970-01-01T00:00
+        path      TEXT NOT NULL,
+        variables TEXT NOT NULL,        -- JSON list of variable names
+        grid_hash TEXT NOT NULL,        -- SHA-1 of the x and y coordinates
+        size      INTEGER NOT NULL,     -- file size in bytes
+        mtime     REAL NOT NULL         -- file modification time
+    )
+'''
+
+_SLICES_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS slices (
+        grid_hash TEXT NOT NULL,        -- SHA-1 of the x and y coordinates
+        lat       REAL NOT NULL,        -- center latitude
+        lon       REAL NOT NULL,        -- center longitude
+        x_shape   REAL NOT NULL,        -- extent along x in meters
+        y_shape   REAL NOT NULL,        -- extent along y in meters
+        x_start   INTEGER NOT NULL,
+        x_stop    INTEGER NOT NULL,
+        y_start   INTEGER NOT NULL,
+        y_stop    INTEGER NOT NULL,
+        PRIMARY KEY (grid_hash, lat, lon, x_shape, y_shape)
+    )
+'''
+
+
+# Guards building the catalog, so concurrent callers in this process wait for
+# one scan of the store rather than each starting their own.
+_catalog_lock = threading.Lock()
+
+
+def _connect_catalog():
+    '''Open a connection to the catalog, building it if it does not exist.
+
+    Returns:
+        sqlite3.Connection:
+            A connection to the catalog.
+    '''
+    with _catalog_lock:
+        conn = _connect_slices()
+        is_new = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'forecasts'"
+        ).fetchone() is None
+        conn.execute(_FORECASTS_SCHEMA)
+        if is_new:
+            _scan_catalog(conn)
+    return conn
+
+
+def _connect_slices():
+    '''Open a connection to the catalog for the slices table only.
+
+    Unlike :func:`_connect_catalog`, this never builds the forecasts table, so
+    it never scans the store.
+
+    Returns:
+        sqlite3.Connection:
+            A connection to the catalog.
+    '''
+    path = catalog_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), timeout=60)
+    conn.execute(_SLICES_SCHEMA)
+    return conn
+
+
+def _catalog_entry(reftime, path):
+    '''Describe a netCDF forecast as a row of the catalog.
+    '''
+    with netCDF4.Dataset(path, 'r') as nc:
+        variables = sorted(nc.variables.keys())
+        grid = _grid_hash(nc['x'][:], nc['y'][:])
+    stat = path.stat()
+    return (
+        _hours(reftime),
+        str(path),
+        json.dumps(variables),
+        grid,
+        stat.st_size,
+        stat.st_mtime,
+    )
+
+
+def _scan_catalog(conn):
+    '''Replace the contents of the catalog with a scan of the netCDF store.
+    '''
+    logger.info(f'building catalog of the netCDF store')
+    rows = []
+    for reftime in _scan_available_forecasts():
+        path = nc_path(reftime)
+        try:
+            rows.append(_catalog_entry(reftime, path))
+        except (OSError, IndexError) as err:
+            logger.warning(f'cannot catalog {path}: {err}')
+    with conn:
+        conn.execute('DELETE FROM forecasts')
+        conn.executemany('INSERT INTO forecasts VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+
+def rebuild_catalog():
+    '''Rebuild the catalog of the netCDF store from scratch.
+
+    This is only required to list forecasts added to the store by means other
+    than Apollo before they are first opened.
+    '''
+    conn = _connect_catalog()
+    try:
+        _scan_catalog(conn)
+    finally:
+        conn.close()
+    clear_cache()
+
+
+def update_catalog(reftime):
+    '''Update the catalog entry for a single reftime from the netCDF store.
+
+    If the netCDF for the reftime does not exist, its entry is removed.
+
+    Arguments:
+        reftime (timestamp):
+            The reftime to update.
+    '''
+    path = nc_path(reftime)
+    conn = _connect_catalog()
+    try:
+        with conn:
+            if path.exists():
+                row = _catalog_entry(reftime, path)
+                conn.execute('INSERT OR REPLACE INTO forecasts VALUES (?, ?, ?, ?, ?, ?)', row)
+            else:
+                conn.execute('DELETE FROM forecasts WHERE reftime = ?', (_hours(reftime),))
+    finally:
+        conn.close()
+
+
+def _catalog_reftimes(start=None, stop=None):
+    '''Query the catalog for the reftimes in the netCDF store.
+
+    Arguments:
+        start (timestamp or None):
+            If given, only reftimes at or after this time are returned.
+        stop (timestamp or None):
+            If given, only reftimes at or before this time are returned.
+
+    Returns:
+        apollo.DatetimeIndex:
+            The sorted reftimes.
+    '''
+    lo = -2**62 if start is None else _hours(start)
+    hi = 2**62 if stop is None else _hours(stop)
+    conn = _connect_catalog()
+    try:
+        rows = conn.execute(
+            'SELECT reftime FROM forecasts WHERE reftime BETWEEN ? AND ? ORDER BY reftime',
+            (lo, hi),
+        ).fetchall()
+    finally:
+        conn.close()
+    hours = np.array([r[0] for r in rows], dtype='int64')
+    return apollo.DatetimeIndex(hours.astype('datetime64[h]'), name='reftime')
+
+
+def _catalog_grids(reftimes):
+    '''Query the catalog for the grid hashes of the given reftimes.
+
+    Arguments:
+        reftimes (list of timestamp):
+            The reftimes of interest.
+
+    Returns:
+        set of str:
+            The distinct grid hashes among the reftimes in the catalog.
+    '''
+    hours = {_hours(r) for r in reftimes}
+    conn = _connect_catalog()
+    try:
+        rows = conn.execute(
+            'SELECT reftime, grid_hash FROM forecasts WHERE reftime BETWEEN ? AND ?',
+            (min(hours), max(hours)),
+        ).fetchall()
+    finally:
+        conn.close()
+    return {grid for (reftime, grid) in rows if reftime in hours}
+
+
+def _load_slice_indices(key):
+    '''Look up a slice window persisted in the catalog.
+
+    Arguments:
+        key (tuple):
+            The tuple ``(grid_hash, lat, lon, x_shape, y_shape)``.
+
+    Returns:
+        tuple or None:
+            The window ``(x_start, x_stop, y_start, y_stop)``, or ``None``.
+    '''
+    try:
+        conn = _connect_slices()
+        try:
+            row = conn.execute(
+                'SELECT x_start, x_stop, y_start, y_stop FROM slices '
+                'WHERE grid_hash = ? AND lat = ? AND lon = ? AND x_shape = ? AND y_shape = ?',
+                key,
+            ).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error as err:
+        logger.debug(f'cannot read slice indices from catalog: {err}')
+        return None
+    return None if row is None else tuple(row)
+
+
+def _save_slice_indices(key, bounds):
+    '''Persist a slice window in the catalog.
+
+    Failures are logged and ignored; the window is merely recomputed later.
+    '''
+    try:
+        conn = _connect_slices()
+        try:
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO slices VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    key + tuple(bounds),
+                )
+        finally:
+            conn.close()
+    except sqlite3.Error as err:
+        logger.debug(f'cannot write slice indices to catalog: {err}')
+
+
+# The process-level cache of datasets returned by :func:`open`, keyed by the
+# store and the reftimes. The most recently used entries are at the end.
+_dataset_cache = OrderedDict()
+_dataset_cache_maxsize = 16
+_dataset_cache_lock = threading.Lock()
+
+
+def set_cache_options(maxsize=None, max_open_files=None):
+    '''Configure the cache of opened datasets.
+
+    Calls to :func:`open` for the same set of reftimes share the same
+    underlying dataset, so repeated calls skip reading and combining the
+    coordinates of every file. The least recently used datasets are evicted
+    when the cache is full.
+
+    Arguments:
+        maxsize (int or None):
+            The maximum number of datasets to cache. Zero disables the cache.
+            The default is 16.
+        max_open_files (int or None):
+            The maximum number of netCDF files to keep open at once, shared by
+            every dataset in the process. Files closed to respect this bound
+            are transparently reopened when accessed. This sets the
+            ``file_cache_maxsize`` option of xarray, which defaults to 128.
+    '''
+    global _dataset_cache_maxsize
+    with _dataset_cache_lock:
+        if maxsize is not None:
+            _dataset_cache_maxsize = int(maxsize)
+            while _dataset_cache_maxsize < len(_dataset_cache):
+                _dataset_cache.popitem(last=False)
+    if max_open_files is not None:
+        xr.set_options(file_cache_maxsize=int(max_open_files))
+
+
+def clear_cache(reftime=None):
+    '''Evict datasets from the cache of opened datasets.
+
+    Apollo evicts datasets automatically when it rewrites a forecast. This
+    function is only required when the store is modified by other means.
+
+    Arguments:
+        reftime (timestamp or None):
+            If given, only evict datasets containing this reftime.
+            Otherwise evict everything.
+    '''
+    with _dataset_cache_lock:
+        if reftime is None:
+            _dataset_cache.clear()
+            return
+        hours = _hours(reftime)
+        for key in [k for k in _dataset_cache if hours in k[1]]:
+            del _dataset_cache[key]
+
+
+def _cache_get(key):
+    '''Get a dataset from the cache, or ``None`` on a miss.
+    '''
+    with _dataset_cache_lock:
+        ds = _dataset_cache.get(key)
+        if ds is not None:
+            _dataset_cache.move_to_end(key)
+        return ds
+
+
+def _cache_put(key, ds):
+    '''Add a dataset to the cache, evicting the least recently used.
+    '''
+    with _dataset_cache_lock:
+        if _dataset_cache_maxsize <= 0: return
+        _dataset_cache[key] = ds
+        _dataset_cache.move_to_end(key)
+        while _dataset_cache_maxsize < len(_dataset_cache):
+            _dataset_cache.popitem(last=False)
+
+
+# The shared HTTP session and the configuration it was created with.
+# The lock guards creation, since downloads run on a pool of worker threads.
+_http_session = None
+_http_session_config = None
+_http_session_lock = threading.Lock()
+
+
+def http_session(pool_size=None, max_retries=None, backoff_factor=None):
+    '''Get the shared HTTP session used to download forecasts.
+
+    The session keeps connections to the NOAA servers alive between requests,
+    so the files of a forecast, their retries, and later forecasts downloaded
+    by the same process all reuse a small pool of TCP and TLS connections.
+
+    The session is created on first use. Arguments left as ``None`` keep their
+    current value, or the default if no session exists yet. Changing any of
+    them replaces the shared session.
+
+    Arguments:
+        pool_size (int or None):
+            The maximum number of connections kept open per host. This should
+            be at least the number of concurrent download workers.
+            The default is 16.
+        max_retries (int or None):
+            The number of times the connection adapter retries failed
+            connections and 5xx responses before the error reaches the caller.
+            This is in addition to the retry loop in :func:`download`.
+            The default is 3.
+        backoff_factor (float or None):
+            The backoff factor for the adapter's retries, in seconds.
+            The default is 0.5.
+
+    Returns:
+        requests.Session:
+            The shared session.
+    '''
+    global _http_session, _http_session_config
+    with _http_session_lock:
+        old = _http_session_config or (16, 3, 0.5)
+        config = (
+            old[0] if pool_size is None else pool_size,
+            old[1] if max_retries is None else max_retries,
+            old[2] if backoff_factor is None else backoff_factor,
+        )
+        (pool_size, max_retries, backoff_factor) = config
+        if _http_session is None or _http_session_config != config:
+            retry = Retry(
+                total=max_retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=(500, 502, 503, 504),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=pool_size,
+                pool_maxsize=pool_size,
+                max_retries=retry,
+            )
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            if _http_session is not None:
+                _http_session.close()
+            _http_session = session
+            _http_session_config = config
+        return _http_session
+
+
+# The size of each chunk read from the network during a streaming download.
+# GRIBs are several megabytes, so large chunks keep the per-write overhead low.
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+
+def _stream_download(url, path, timeout=10, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    '''Stream a remote file to a local path, resuming partial downloads.
+
+    If ``path`` already exists, it is treated as the prefix of an interrupted
+    transfer and an HTTP Range request is issued for the remaining bytes. If
+    the server ignores the range, the file is rewritten from the start.
+
+    Arguments:
+        url (str):
+            The remote file.
+        path (pathlib.Path):
+            The local file being written. It may hold a partial download.
+        timeout (int):
+            The network timeout in seconds.
+        chunk_size (int):
+            The number of bytes to read from the network at a time.
+
+    Raises:
+        IOError:
+            The transfer failed or the final size does not match the size
+            advertised by the server. The partial file is kept for resuming.
+    '''
+    offset = path.stat().st_size if path.exists() else 0
+    headers = {'Range': f'bytes={offset}-'} if offset else {}
+
+    with http_session().get(url, headers=headers, timeout=timeout, stream=True) as r:
+        # A 416 means our partial file is not a prefix of the remote file.
+        # Discard it; the caller will retry from scratch.
+        if r.status_code == 416:
+            path.unlink()
+            raise IOError(f'cannot resume download of {path.name}, restarting')
+
+        r.raise_for_status()
+
+        # Determine the expected size of the complete file.
+        # The server answers 206 when it honors the range, or 200 otherwise.
+        if r.status_code == 206:
+            mode = 'ab'
+            total = r.headers.get('Content-Range', '').rpartition('/')[2]
+            logger.info(f'resuming download of {path.name} at byte {offset}')
+        else:
+            mode = 'wb'
+            offset = 0
+            total = r.headers.get('Content-Length', '')
+        total = int(total) if total.isdigit() else None
+
+        with path.open(mode, buffering=chunk_size) as fd:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                fd.write(chunk)
+
+    size = path.stat().st_size
+    if total is not None and size != total:
+        raise IOError(f'incomplete download of {path.name}: got {size} of {total} bytes')
+
+
+def _inventory_pattern():
+    '''Compile a regex matching the ``.idx`` entries of the wanted messages.
+
+    The pattern is matched against the ``VAR:LEVEL:FORECAST`` portion of each
+    inventory line.
+
+    Returns:
+        re.Pattern:
+            The compiled pattern.
+    '''
+    instant = r'(anl|\d+ hour fcst)'  # PyNIO ``P0`` variables, not averages.
+    alternatives = [f'[^:]+:{IDX_LEVELS[lvl]}:.*' for lvl in _NUMBERED_LEVELS]
+    for name in GRIB_FEATURES:
+        parts = name.split('_')
+        if len(parts) != 4 or parts[1] != 'P0': continue  # Not a data variable
+        var, _, lvl, _ = parts
+        if lvl in _NUMBERED_LEVELS: continue  # Already matched above
+        alternatives.append(f'{var}:{IDX_LEVELS[lvl]}:{instant}')
+    return re.compile('|'.join(f'({a})' for a in alternatives))
+
+
+def _read_inventory(url, timeout=10):
+    '''Read the byte ranges of the wanted messages from a ``.idx`` inventory.
+
+    NOMADS publishes an inventory next to each GRIB. Each line describes one
+    message, like ``12:3456789:d=2019010100:TMP:2 m above ground:3 hour fcst:``,
+    giving the message number, its byte offset, and its description. A message
+    ends where the next one begins.
+
+    Arguments:
+        url (str):
+            The URL of the GRIB file (not the inventory).
+        timeout (int):
+            The network timeout in seconds.
+
+    Returns:
+        pair:
+            A pair ``(ranges, last)``. The ``ranges`` are the merged byte
+            ranges ``(start, stop)`` to fetch, in file order. The ``stop`` is
+            exclusive and may be ``None`` for the last message. The ``last``
+            is the offset of the last message in the inventory, or ``None`` if
+            the inventory is empty.
+    '''
+    r = http_session().get(url + '.idx', timeout=timeout)
+    r.raise_for_status()
+
+    entries = []
+    for line in r.text.splitlines():
+        fields = line.split(':')
+        if len(fields) < 6: continue
+        offset = int(fields[1])
+        desc = ':'.join(fields[3:6])
+        entries.append((offset, desc))
+
+    pattern = _inventory_pattern()
+    ranges = []
+    for i, (offset, desc) in enumerate(entries):
+        if not pattern.fullmatch(desc): continue
+        stop = entries[i+1][0] if i + 1 < len(entries) else None
+        if ranges and ranges[-1][1] == offset:
+            ranges[-1] = (ranges[-1][0], stop)  # Merge adjacent messages
+        else:
+            ranges.append((offset, stop))
+    last = entries[-1][0] if entries else None
+    return ranges, last
+
+
+def _iter_byteranges(r, ranges):
+    '''Iterate over the parts of a response to a byte-range request.
+
+    Arguments:
+        r (requests.Response):
+            A response to a request with a ``Range`` header.
+        ranges (list of pair):
+            The ranges that were requested.
+
+    Yields:
+        triple:
+            Triples ``(start, data, size)`` giving the offset and content of
+            each part, and the size of the whole file if the server sent it.
+
+    Raises:
+        IOError:
+            A part of the response does not say which bytes it holds.
+    '''
+    body = r.content
+    ctype = r.headers.get('Content-Type', '')
+
+    # The server ignored the ranges and sent the whole file.
+    if r.status_code == 200:
+        for (start, stop) in ranges:
+            yield start, body[start:stop], len(body)
+
+    # A single range is sent as the entire body.
+    elif not ctype.startswith('multipart/byteranges'):
+        content_range = r.headers.get('Content-Range', '')
+        m = re.match(r'bytes (\d+)-\d+/(\d+|\*)', content_range)
+        if m is None:
+            raise IOError(f'bad Content-Range in response from {r.url}: {repr(content_range)}')
+        size = int(m[2]) if m[2].isdigit() else None
+        yield int(m[1]), body, size
+
+    # Multiple ranges are sent as a multipart message. We slice each part by
+    # the length in its Content-Range, so binary data can never be mistaken
+    # for a boundary.
+    else:
+        boundary = ctype.partition('boundary=')[2].strip('"')
+        delim = b'--' + boundary.encode('ascii')
+        pos = 0
+        while True:
+            i = body.find(delim, pos)
+            if i < 0: break
+            i += len(delim)
+            if body[i:i+2] == b'--': break
+            j = body.index(b'\r\n\r\n', i)
+            headers = body[i:j].decode('latin-1')
+            m = re.search(r'bytes (\d+)-(\d+)/(\d+|\*)', headers, re.IGNORECASE)
+            if m is None:
+                raise IOError(f'bad part in multipart response from {r.url}')
+            start, stop = int(m[1]), int(m[2]) + 1
+            size = int(m[3]) if m[3].isdigit() else None
+            j += 4
+            yield start, body[j : j + stop - start], size
+            pos = j + stop - start
+
+
+def _grib_length(header):
+    '''Read the length of a GRIB message from its first 16 bytes.
+
+    Returns:
+        int or None:
+            The length of the message in bytes, or ``None`` if the bytes are
+            not the start of a GRIB message.
+    '''
+    if len(header) < 16 or header[:4] != b'GRIB': return None
+    if header[7] == 1: return int.from_bytes(header[4:7], 'big')
+    if header[7] == 2: return int.from_bytes(header[8:16], 'big')
+    return None
+
+
+def _subset_download(url, path, timeout=10, max_ranges=32):
+    '''Download only the wanted messages of a GRIB.
+
+    The messages are located with the ``.idx`` inventory and fetched with
+    multi-range HTTP requests. GRIB files are plain concatenations of
+    messages, so the ranges written back to back form a valid, smaller GRIB.
+
+    An inventory can only be trusted if it lists every message. Unless the
+    last listed message is fetched to the end of the file anyway, the header
+    of that message is fetched separately to check that the message ends
+    exactly at the end of the file.
+
+    Arguments:
+        url (str):
+            The remote GRIB file.
+        path (pathlib.Path):
+            The local file to write.
+        timeout (int):
+            The network timeout in seconds.
+        max_ranges (int):
+            The maximum number of ranges in a single request.
+
+    Returns:
+        bool:
+            True if the subset was written. False if the inventory is missing,
+            lists none of the wanted messages, or is shorter than the file,
+            in which case the full file should be downloaded instead.
+
+    Raises:
+        IOError:
+            The inventory or one of the ranges could not be fetched.
+    '''
+    try:
+        ranges, last = _read_inventory(url, timeout=timeout)
+    except requests.HTTPError as err:
+        if err.response is None or err.response.status_code != 404: raise
+        logger.warning(f'no inventory for {url}')
+        return False
+
+    if not ranges:
+        logger.warning(f'no wanted messages in the inventory of {url}')
+        return False
+
+    def fetch(batch):
+        spec = ','.join(f'{a}-{"" if b is None else b-1}' for (a, b) in batch)
+        with http_session().get(url, headers={'Range': f'bytes={spec}'}, timeout=timeout) as r:
+            r.raise_for_status()
+            parts = sorted(_iter_byteranges(r, batch), key=lambda p: p[0])
+        if [p[0] for p in parts] != [a for (a, _) in batch]:
+            raise IOError(f'unexpected byte ranges in response from {url}')
+        return parts
+
+    if ranges[-1][1] is not None:
+        [(_, header, size)] = fetch([(last, last + 16)])
+        if size is None or last + (_grib_length(header) or 0) != size:
+            logger.warning(f'the inventory of {url} does not cover the whole file')
+            return False
+
+    with path.open('wb', buffering=DOWNLOAD_CHUNK_SIZE) as fd:
+        for i in range(0, len(ranges), max_ranges):
+            for (_, data, _) in fetch(ranges[i : i + max_ranges]):
+                fd.write(data)
+    return True
+
+
+def _download_grib(reftime, forecast, max_tries=8, timeout=10, fail_fast=False,
+        subset=False):
     '''Ensure that the GRIB for this reftime and forecast exists locally.
 
+    The GRIB is first streamed to a ``.part`` file next to its final path.
+    Failed transfers leave the partial file in place so that the next attempt
+    resumes where the previous one stopped.
+
+    In subset mode, only the messages used by Apollo are fetched using the
+    ``.idx`` inventory published next to the GRIB, and written to the subset
+    path of :func:`grib_path`. If the inventory is missing or incomplete, the
+    full file is downloaded instead. A complete GRIB already on disk satisfies
+    either mode, but a subset is only reused in subset mode.
+
     Arguments:
         reftime (timestamp):
             The reference time to download.
@@ -286,6 +1376,8 @@ def _download_grib(reftime, forecast, max_tries=8, timeout=10, fail_fast=False):
         fail_fast (bool):
             If true, the download errors are treated as fatal.
             This overrides the `max_tries` argument.
+        subset (bool):
+            If true, download only the wanted messages using byte ranges.
 
     Returns:
         xarray.Dataset:
@@ -295,28 +1387,38 @@ def _download_grib(reftime, forecast, max_tries=8, timeout=10, fail_fast=False):
         max_tries = 1
 
     url = grib_url(reftime, forecast)
-    path = grib_path(reftime, forecast)
-    path.parent.mkdir(exist_ok=True)
+    full_path = grib_path(reftime, forecast)
+    path = grib_path(reftime, forecast, subset=subset)
+    full_path.parent.mkdir(parents=True, exist_ok=True)
 
     for i in range(max_tries):
+        if full_path.exists():
+            path = full_path
+            break
         if path.exists():
             break
 
         try:
             # Perform a streaming download because the files are big.
+            # The partial file is only renamed once it is known to be complete.
             logger.info(f'downloading {url}')
-            with path.open('wb') as fd:
-                r = requests.get(url, timeout=timeout, stream=True)
-                r.raise_for_status()
-                for chunk in r.iter_content(chunk_size=128):
-                    fd.write(chunk)
+            if path != full_path:
+                part = path.with_name(path.name + '.part')
+                if _subset_download(url, part, timeout=timeout):
+                    part.rename(path)
+                    break
+                logger.warning(f'downloading full file for {full_path.name}')
+                if part.exists(): part.unlink()
+                path = full_path
+            part = path.with_name(path.name + '.part')
+            _stream_download(url, part, timeout=timeout)
+            part.rename(path)
             break
 
         except IOError as err:
             # IOError includes both system and HTTP errors.
-            # Retry with exponential backoff.
+            # Retry with exponential backoff, resuming from the partial file.
             logger.warning(err)
-            path.unlink()
             if i + 1 == max_tries:
                 logger.error(f'download of {path.name} failed, giving up')
                 raise err
@@ -326,14 +1428,11 @@ def _download_grib(reftime, forecast, max_tries=8, timeout=10, fail_fast=False):
                 sleep(delay)
                 continue
 
-        except (Exception, SystemExit, KeyboardInterrupt) as err:
-            # Partial files should be deleted
-            # SystemExit and KeyboardInterrupt must be caught explicitly.
-            path.unlink()
-            raise err
-
+    # PyNIO calls into the HDF5 and netCDF libraries, which are not
+    # thread-safe. Every read of the GRIB, including the open and close,
+    # holds the same lock as the netCDF writes in :func:`download`.
     logger.info(f'reading {path}')
-    return xr.open_dataset(path, engine='pynio')
+    return xr.open_dataset(path, engine='pynio', lock=HDF5_LOCK)
 
 
 def _process_grib(ds, reftime, forecast):
@@ -358,38 +1457,7 @@ def _process_grib(ds, reftime, forecast):
         xarray.Dataset:
             A processed dataset.
     '''
-    features = {
-        # Data variables
-        'DLWRF_P0_L1_GLC0':  'DLWRF_SFC',    'DSWRF_P0_L1_GLC0':   'DSWRF_SFC',
-        'PRES_P0_L1_GLC0':   'PRES_SFC',
-        'PRES_P0_L6_GLC0':   'PRES_MWSL',    'PRES_P0_L7_GLC0':    'PRES_TRO',
-        'TCDC_P0_L200_GLC0': 'TCC_EATM',     'TMP_P0_2L108_GLC0':  'TMP_SPDY',
-        'TMP_P0_L1_GLC0':    'TMP_SFC',      'TMP_P0_L100_GLC0':   'TMP_ISBL',
-        'TMP_P0_L103_GLC0':  'TMP_HTGL',     'TMP_P0_L7_GLC0':     'TMP_TRO',
-        'RH_P0_2L104_GLC0':  'RH_SIGY',      'RH_P0_2L108_GLC0':   'RH_SPDY',
-        'RH_P0_L100_GLC0':   'RH_ISBL',
-        'RH_P0_L4_GLC0':     'RH_0DEG',      'UGRD_P0_2L108_GLC0': 'UGRD_SPDY',
-        'UGRD_P0_L100_GLC0': 'UGRD_ISBL',    'UGRD_P0_L103_GLC0':  'UGRD_HTGL',
-        'UGRD_P0_L220_GLC0': 'UGRD_TOA',     'UGRD_P0_L6_GLC0':    'UGRD_MWSL',
-        'UGRD_P0_L7_GLC0':   'UGRD_TRO',     'VGRD_P0_2L108_GLC0': 'VGRD_SPDY',
-        'VGRD_P0_L100_GLC0': 'VGRD_ISBL',    'VGRD_P0_L103_GLC0':  'VGRD_HTGL',
-        'VGRD_P0_L220_GLC0': 'VGRD_TOA',     'VGRD_P0_L6_GLC0':    'VGRD_MWSL',
-        'VGRD_P0_L7_GLC0':   'VGRD_TRO',     'VIS_P0_L1_GLC0':     'VIS_SFC',
-        'LHTFL_P0_L1_GLC0':  'LHTFL_SFC',    'SHTFL_P0_L1_GLC0':   'SHTFL_SFC',
-        'REFC_P0_L200_GLC0': 'REFC_EATM',    'REFD_P0_L103_GLC0':  'REFD_HTGL',
-        'REFD_P0_L105_GLC0': 'REFD_HYBL',    'VVEL_P0_L100_GLC0':  'VVEL_ISBL',
-        'HGT_P0_L1_GLC0':    'HGT_SFC',      'HGT_P0_L100_GLC0':   'HGT_ISBL',
-        'HGT_P0_L2_GLC0':    'HGT_CBL',      'HGT_P0_L220_GLC0':   'HGT_TOA',
-        'HGT_P0_L245_GLC0':  'HGT_LLTW',     'HGT_P0_L4_GLC0':     'HGT_0DEG',
-        'PWAT_P0_L200_GLC0': 'PWAT_EATM',    'TKE_P0_L100_GLC0':   'TKE_ISBL',
-
-        # Coordinate variables
-        'lv_HTGL1':  'z_HTGL1',    'lv_HTGL3':  'z_HTGL2',
-        'lv_HTGL6':  'z_HTGL3',    'lv_ISBL0':  'z_ISBL',
-        'lv_SPDL2':  'z_SPDY',
-        'xgrid_0':   'x',          'ygrid_0':   'y',
-        'gridlat_0': 'lat',        'gridlon_0': 'lon',
-    }
+    features = GRIB_FEATURES
     unwanted = [k for k in ds.variables.keys() if k not in features]
     ds = ds.drop(unwanted)
     ds = ds.rename(features)
@@ -520,15 +1588,77 @@ def _process_grib(ds, reftime, forecast):
     return ds
 
 
-def _open_dataset(paths):
+def _select(ds, variables=None, region=None):
+    '''Select variables and a geographic window from a dataset.
+
+    Arguments:
+        ds (xarray.Dataset):
+            The dataset to subset.
+        variables (list of str or None):
+            The data variables to keep. The default is to keep all.
+        region (pair or dict or None):
+            Either a pair ``(center, shape)`` as understood by
+            :func:`slice_geo`, or a mapping from dimension names to integer
+            slices like those returned by :func:`slice_indices`. The default
+            is the full grid.
+
+    Returns:
+        xarray.Dataset:
+            The subset.
+    '''
+    if variables is not None:
+        ds = ds[list(variables)]
+    if region is not None:
+        if isinstance(region, dict):
+            window = region
+        else:
+            center, shape = region
+            window = slice_indices(ds, center, shape)
+        ds = ds.isel(window)
+    return ds
+
+
+def _selection_key(variables, region):
+    '''A hashable description of the arguments to :func:`_select`.
+    '''
+    if variables is not None:
+        variables = tuple(variables)
+    if isinstance(region, dict):
+        region = tuple(sorted((k, v.start, v.stop, v.step) for (k, v) in region.items()))
+    elif region is not None:
+        center, shape = region
+        region = (tuple(np.ravel(center).tolist()), tuple(np.ravel(shape).tolist()))
+    return (variables, region)
+
+
+def _open_dataset(paths, aligned=False, chunks=None, parallel=True, preprocess=None):
     '''Open one or more netCDF files as a single dataset.
 
     This is a wrapper around :func:`xarray.open_mfdataset` providing defaults
     relevant to Apollo's filesystem layout.
 
+    Only variables with a reftime dimension are concatenated across files.
+    Other variables, like the latitude and longitude of the grid, are taken
+    from the files without being stacked.
+
     Arguments:
         paths (str or pathlib.Path or list):
             One or more paths to the datasets.
+        aligned (bool):
+            If true, the caller guarantees that the paths are sorted by reftime
+            and share the same grid. The files are then concatenated along the
+            reftime dimension without reading and comparing the coordinates
+            of every file.
+        chunks (dict or None):
+            The dask chunk sizes for each dimension. The default is one chunk
+            per file.
+        parallel (bool):
+            If true, the metadata of each file is read in parallel using the
+            current dask scheduler, a thread pool by default.
+        preprocess (callable or None):
+            A function applied to the lazy dataset of each file before the
+            files are combined. Selections made here are read from disk as
+            hyperslabs, so only the selected data is decoded.
 
     Returns:
         xarray.Dataset:
@@ -537,28 +1667,184 @@ def _open_dataset(paths):
     if isinstance(paths, (str, Path)):
         paths = [paths]
 
+    kwargs = dict(
+        chunks=chunks,
+        parallel=parallel and 1 < len(paths),
+        data_vars='minimal',
+        coords='minimal',
+        preprocess=preprocess,
+    )
+    if aligned:
+        kwargs.update(combine='nested', concat_dim='reftime', compat='override')
+    else:
+        kwargs.update(combine='by_coords')
+
     # Xarray and libnetcdf sometimes send trash to stdout or stderr.
     # We completly silence both streams temporarily.
     with builtins.open('/dev/null', 'w') as dev_null:
         with contextlib.redirect_stdout(dev_null):
             with contextlib.redirect_stderr(dev_null):
-                return xr.open_mfdataset(paths, combine='by_coords')
+                return xr.open_mfdataset(paths, **kwargs)
+
+
+def _download_forecast(reftime, forecast, **kwargs):
+    '''Download and process a single forecast hour.
 
+    This is the unit of work executed by the worker pool in :func:`download`.
 
-def download(reftime='now', save_nc=True, keep_gribs=False, force=False, **kwargs):
+    Arguments:
+        reftime (timestamp):
+            The reference time to download.
+        forecast (int):
+            The forecast hour to download.
+        **kwargs:
+            Forwarded to :func:`_download_grib`.
+
+    Returns:
+        xarray.Dataset:
+            The processed forecast hour, loaded into memory.
+    '''
+    grib = _download_grib(reftime, forecast, **kwargs)
+    ds = _process_grib(grib, reftime, forecast).load()
+    grib.close()
+    return ds
+
+
+def _encode(ds):
+    '''Encode a dataset into the variables and attributes stored on disk.
+
+    This applies the same CF encoding that :meth:`xarray.Dataset.to_netcdf`
+    would apply, e.g. converting timestamps to hours since the epoch.
+
+    Returns:
+        pair:
+            A pair ``(variables, attrs)`` of the encoded variables and the
+            global attributes.
+    '''
+    variables, attrs = xr.conventions.encode_dataset_coordinates(ds)
+    return xr.conventions.cf_encoder(variables, attrs)
+
+
+def _create_nc(path, ds, **policy):
+    '''Create a netCDF with room for every forecast hour of a reftime.
+
+    The file is laid out like a single forecast hour, except that the
+    ``forecast`` dimension spans the full :data:`FORECAST_PERIOD`. Variables
+    without a forecast dimension are written immediately. Variables with a
+    forecast dimension are left empty to be filled by :func:`_write_nc`.
+
+    Data variables are compressed and chunked according to the storage policy.
+    Packing to ``int16`` requires the value range of the whole forecast, which
+    is not known until every hour is written, so data variables are always
+    stored as ``float32`` here. Use ``apollo nam encode`` to pack them later.
+
+    The HDF5 library is not thread-safe, so the file is created while holding
+    xarray's HDF5 lock, like every other access to netCDF or GRIB files
+    during a download. The file must be closed with :func:`_close_nc`.
+
+    Arguments:
+        path (pathlib.Path):
+            The path of the new file.
+        ds (xarray.Dataset):
+            Any processed forecast hour, used as a template.
+        **policy:
+            Overrides for :data:`ENCODING_POLICY`.
+
+    Returns:
+        netCDF4.Dataset:
+            The new file, open for writing.
+    '''
+    policy['pack'] = 'float32'
+    encoding = storage_encoding(ds, **policy)
+    variables, attrs = _encode(ds)
+
+    with HDF5_LOCK:
+        nc = netCDF4.Dataset(path, 'w', format='NETCDF4')
+        nc.setncatts(attrs)
+
+        for (dim, size) in ds.dims.items():
+            if dim == 'forecast': size = len(FORECAST_PERIOD)
+            nc.createDimension(dim, size)
+
+        for (name, var) in variables.items():
+            var_attrs = dict(var.attrs)
+            default_fill = np.nan if var.dtype.kind == 'f' else None
+            fill = var_attrs.pop('_FillValue', default_fill)
+            enc = dict(encoding.get(name, {}))
+            dtype = enc.pop('dtype', var.dtype)
+            if 'chunksizes' in enc:
+                enc['chunksizes'] = tuple(
+                    len(FORECAST_PERIOD) if d == 'forecast' else c
+                    for (d, c) in zip(var.dims, enc['chunksizes'])
+                )
+            nc.createVariable(name, dtype, var.dims, fill_value=fill, **enc)
+            nc[name].setncatts(var_attrs)
+            if 'forecast' not in var.dims:
+                nc[name][...] = var.values
+
+        # The forecast coordinate is stored in hours.
+        nc['forecast'].units = 'hours'
+        nc['forecast'][:] = np.asarray(FORECAST_PERIOD)
+    return nc
+
+
+def _write_nc(nc, ds, forecast):
+    '''Write a processed forecast hour into its slot of a netCDF.
+
+    Arguments:
+        nc (netCDF4.Dataset):
+            A file created by :func:`_create_nc`.
+        ds (xarray.Dataset):
+            The processed forecast hour.
+        forecast (int):
+            The forecast hour.
+    '''
+    i = FORECAST_PERIOD.index(forecast)
+    variables, _ = _encode(ds)
+    with HDF5_LOCK:
+        for (name, var) in variables.items():
+            if name == 'forecast' or 'forecast' not in var.dims: continue
+            if name not in nc.variables:
+                logger.warning(f'forecast hour {forecast} has unexpected variable {name}')
+                continue
+            key = tuple(slice(i, i+1) if d == 'forecast' else slice(None) for d in var.dims)
+            nc[name][key] = var.values
+
+
+def _close_nc(nc):
+    '''Close a netCDF created by :func:`_create_nc`.
+    '''
+    with HDF5_LOCK:
+        nc.close()
+
+
+def download(reftime='now', save_nc=True, keep_gribs=False, force=False,
+        max_workers=4, encoding=None, store=None, **kwargs):
     '''Download a forecast.
 
     The download is skipped for GRIB files in the cache.
 
+    The forecast hours are downloaded and processed concurrently by a pool of
+    worker threads. Each file retains its own retry and backoff schedule.
+    Processed forecast hours are written into a single netCDF as they arrive,
+    so only the forecast hours in flight are held in memory.
+
     Arguments:
         reftime (timestamp):
             The reference time to open.
         save_nc (bool or None):
-            Whether to save the processed forecast in the cache as a netCDF.
+            Whether to save the processed forecast in the local store.
         keep_gribs (bool or None):
             Whether to save the raw forecast in the cache as a set of GRIBs.
         force (bool):
             If true, download even if the dataset already exists locally.
+        max_workers (int):
+            The maximum number of forecast hours to download concurrently.
+        encoding (dict or None):
+            Overrides for the storage policy, see :data:`ENCODING_POLICY`.
+        store ('netcdf' or 'zarr' or None):
+            The backend of the local store. The default is determined by the
+            ``APOLLO_NAM_STORE`` environment variable, or ``'netcdf'``.
         max_tries (int):
             The maximum number of failed downloads for a single file
             before raising an `IOError`. Exponential backoff is applied
@@ -569,47 +1855,91 @@ def download(reftime='now', save_nc=True, keep_gribs=False, force=False, **kwarg
         fail_fast (bool):
             If true, the download errors are treated as fatal.
             This overrides the `max_tries` argument.
+        subset (bool):
+            If true, download only the GRIB messages used by Apollo, located
+            with the NOMADS ``.idx`` inventories.
 
     Returns:
         xarray.Dataset:
             A dataset for the forecast at this reftime.
     '''
+    store = _get_store(store)
+    reftime = apollo.Timestamp(reftime).floor('6h')
+
     # No need to download if we already have the dataset.
-    if not force and nc_path(reftime).exists():
+    if not force and store == 'netcdf' and nc_path(reftime).exists():
         logger.info(f'skipping downlod, file exists: {nc_path(reftime)}')
-        return open(reftime, on_miss='raise')
+        return open(reftime, on_miss='raise', store=store)
+    if not force and store == 'zarr' and reftime in _zarr_reftimes():
+        logger.info(f'skipping downlod, reftime exists: {reftime}')
+        return open(reftime, on_miss='raise', store=store)
+
+    # The day directory must exist before the workers start writing into it.
+    grib_path(reftime, 0).parent.mkdir(parents=True, exist_ok=True)
 
-    # We save each GRIB as a netCDF in a temp directory, then reopen all
-    # as a single dataset, which we finally persist in the datastore.
-    # It is important to persist the intermediate datasets for performance
-    # and memory usage.
+    # Unless we are saving to the netCDF store, we write the netCDF to a temp
+    # directory and either copy it to the Zarr store or load it into memory
+    # before the directory is deleted.
     with TemporaryDirectory() as tmpdir:
-        tmpdir = Path(tmpdir)
-        paths = []
-        for forecast in FORECAST_PERIOD:
-            path = tmpdir / f'{forecast}.nc'
-            ds = _download_grib(reftime, forecast)
-            ds = _process_grib(ds, reftime, forecast)
-            ds.to_netcdf(path)
-            paths.append(path)
-        ds = _open_dataset(paths)
-
-    if save_nc:
-        path = nc_path(reftime)
-        logger.info(f'writing {path}')
-        ds.to_netcdf(path)
+        in_place = save_nc and store == 'netcdf'
+        path = nc_path(reftime) if in_place else Path(tmpdir) / 'forecast.nc'
+        part = path.with_name(path.name + '.part')
+
+        max_workers = max(1, int(max_workers))
+        logger.info(f'downloading {len(FORECAST_PERIOD)} forecast hours with {max_workers} workers')
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {
+                pool.submit(_download_forecast, reftime, forecast, **kwargs): forecast
+                for forecast in FORECAST_PERIOD
+            }
+            nc = None
+            try:
+                # Write each forecast hour as soon as it is ready.
+                # The first one to arrive determines the layout of the file.
+                # All writes happen on this thread. Completed futures are
+                # dropped so their results can be freed once written.
+                for future in as_completed(futures):
+                    forecast = futures.pop(future)
+                    ds = future.result()
+                    del future
+                    if nc is None:
+                        logger.info(f'writing {path}')
+                        nc = _create_nc(part, ds, **(encoding or {}))
+                    _write_nc(nc, ds, forecast)
+                    del ds
+            except BaseException:
+                # The first failure is re-raised after pending work is cancelled.
+                for f in futures: f.cancel()
+                if nc is not None: _close_nc(nc)
+                if part.exists(): part.unlink()
+                raise
+            _close_nc(nc)
+
+        part.rename(path)
+        if in_place:
+            update_catalog(reftime)
+            clear_cache(reftime)
+
         ds = _open_dataset([path])
+        if save_nc and store == 'zarr':
+            _zarr_write(ds, **(encoding or {}))
+            ds.close()
+            ds = _open_zarr([reftime])
+        elif not save_nc:
+            ds = ds.load()
 
     if not keep_gribs:
         for forecast in FORECAST_PERIOD:
-            path = grib_path(reftime, forecast)
-            logger.info(f'deleting {path}')
-            path.unlink()
+            for path in (grib_path(reftime, forecast), grib_path(reftime, forecast, subset=True)):
+                if not path.exists(): continue
+                logger.info(f'deleting {path}')
+                path.unlink()
 
     return ds
 
 
-def open(reftimes='now', on_miss='raise', **kwargs):
+def open(reftimes='now', on_miss='raise', store=None, cache=True, chunks=None,
+        variables=None, region=None, **kwargs):
     '''Open a forecast for one or more reference times.
 
     Arguments:
@@ -624,6 +1954,23 @@ def open(reftimes='now', on_miss='raise', **kwargs):
             - ``'skip'``: Skip missing forecasts. This mode will raise a
               :class:`CacheMiss` exception only if the resulting dataset
               would be empty.
+        store ('netcdf' or 'zarr' or None):
+            The backend of the local store. The default is determined by the
+            ``APOLLO_NAM_STORE`` environment variable, or ``'netcdf'``.
+        cache (bool):
+            If true, reuse the dataset from a previous call for the same
+            reftimes, see :func:`set_cache_options`.
+        chunks (dict or None):
+            The dask chunk sizes for each dimension, e.g. ``{'x': 16, 'y': 16}``.
+            The default is one chunk per file for the netCDF store, or the
+            chunks on disk for the Zarr store.
+        variables (list of str or None):
+            If given, only open these data variables.
+        region (pair or dict or None):
+            If given, only open this geographic window. This is either a pair
+            ``(center, shape)`` as understood by :func:`slice_geo`, or a
+            mapping from ``'x'`` and ``'y'`` to integer slices like those
+            returned by :func:`slice_indices`.
         **kwargs:
             Additional keyword arguments are forwarded to :func:`download`.
 
@@ -632,6 +1979,8 @@ def open(reftimes='now', on_miss='raise', **kwargs):
             A single dataset containing all forecasts at the given reference
             times.
     '''
+    store = _get_store(store)
+
     if not on_miss in ('raise', 'download', 'skip'):
         raise ValueError(f"Unknown cache miss strategy: {repr(on_miss)}")
 
@@ -645,23 +1994,55 @@ def open(reftimes='now', on_miss='raise', **kwargs):
             for r in reftimes
         ]
 
-    paths = []
+    if reftimes:
+        available = set(_available_reftimes(min(reftimes), max(reftimes), store))
+    else:
+        available = set()
+
+    found = []
     for reftime in reftimes:
-        path = nc_path(reftime)
-        if path.exists():
-            paths.append(path)
+        if reftime in available:
+            found.append(reftime)
+        elif store == 'netcdf' and nc_path(reftime).exists():
+            # The file was added to the store by means other than Apollo.
+            logger.info(f'adding forecast to the catalog: {reftime}')
+            update_catalog(reftime)
+            found.append(reftime)
         elif on_miss == 'download':
-            download(reftime)
-            paths.append(path)
+            download(reftime, store=store, **kwargs)
+            found.append(reftime)
         elif on_miss == 'skip':
             continue
         else:
             raise CacheMiss(f'Missing forecast for reftime {reftime}')
 
-    if len(paths) == 0:
+    if len(found) == 0:
         raise CacheMiss('No applicable forecasts were found')
 
-    ds = _open_dataset(paths)
+    found = sorted(set(found))
+    key = (
+        store,
+        tuple(_hours(reftime) for reftime in found),
+        tuple(sorted(chunks.items())) if chunks else None,
+        _selection_key(variables, region),
+    )
+    ds = _cache_get(key) if cache else None
+    if ds is not None:
+        logger.debug(f'reusing cached dataset for {len(found)} reftimes')
+        return ds.copy()
+
+    # The selection is applied lazily before any data is read.
+    # For the netCDF store, it is applied to each file before combining.
+    select = partial(_select, variables=variables, region=region)
+    if store == 'zarr':
+        ds = _open_zarr(found, chunks=chunks)
+        ds = select(ds)
+    else:
+        # If the catalog says that every file shares the same grid,
+        # we can skip the expensive coordinate comparisons.
+        paths = [nc_path(reftime) for reftime in found]
+        aligned = len(_catalog_grids(found)) == 1
+        ds = _open_dataset(paths, aligned=aligned, chunks=chunks, preprocess=select)
 
     # Reconstruct `time` dimension by combining `reftime` and `forecast`.
     # - `reftime` is the time the forecast was made.
@@ -670,10 +2051,13 @@ def open(reftimes='now', on_miss='raise', **kwargs):
     time = ds.reftime + ds.forecast
     ds = ds.assign_coords(time=time)
 
+    if cache:
+        _cache_put(key, ds)
+        ds = ds.copy()
     return ds
 
 
-def open_range(start, stop='now', on_miss='skip', **kwargs):
+def open_range(start, stop='now', on_miss='skip', store=None, **kwargs):
     '''Open a forecast for a range of reference times.
 
     Arguments:
@@ -686,6 +2070,9 @@ def open_range(start, stop='now', on_miss='skip', **kwargs):
             - ``'raise'``: Raise a :class:`CacheMiss` exception.
             - ``'download'``: Attempt to download the forecast.
             - ``'skip'``: Skip missing forecasts.
+        store ('netcdf' or 'zarr' or None):
+            The backend of the local store. The default is determined by the
+            ``APOLLO_NAM_STORE`` environment variable, or ``'netcdf'``.
         **kwargs:
             Additional keyword arguments are forwarded to :func:`download`.
 
@@ -697,12 +2084,63 @@ def open_range(start, stop='now', on_miss='skip', **kwargs):
     start = apollo.Timestamp(start).floor('6h')
     stop = apollo.Timestamp(stop).floor('6h')
     reftimes = pd.date_range(start, stop, freq='6h')
-    return open(reftimes, on_miss=on_miss, **kwargs)
+    return open(reftimes, on_miss=on_miss, store=store, **kwargs)
 
 
-def iter_available_forecasts():
+def iter_available_forecasts(store=None):
     '''Iterate over the reftimes of available forecasts.
 
+    Arguments:
+        store ('netcdf' or 'zarr' or None):
+            The backend of the local store. The default is determined by the
+            ``APOLLO_NAM_STORE`` environment variable, or ``'netcdf'``.
+
+    Yields:
+        pandas.Timestamp:
+            The forecast's reference time, with UTC timezone.
+    '''
+    for reftime in _available_reftimes(store=store):
+        yield apollo.Timestamp(reftime)
+
+
+def _available_reftimes(start=None, stop=None, store=None):
+    '''List the reftimes in the local store between two times, inclusive.
+
+    The netCDF store is resolved with a single query to the catalog. Entries
+    whose file has been removed from the store by means other than Apollo are
+    dropped from the catalog. Files added by other means are not listed until
+    they are opened or the catalog is rebuilt with :func:`rebuild_catalog`.
+
+    Arguments:
+        start (timestamp or None):
+            The first reftime of interest, or ``None`` for no lower bound.
+        stop (timestamp or None):
+            The last reftime of interest, or ``None`` for no upper bound.
+        store ('netcdf' or 'zarr' or None):
+            The backend of the local store.
+
+    Returns:
+        apollo.DatetimeIndex:
+            The sorted reftimes.
+    '''
+    if _get_store(store) == 'zarr':
+        index = _zarr_reftimes().sort_values()
+        if start is not None: index = index[index >= apollo.Timestamp(start)]
+        if stop is not None: index = index[index <= apollo.Timestamp(stop)]
+        return index
+
+    index = _catalog_reftimes(start, stop)
+    stale = [reftime for reftime in index if not nc_path(reftime).exists()]
+    for reftime in stale:
+        logger.warning(f'dropping missing forecast from the catalog: {reftime}')
+        update_catalog(reftime)
+        clear_cache(reftime)
+    return index.drop(stale) if stale else index
+
+
+def _scan_available_forecasts():
+    '''Iterate over the reftimes of forecasts by walking the netCDF store.
+
     Yields:
         pandas.Timestamp:
             The forecast's reference time, with UTC timezone.
@@ -721,7 +2159,7 @@ def iter_available_forecasts():
             yield apollo.Timestamp(f'{year:04}-{month:02}-{day:02}T{hour:02}Z')
 
 
-def times_to_reftimes(times):
+def times_to_reftimes(times, available_only=False, store=None):
     '''Compute the reference times for forecasts containing the given times.
 
     On the edge case, this may select one extra forecast per time.
@@ -729,6 +2167,12 @@ def times_to_reftimes(times):
     Arguments:
         times (numpy.ndarray like):
             A series of forecast times.
+        available_only (bool):
+            If true, only return reftimes that exist in the local store.
+        store ('netcdf' or 'zarr' or None):
+            The backend of the local store, used when ``available_only`` is
+            true. The default is determined by the ``APOLLO_NAM_STORE``
+            environment variable, or ``'netcdf'``.
 
     Returns:
         apollo.DatetimeIndex:
@@ -742,4 +2186,269 @@ def times_to_reftimes(times):
     e = a - pd.Timedelta('24h')
     f = a - pd.Timedelta('30h')
     g = a - pd.Timedelta('36h')
-    return a.union(b).union(c).union(d).union(e).union(f).union(g)
+    reftimes = a.union(b).union(c).union(d).union(e).union(f).union(g)
+    if available_only and len(reftimes) != 0:
+        available = _available_reftimes(reftimes.min(), reftimes.max(), store)
+        reftimes = reftimes.intersection(available)
+    return reftimes
+
+
+def select_forecasts(ds, times, strategy='best'):
+    '''Select one value per valid time from overlapping forecasts.
+
+    Each valid time is covered by several forecasts, one for each reftime
+    within the forecast period. This function chooses between them according
+    to a strategy and returns a dataset indexed by valid time. The selection
+    is computed on the ``reftime`` and ``forecast`` coordinates alone, and the
+    data is gathered with a single vectorized indexing operation per source.
+
+    The strategy may be one of:
+
+    - ``'best'``: Use the forecast with the shortest forecast hour, i.e. the
+      most recent forecast.
+    - An integer ``k`` between 0 and 5: Use the forecast whose forecast hour
+      is in the range ``[6k, 6k+6)``. Since reftimes are 6 hours apart, there
+      is at most one such forecast.
+    - A dict mapping integers ``k`` to weights: Blend the forecasts selected
+      by each integer strategy ``k`` using the given weights. Missing values
+      and missing forecasts are excluded, and the remaining weights are
+      renormalized.
+
+    Valid times for which no forecast satisfies the strategy are dropped.
+
+    Arguments:
+        ds (xarray.Dataset):
+            A dataset returned by :func:`open`, or a subset thereof.
+        times (numpy.ndarray like):
+            The valid times to select.
+        strategy (str or int or dict):
+            The strategy for selecting between overlapping forecasts.
+
+    Returns:
+        xarray.Dataset:
+            A dataset whose ``reftime`` and ``forecast`` dimensions have been
+            replaced by a ``time`` dimension.
+    '''
+    if strategy == 'best':
+        windows = None
+    elif isinstance(strategy, int) and 0 <= strategy < 6:
+        windows = {strategy: 1.0}
+    elif isinstance(strategy, dict) and strategy and all(
+            isinstance(k, int) and 0 <= k < 6 and 0 <= w for (k, w) in strategy.items()):
+        windows = {k: float(w) for (k, w) in strategy.items()}
+    else:
+        raise ValueError(f'invalid dedupe_strategy {repr(strategy)}')
+
+    if 'time' in ds.coords:
+        ds = ds.drop('time')
+    if not ds.indexes['reftime'].is_monotonic_increasing:
+        ds = ds.sortby('reftime')
+    if not ds.indexes['forecast'].is_monotonic_increasing:
+        ds = ds.sortby('forecast')
+
+    times = apollo.DatetimeIndex(times).unique()
+    times = np.asarray(times.tz_convert(None), dtype='datetime64[ns]')
+    reftimes = ds.reftime.values.astype('datetime64[ns]')
+    forecasts = ds.forecast.values.astype('timedelta64[ns]')
+    hours = forecasts / np.timedelta64(1, 'h')
+
+    # For every valid time and forecast hour, locate the reftime that would
+    # produce it. The `valid` mask marks those that exist in the dataset.
+    # Both arrays have shape (times, forecasts).
+    wanted = times[:, None] - forecasts[None, :]
+    ri = np.searchsorted(reftimes, wanted).clip(0, len(reftimes) - 1)
+    valid = (reftimes[ri] == wanted)
+
+    def take(mask):
+        # Select the first (i.e. shortest) forecast hour allowed by the mask.
+        fi = mask.argmax(axis=1)
+        found = mask[np.arange(len(times)), fi]
+        sel = ds.isel(
+            reftime=xr.DataArray(ri[np.arange(len(times)), fi], dims='time'),
+            forecast=xr.DataArray(fi, dims='time'),
+        )
+        sel = sel.drop(['reftime', 'forecast'])
+        sel = sel.assign_coords(time=times)
+        return sel, xr.DataArray(found, dims='time', coords={'time': times})
+
+    if windows is None:
+        result, found = take(valid)
+    else:
+        num = den = 0
+        found = False
+        for (k, weight) in windows.items():
+            mask = valid & (6*k <= hours) & (hours < 6*k + 6)
+            sel, found_k = take(mask)
+            w = weight * found_k * sel.notnull()
+            num = num + sel.fillna(0) * w
+            den = den + w
+            found = found | found_k
+        result = num / den
+        result = result.assign_attrs(ds.attrs)
+        for v in result.data_vars:
+            result[v].attrs = ds[v].attrs
+
+    return result.isel(time=np.flatnonzero(found.values))
+
+
+def feature_matrix(ds, dtype='float32'):
+    '''Flatten a dataset indexed by time into a feature matrix.
+
+    Each data variable contributes one column for every combination of its
+    non-time coordinates. Each variable is reshaped on its own, so variables
+    with different z-axes are not broadcast against each other. The matrix is
+    allocated once and filled one variable at a time. No long-format
+    intermediate is created.
+
+    Arguments:
+        ds (xarray.Dataset):
+            A dataset with a ``time`` dimension, e.g. from
+            :func:`select_forecasts`. Every data variable must have the
+            ``time`` dimension.
+        dtype (str or numpy.dtype):
+            The dtype of the matrix.
+
+    Returns:
+        pair:
+            A pair ``(matrix, columns)``. The matrix is a C-contiguous array
+            of shape ``(time, feature)``. The columns are a list of tuples
+            naming each feature, ``(variable, *coordinates)``, where the
+            coordinates are given in the order of the variable's dimensions.
+    '''
+    names = list(ds.data_vars)
+    sizes = []
+    for name in names:
+        var = ds[name]
+        if var.dims[0] != 'time':
+            var = var.transpose('time', ...)
+        sizes.append(int(np.prod(var.shape[1:], dtype='int64')))
+
+    matrix = np.empty((ds.dims['time'], sum(sizes)), dtype=dtype)
+    columns = []
+    start = 0
+    for (name, size) in zip(names, sizes):
+        var = ds[name]
+        if var.dims[0] != 'time':
+            var = var.transpose('time', ...)
+        block = matrix[:, start:start+size]
+        block[...] = np.asarray(var.data).reshape(len(block), size)
+        start += size
+
+        # Name the columns in the same order as the reshaped data.
+        dims = var.dims[1:]
+        coords = [ds[d].values if d in ds.coords else np.arange(ds.dims[d]) for d in dims]
+        labels = pd.MultiIndex.from_product(coords) if coords else [()]
+        columns.extend((name, *label) for label in labels)
+
+    return matrix, columns
+
+
+def extract_sites(times, lats, lons, shape=12000, variables=PLANAR_FEATURES,
+        strategy='best', store=None, dtype='float32'):
+    '''Extract features around many sites at once.
+
+    Each site is described by a latitude-longitude point and shares the same
+    neighborhood ``shape``. The forecasts are opened once for all sites, and
+    each forecast is read from disk once, restricted to the bounding box of
+    every neighborhood. The neighborhood of each site is then gathered from
+    memory, and one forecast is selected per time as in
+    :func:`select_forecasts`.
+
+    Features are named by ``(variable, *z, dy, dx)``, where ``z`` are any
+    vertical coordinates of the variable and ``dy`` and ``dx`` are the integer
+    offsets of the grid cell from the cell nearest the site. These names are
+    the same for every site.
+
+    Arguments:
+        times (numpy.ndarray like):
+            The valid times to extract, floored to the hour.
+        lats (float or sequence of float):
+            The latitude of each site.
+        lons (float or sequence of float):
+            The longitude of each site.
+        shape (float or pair of float):
+            The height and width of the neighborhood of each site, measured in
+            meters, as in :func:`slice_geo`.
+        variables (list of str):
+            The variables to extract.
+        strategy (str or int or dict):
+            The strategy for selecting between overlapping forecasts.
+        store ('netcdf' or 'zarr' or None):
+            The backend of the local store. The default is determined by the
+            ``APOLLO_NAM_STORE`` environment variable, or ``'netcdf'``.
+        dtype (str or numpy.dtype):
+            The dtype of the result.
+
+    Returns:
+        tuple:
+            A tuple ``(array, index, columns)``. The array has the shape
+            ``(site, time, feature)`` and may contain NaN for missing data.
+            The index is an :class:`apollo.DatetimeIndex` of the times for
+            which a forecast was found. The columns are a list of tuples
+            naming each feature.
+    '''
+    lats = np.atleast_1d(np.asarray(lats, dtype='float64'))
+    lons = np.atleast_1d(np.asarray(lons, dtype='float64'))
+    if lats.ndim != 1 or lats.shape != lons.shape:
+        raise ValueError('lats and lons must be one dimensional with the same length')
+
+    variables = list(variables)
+    times = apollo.DatetimeIndex(times).floor('1h').unique()
+    reftimes = times_to_reftimes(times, available_only=True, store=store)
+    ds = open(reftimes, on_miss='skip', store=store, variables=variables)
+    if 'time' in ds.coords:
+        ds = ds.drop('time')
+
+    # Locate the window of every site, which must all be the same size.
+    windows = [slice_indices(ds, center, shape) for center in zip(lats, lons)]
+    sizes = {(w['y'].stop - w['y'].start, w['x'].stop - w['x'].start) for w in windows}
+    if len(sizes) != 1:
+        raise ValueError('the neighborhoods of some sites are clipped by the edge of the grid')
+    (ny, nx) = sizes.pop()
+
+    # Restrict the dataset to the bounding box of all windows,
+    # and express each window as offsets into the box.
+    y0 = min(w['y'].start for w in windows)
+    y1 = max(w['y'].stop for w in windows)
+    x0 = min(w['x'].start for w in windows)
+    x1 = max(w['x'].stop for w in windows)
+    ds = ds.isel(y=slice(y0, y1), x=slice(x0, x1))
+    yi = np.array([np.arange(w['y'].start, w['y'].stop) for w in windows]) - y0
+    xi = np.array([np.arange(w['x'].start, w['x'].stop) for w in windows]) - x0
+    yi = yi[:, :, None]  # (site, ny, 1)
+    xi = xi[:, None, :]  # (site, 1, nx)
+
+    # Name the features of a single site.
+    dy = np.arange(ny) - ny // 2
+    dx = np.arange(nx) - nx // 2
+    columns = []
+    for name in variables:
+        dims = [d for d in ds[name].dims if d not in ('reftime', 'forecast', 'y', 'x')]
+        coords = [ds[d].values if d in ds.coords else np.arange(ds.dims[d]) for d in dims]
+        labels = pd.MultiIndex.from_product([*coords, dy, dx])
+        columns.extend((name, *label) for label in labels)
+
+    # Read one forecast at a time and gather the window of every site.
+    # Each block has the shape (forecast, site, feature).
+    blocks = []
+    for i in range(ds.dims['reftime']):
+        forecast = ds.isel(reftime=i).load()
+        parts = []
+        for name in variables:
+            var = forecast[name].transpose('forecast', ..., 'y', 'x')
+            arr = np.asarray(var.values, dtype=dtype)
+            arr = arr[..., yi, xi]  # (forecast, *z, site, ny, nx)
+            arr = np.moveaxis(arr, -3, 1)  # (forecast, site, *z, ny, nx)
+            parts.append(arr.reshape(arr.shape[0], arr.shape[1], -1))
+        blocks.append(np.concatenate(parts, axis=2))
+
+    # Select one forecast per time.
+    features = xr.DataArray(
+        np.stack(blocks),
+        dims=('reftime', 'forecast', 'site', 'feature'),
+        coords={'reftime': ds.reftime.values, 'forecast': ds.forecast.values},
+    )
+    features = select_forecasts(features.to_dataset(name='features'), times, strategy)
+    array = features['features'].transpose('site', 'time', 'feature').values
+    index = apollo.DatetimeIndex(features.time.values, name='time')
+    return np.ascontiguousarray(array, dtype=dtype), index, columns
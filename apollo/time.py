@@ -4,13 +4,22 @@ The contents of this module are reexported at the top-level, e.g. prefer
 ``apollo.Timestamp`` over ``apollo.timestamps.Timestamp``.
 '''
 
+import functools
 import time
 
 import numpy as np
 import pandas as pd
 
-import pvlib
-from pvlib import solarposition
+
+# The public API, reexported lazily by the `apollo` package.
+__all__ = [
+    'Timestamp',
+    'DatetimeIndex',
+    'date_range',
+    'time_of_day',
+    'time_of_year',
+    'is_daylight',
+]
 
 
 def _localtz():
@@ -244,11 +253,115 @@ def time_of_year(times):
     }, index=times)
 
 
+# The solar zenith angle at sunrise and sunset, in degrees. As in published
+# sunrise and sunset times, this places the upper limb of the sun on the
+# horizon, 16' above its center, corrected for 34' of atmospheric refraction.
+_SUNRISE_ZENITH = 90 + 50 / 60
+
+
+def _compute_sun_events(days, lat, lon):
+    '''Compute sunrise and sunset for many days with the NOAA equations.
+
+    The equations follow the NOAA solar calculator, evaluated at the
+    approximate solar noon of each day. Within the polar circles, the times
+    are within two minutes of those published by the NOAA and the US Naval
+    Observatory. Beyond them, the error grows as the sun grazes the horizon,
+    and the first or last day of a polar day or night may be misjudged.
+
+    Arguments:
+        days (numpy.ndarray):
+            UTC days since the epoch, as integers.
+        lat (float):
+            The latitude.
+        lon (float):
+            The longitude.
+
+    Returns:
+        tuple of numpy.ndarray:
+            A tuple ``(sunrise, sunset, polar_day)``. Sunrise and sunset are
+            minutes since the epoch, or infinity if the sun does not cross the
+            horizon that day. ``polar_day`` is true on days the sun never sets.
+    '''
+    days = np.asarray(days, dtype='float64')
+    noon = 720 - 4 * lon
+    jd = 2440587.5 + days + noon / 1440
+    jc = (jd - 2451545) / 36525
+
+    # The position of the sun.
+    l0 = np.radians((280.46646 + jc * (36000.76983 + jc * 0.0003032)) % 360)
+    m = np.radians(357.52911 + jc * (35999.05029 - 0.0001537 * jc))
+    e = 0.016708634 - jc * (0.000042037 + 0.0000001267 * jc)
+    c = (np.sin(m) * (1.914602 - jc * (0.004817 + 0.000014 * jc))
+        + np.sin(2 * m) * (0.019993 - 0.000101 * jc)
+        + np.sin(3 * m) * 0.000289)
+    omega = np.radians(125.04 - 1934.136 * jc)
+    app_long = np.radians(np.degrees(l0) + c - 0.00569 - 0.00478 * np.sin(omega))
+    mean_obliq = 23 + (26 + (21.448 - jc * (46.815 + jc * (0.00059 - jc * 0.001813))) / 60) / 60
+    obliq = np.radians(mean_obliq + 0.00256 * np.cos(omega))
+    decl = np.arcsin(np.sin(obliq) * np.sin(app_long))
+
+    # The equation of time, in minutes.
+    y = np.tan(obliq / 2) ** 2
+    eq_time = 4 * np.degrees(
+        y * np.sin(2 * l0)
+        - 2 * e * np.sin(m)
+        + 4 * e * y * np.sin(m) * np.cos(2 * l0)
+        - 0.5 * y * y * np.sin(4 * l0)
+        - 1.25 * e * e * np.sin(2 * m)
+    )
+
+    # The hour angle of sunrise, in degrees.
+    phi = np.radians(lat)
+    cos_ha = (np.cos(np.radians(_SUNRISE_ZENITH)) / (np.cos(phi) * np.cos(decl))
+        - np.tan(phi) * np.tan(decl))
+    ha = np.degrees(np.arccos(np.clip(cos_ha, -1, 1)))
+    crosses = np.abs(cos_ha) < 1
+
+    solar_noon = days * 1440 + noon - eq_time
+    sunrise = np.where(crosses, solar_noon - 4 * ha, np.inf)
+    sunset = np.where(crosses, solar_noon + 4 * ha, np.inf)
+    polar_day = cos_ha <= -1
+    return sunrise, sunset, polar_day
+
+
+@functools.lru_cache(maxsize=256)
+def _sun_events(first, last, lat, lon):
+    '''Compute sunrise and sunset for a range of days, memoized.
+
+    Repeated calls for the same times, e.g. when predicting in batches, reuse
+    the result. The arrays are read-only since they are shared by all callers.
+
+    Arguments:
+        first (int):
+            The first UTC day since the epoch.
+        last (int):
+            The last UTC day since the epoch, inclusive.
+        lat (float):
+            The latitude.
+        lon (float):
+            The longitude.
+
+    Returns:
+        tuple of numpy.ndarray:
+            See :func:`_compute_sun_events`.
+    '''
+    days = np.arange(first, last + 1)
+    events = _compute_sun_events(days, lat, lon)
+    for a in events:
+        a.setflags(write=False)
+    return events
+
+
 def is_daylight(times, lat, lon):
     '''Determine if the sun is above the horizon.
 
     The resulting series has a one hour leeway for both sunrise and sunset.
 
+    Sunrise and sunset are computed for each day with vectorized solar
+    position equations, and memoized per location and range of days. Within
+    the polar circles they are within two minutes of published times, which
+    is well inside the leeway. See :func:`_compute_sun_events`.
+
     Arguments:
         times (numpy.ndarray like):
             A series of timestamps.
@@ -263,23 +376,33 @@ def is_daylight(times, lat, lon):
     '''
     times = DatetimeIndex(times, name='time')
 
-    # Compute the time of the next sunrise, sunset, and transit (solar noon).
-    # This computation assumes an altitude of sea-level and determined positions
-    # based on the center of the sun. It could be adjusted for greater accuracy,
-    # but the loss of generality probably isn't worth it.
-    # (`rst` abreviates `rise_set_transit`)
-    rst = solarposition.sun_rise_set_transit_ephem(times, lat, lon)
+    # Work in minutes since the epoch.
+    t = times.values.astype('datetime64[s]').astype('int64') / 60
+    day = np.floor(t / 1440).astype('int64')
+
+    # Compute sunrise and sunset on the days around each time.
+    # The next events after a time occur at most two days later, in UTC.
+    (first, last) = (day.min(), day.max()) if len(day) else (0, -1)
+    events = _sun_events(int(first) - 1, int(last) + 2, float(lat), float(lon))
+    (sunrise, sunset, polar_day) = events
+    k = (day - first + 1)[:, None] + np.arange(-1, 3)
+
+    # Find the next sunrise and next sunset after each time.
+    rises = sunrise[k]
+    sets = sunset[k]
+    next_sunrise = np.where(t[:, None] <= rises, rises, np.inf).min(axis=1)
+    next_sunset = np.where(t[:, None] <= sets, sets, np.inf).min(axis=1)
 
     # Daylight is when the next sunset preceeds the next sunrise.
-    daylight = (rst.sunset < rst.sunrise)
+    # During polar day there is neither.
+    daylight = (next_sunset < next_sunrise)
+    daylight |= np.isinf(next_sunset) & np.isinf(next_sunrise) & polar_day[k[:, 1]]
 
     # Give ourselves leeway to account for the hour in which sunrise/set occurs.
-    one_hour = pd.Timedelta(1, 'h')
-    sunrise_edge = (rst.sunrise - rst.index < one_hour)
-    sunset_edge = (rst.sunset - rst.index < one_hour)
+    sunrise_edge = (next_sunrise - t < 60)
+    sunset_edge = (next_sunset - t < 60)
     daylight |= sunrise_edge
     daylight |= sunset_edge
 
     # Ensure the series has a name.
-    daylight.name = 'daylight'
-    return daylight
+    return pd.Series(daylight, index=times, name='daylight')
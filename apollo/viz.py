@@ -17,6 +17,17 @@ from mpl_toolkits.axes_grid1 import make_axes_locatable
 import apollo
 
 
+# The public API, reexported lazily by the `apollo` package.
+__all__ = [
+    'DAYS',
+    'MONTHS',
+    'MAP_FEATURES',
+    'date_heatmap',
+    'date_heatmap_figure',
+    'nam_figure',
+]
+
+
 DAYS = np.array(['Sun.', 'Mon.', 'Tues.', 'Wed.', 'Thurs.', 'Fri.', 'Sat.'])
 MONTHS = np.array(['Jan.', 'Feb.', 'Mar.', 'Apr.', 'May', 'June',
         'July', 'Aug.', 'Sept.', 'Oct.', 'Nov.', 'Dec.'])
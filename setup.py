@@ -50,6 +50,6 @@ setup(
         # 'License :: OSI Approved :: MIT License',
 
         # Supported Python versions
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
     ],
 )
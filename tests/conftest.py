@@ -0,0 +1,160 @@
+import pytest
+
+
+@pytest.fixture
+def apollo_data(tmp_path, monkeypatch):
+    '''Point the Apollo database at an empty temporary directory.
+    '''
+    monkeypatch.setenv('APOLLO_DATA', str(tmp_path))
+    monkeypatch.delenv('APOLLO_NAM_STORE', raising=False)
+    return tmp_path
+
+
+class _HTTPServer:
+    '''A local HTTP server standing in for the NOAA servers.
+
+    Files are served from :attr:`files`, keyed by URL path. Range requests
+    are honored with single-part or ``multipart/byteranges`` responses unless
+    :attr:`ranges` is false, in which case the whole file is sent with a 200.
+    If :attr:`content_range` is false, single-part 206 responses omit their
+    ``Content-Range`` header. Every request is logged in :attr:`requests` as a
+    pair ``(path, range_header)``, and :attr:`connections` counts the TCP
+    connections accepted.
+    '''
+
+    def __init__(self):
+        import http.server
+        import threading
+
+        self.files = {}
+        self.ranges = True
+        self.content_range = True
+        self.requests = []
+        self.connections = 0
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                server.connections += 1
+                super().setup()
+
+            def do_GET(self):
+                spec = self.headers.get('Range')
+                server.requests.append((self.path, spec))
+                body = server.files.get(self.path)
+                if body is None:
+                    return self.reply(404, b'not found')
+                if spec is None or not server.ranges:
+                    return self.reply(200, body)
+
+                ranges = []
+                for r in spec[len('bytes='):].split(','):
+                    (a, _, b) = r.partition('-')
+                    (a, b) = (int(a), int(b) + 1 if b else len(body))
+                    if len(body) <= a:
+                        headers = {'Content-Range': f'bytes */{len(body)}'}
+                        return self.reply(416, b'', headers)
+                    ranges.append((a, min(b, len(body))))
+
+                if len(ranges) == 1:
+                    (a, b) = ranges[0]
+                    headers = {}
+                    if server.content_range:
+                        headers['Content-Range'] = f'bytes {a}-{b-1}/{len(body)}'
+                    return self.reply(206, body[a:b], headers)
+
+                boundary = 'BOUNDARY'
+                parts = []
+                for (a, b) in ranges:
+                    parts.append(
+                        f'--{boundary}\r\n'
+                        f'Content-Type: application/octet-stream\r\n'
+                        f'Content-Range: bytes {a}-{b-1}/{len(body)}\r\n\r\n'
+                        .encode('ascii') + body[a:b] + b'\r\n'
+                    )
+                parts.append(f'--{boundary}--\r\n'.encode('ascii'))
+                ctype = f'multipart/byteranges; boundary={boundary}'
+                self.reply(206, b''.join(parts), {'Content-Type': ctype})
+
+            def reply(self, status, body, headers=None):
+                self.send_response(status)
+                for (k, v) in (headers or {}).items():
+                    self.send_header(k, v)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def url(self, path):
+        (host, port) = self._server.server_address
+        return f'http://{host}:{port}{path}'
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def http_server():
+    '''A local HTTP server standing in for the NOAA servers.
+    '''
+    server = _HTTPServer()
+    yield server
+    server.close()
+
+
+def make_forecast(reftime, forecast, nx=4, ny=3, seed=0):
+    '''Build a synthetic forecast hour, shaped like a processed GRIB.
+
+    The dataset has a planar variable ``DSWRF_SFC`` and an isobaric variable
+    ``TMP_ISBL`` with two levels, on a small grid in the NAM218 projection.
+    Values are random but reproducible for a given seed and forecast hour.
+    '''
+    import numpy as np
+    import pandas as pd
+    import xarray as xr
+
+    rng = np.random.RandomState(seed * 1000 + forecast)
+    reftime = pd.Timestamp(reftime)
+    if reftime.tz is not None:
+        reftime = reftime.tz_convert(None)
+    hours = int((reftime - pd.Timestamp('1970-01-01')) / pd.Timedelta(1, 'h'))
+    x = 12000.0 * np.arange(nx) + 1000.0
+    y = 12000.0 * np.arange(ny) - 2000.0
+
+    def var(z, shape):
+        data = rng.uniform(0, 100, (1, 1, *shape, ny, nx)).astype('float32')
+        return (('reftime', 'forecast', z, 'y', 'x'), data)
+
+    ds = xr.Dataset(
+        data_vars={
+            'DSWRF_SFC': var('z_SFC', (1,)),
+            'TMP_ISBL': var('z_ISBL', (2,)),
+        },
+        coords={
+            'reftime': ('reftime', [hours], {'units': 'hours since 1970-01-01T00:00'}),
+            'forecast': ('forecast', [forecast], {'units': 'hours'}),
+            'z_SFC': ('z_SFC', [0.0]),
+            'z_ISBL': ('z_ISBL', [50000.0, 70000.0]),
+            'x': ('x', x),
+            'y': ('y', y),
+            'lat': (('y', 'x'), 33.0 + 0.1 * np.add.outer(np.arange(ny), np.zeros(nx))),
+            'lon': (('y', 'x'), -84.0 + 0.1 * np.add.outer(np.zeros(ny), np.arange(nx))),
+        },
+    )
+    return xr.decode_cf(ds)
+
+
+@pytest.fixture
+def nam_forecast():
+    '''A factory for synthetic forecast hours, see :func:`make_forecast`.
+    '''
+    return make_forecast
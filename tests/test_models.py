@@ -0,0 +1,209 @@
+import logging
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('sklearn')
+pytest.importorskip('pickle5')
+pytest.importorskip('xarray')
+
+from sklearn.linear_model import SGDRegressor
+from sklearn.multioutput import MultiOutputRegressor
+
+from apollo import nam
+from apollo.models.base import IrradianceModel
+
+
+class _Model(IrradianceModel):
+    '''A model whose feature data is missing or empty on some days.
+
+    With ``gaps``, the features of every other hour are NaN.
+    '''
+    def __init__(self, missing=(), empty=(), gaps=False, **kwargs):
+        estimator = MultiOutputRegressor(SGDRegressor())
+        super().__init__(estimator=estimator, **kwargs)
+        self.missing = list(missing)
+        self.empty = list(empty)
+        self.gaps = gaps
+
+    def load_data(self, index):
+        day = index[0].day
+        if day in self.missing:
+            raise nam.CacheMiss(f'no data for day {day}')
+        if day in self.empty:
+            index = index[:0]
+        x = np.arange(len(index), dtype='float64')
+        if self.gaps:
+            x[::2] = np.nan
+        return pd.DataFrame({'x': x, 'y': x ** 2}, index=index)
+
+
+def _targets(days):
+    index = pd.date_range('2019-01-01', periods=24*days, freq='1h', tz='UTC')
+    return pd.DataFrame({'ghi': np.arange(len(index), dtype='float64')}, index=index)
+
+
+def test_fit_chunked_skips_chunks_without_data(caplog):
+    model = _Model(missing=[1], empty=[2], standardize=True)
+    with caplog.at_level(logging.DEBUG, logger='apollo.models.base'):
+        model.fit(_targets(3), chunksize='1D')
+
+    # Only the third day reaches the scalers and the estimator.
+    assert model.feature_scaler.n_samples_seen_ == 24
+    assert model.target_scaler.n_samples_seen_ == 24
+    skipped = [r for r in caplog.records if 'skipping chunk' in r.getMessage()]
+    assert len(skipped) == 4  # Two chunks in each of two passes.
+
+
+def test_fit_chunked_raises_without_data():
+    model = _Model(missing=[1], empty=[2])
+    with pytest.raises(ValueError):
+        model.fit(_targets(2), chunksize='1D')
+
+
+def test_predict_indexes_kept_rows():
+    targets = _targets(1)
+    model = _Model(standardize=True).fit(targets)
+
+    # Rows with NaN features are dropped by preprocess.
+    model.gaps = True
+    predictions = model.predict(targets.index)
+    assert list(predictions.index) == list(targets.index[1::2])
+
+
+def test_iter_predict_rejects_unknown_errors():
+    model = _Model().fit(_targets(1))
+    with pytest.raises(ValueError):
+        model.iter_predict(_targets(1).index, '1D', errors='ignore')
+
+
+def test_iter_predict_skips_only_cache_misses():
+    model = _Model().fit(_targets(1))
+    model.missing = [2]
+    index = _targets(3).index
+    predictions = list(model.iter_predict(index, '1D', errors='skip'))
+    assert [p.index[0].day for p in predictions] == [1, 3]
+
+    model.estimator.predict = None  # Not a cache miss.
+    with pytest.raises(TypeError):
+        list(model.iter_predict(index, '1D', errors='skip'))
+
+
+def test_loaded_model_can_be_trained(tmp_path):
+    from apollo.models import load_model
+
+    targets = _targets(2)
+    model = _Model(standardize=True).fit(targets[:24])
+    path = model.save(tmp_path / 'model.model')
+
+    # Memory-mapped arrays are read-only, so they are opt-in.
+    mapped = load_model(path, memmap=True)
+    coef = mapped.estimator.estimators_[0].coef_
+    assert not coef.flags.writeable
+
+    loaded = load_model(path)
+    loaded.partial_fit(targets[24:])
+    assert loaded.feature_scaler.n_samples_seen_ == 48
+
+
+def test_predict_in_batches_without_any_batch():
+    model = _Model().fit(_targets(1))
+    model.missing = [1, 2]
+
+    predictions = model.predict(_targets(2).index, chunksize='1D', errors='skip')
+    assert len(predictions) == 0
+    assert list(predictions.columns) == ['ghi']
+
+    predictions = model.predict(_targets(2).index[:0], chunksize='1D')
+    assert len(predictions) == 0
+    assert list(predictions.columns) == ['ghi']
+
+
+def _reference_preprocess(model, data, targets=None, fit=False):
+    '''Preprocess with pandas, as IrradianceModel did before working on arrays.
+    '''
+    import apollo
+
+    if fit:
+        model.columns = list(targets.columns)
+
+    data = data.replace([np.inf, -np.inf], np.nan).dropna()
+    if targets is not None:
+        targets = targets.replace([np.inf, -np.inf], np.nan).dropna()
+        targets = targets.groupby(targets.index.floor('1h')).mean()
+
+    if targets is not None and model.daylight_only:
+        (lat, lon) = model.center
+        targets = targets[apollo.is_daylight(targets.index, lat, lon)]
+
+    if targets is not None:
+        index = data.index.intersection(targets.index)
+        data = data.loc[index]
+        targets = targets.loc[index]
+    index = data.index
+
+    data = data.astype('float64')
+    if model.standardize:
+        cols = list(data.columns)
+        if fit: model.feature_scaler.fit(data[cols].to_numpy())
+        data[cols] = model.feature_scaler.transform(data[cols].to_numpy())
+    if model.standardize and targets is not None:
+        cols = model.columns
+        if fit: model.target_scaler.fit(targets[cols].to_numpy())
+        targets[cols] = model.target_scaler.transform(targets[cols].to_numpy())
+
+    if model.add_time_of_day:
+        data = data.join(apollo.time_of_day(index))
+    if model.add_time_of_year:
+        data = data.join(apollo.time_of_year(index))
+
+    raw_targets = None if targets is None else targets[model.columns].to_numpy()
+    return data.to_numpy(), raw_targets, index
+
+
+def _messy_data(seed=0):
+    '''Features and targets with gaps, duplicates, and mismatched indices.
+    '''
+    rng = np.random.RandomState(seed)
+    index = pd.date_range('2019-06-01', periods=24*4, freq='1h', tz='UTC')
+    data = pd.DataFrame(rng.normal(size=(len(index), 3)), index=index, columns=['a', 'b', 'c'])
+    data.iloc[rng.choice(len(index), 8, replace=False), 0] = np.nan
+    data.iloc[rng.choice(len(index), 4, replace=False), 1] = np.inf
+
+    # Targets every 20 minutes, averaged into hours, offset from the features.
+    index = pd.date_range('2019-06-02', periods=3*24*4, freq='20min', tz='UTC')
+    targets = pd.DataFrame(rng.uniform(0, 1000, size=(len(index), 2)),
+        index=index, columns=['ghi', 'dni'])
+    targets.iloc[rng.choice(len(index), 10, replace=False), 1] = np.nan
+    return data, targets
+
+
+@pytest.mark.parametrize('standardize', [False, True])
+@pytest.mark.parametrize('daylight_only', [False, True])
+@pytest.mark.parametrize('time_features', [False, True])
+def test_preprocess_matches_pandas_reference(standardize, daylight_only, time_features):
+    data, targets = _messy_data()
+    kwargs = dict(
+        standardize=standardize,
+        daylight_only=daylight_only,
+        add_time_of_day=time_features,
+        add_time_of_year=time_features,
+    )
+
+    model = _Model(**kwargs)
+    reference = _Model(**kwargs)
+    model.center = reference.center = (33.9, -83.4)
+    (x, y, index) = model.preprocess(data, targets, fit=True, return_index=True)
+    (ex, ey, eindex) = _reference_preprocess(reference, data, targets, fit=True)
+    assert 0 < len(index) < len(data)
+    assert list(index) == list(eindex)
+    np.testing.assert_allclose(x, ex)
+    np.testing.assert_allclose(y, ey)
+
+    # Without targets, every complete row is kept.
+    (x, y, index) = model.preprocess(data, return_index=True)
+    (ex, ey, eindex) = _reference_preprocess(reference, data)
+    assert y is None and ey is None
+    assert list(index) == list(eindex)
+    np.testing.assert_allclose(x, ex)
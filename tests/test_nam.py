@@ -0,0 +1,254 @@
+import gc
+import threading
+import time
+import weakref
+
+import numpy as np
+import pytest
+
+xr = pytest.importorskip('xarray')
+pytest.importorskip('netCDF4')
+
+from apollo import nam
+
+
+class _Forecast:
+    '''A stand-in for a processed forecast hour.
+    '''
+    def __init__(self, forecast):
+        self.forecast = forecast
+
+
+class _File:
+    def close(self):
+        pass
+
+
+class _Dataset:
+    def load(self):
+        return self
+
+
+def test_download_releases_written_forecasts(apollo_data, monkeypatch):
+    written = []
+
+    def download_forecast(reftime, forecast, **kwargs):
+        return _Forecast(forecast)
+
+    def create_nc(path, ds, **policy):
+        path.touch()
+        return _File()
+
+    def write_nc(nc, ds, forecast):
+        # Every forecast hour written before this one must have been freed.
+        gc.collect()
+        assert all(ref() is None for ref in written)
+        written.append(weakref.ref(ds))
+
+    monkeypatch.setattr(nam, '_download_forecast', download_forecast)
+    monkeypatch.setattr(nam, '_create_nc', create_nc)
+    monkeypatch.setattr(nam, '_write_nc', write_nc)
+    monkeypatch.setattr(nam, '_open_dataset', lambda paths: _Dataset())
+
+    nam.download('2019-01-01T00:00', save_nc=False, keep_gribs=True, max_workers=1)
+    assert len(written) == len(nam.FORECAST_PERIOD)
+
+
+def _fake_store(monkeypatch, download_forecast):
+    '''Replace the GRIB and netCDF I/O of :func:`nam.download`.
+
+    Returns:
+        list:
+            The forecast hours written, in the order they were written.
+    '''
+    written = []
+
+    def create_nc(path, ds, **policy):
+        path.touch()
+        return _File()
+
+    def write_nc(nc, ds, forecast):
+        written.append(forecast)
+
+    monkeypatch.setattr(nam, '_download_forecast', download_forecast)
+    monkeypatch.setattr(nam, '_create_nc', create_nc)
+    monkeypatch.setattr(nam, '_write_nc', write_nc)
+    monkeypatch.setattr(nam, '_open_dataset', lambda paths: _Dataset())
+    return written
+
+
+def test_download_bounds_concurrent_workers(apollo_data, monkeypatch):
+    lock = threading.Lock()
+    active = [0]
+    peak = [0]
+
+    def download_forecast(reftime, forecast, **kwargs):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.01)
+        with lock:
+            active[0] -= 1
+        return _Forecast(forecast)
+
+    written = _fake_store(monkeypatch, download_forecast)
+    nam.download('2019-01-01T00:00', save_nc=False, keep_gribs=True, max_workers=3)
+    assert sorted(written) == list(nam.FORECAST_PERIOD)
+    assert 1 < peak[0] <= 3
+
+
+def test_download_failure_discards_partial_file(apollo_data, monkeypatch):
+    def download_forecast(reftime, forecast, **kwargs):
+        if forecast == 5:
+            raise IOError('download failed')
+        return _Forecast(forecast)
+
+    _fake_store(monkeypatch, download_forecast)
+    path = nam.nc_path('2019-01-01T00:00')
+    with pytest.raises(IOError):
+        nam.download('2019-01-01T00:00', keep_gribs=True, max_workers=2)
+    assert not path.exists()
+    assert not path.with_name(path.name + '.part').exists()
+
+
+def test_download_grib_reads_under_hdf5_lock(apollo_data, monkeypatch):
+    path = nam.grib_path('2019-01-01T00:00', 0)
+    path.parent.mkdir(parents=True)
+    path.touch()
+
+    opened = {}
+    def open_dataset(path, **kwargs):
+        opened.update(kwargs)
+    monkeypatch.setattr(nam.xr, 'open_dataset', open_dataset)
+
+    nam._download_grib('2019-01-01T00:00', 0)
+    assert opened['engine'] == 'pynio'
+    assert opened['lock'] is nam.HDF5_LOCK
+
+
+def test_slice_indices_never_scans_the_store(apollo_data, monkeypatch):
+    monkeypatch.setattr(nam, '_slice_cache', {})
+
+    def scan(conn):
+        raise AssertionError('the store was scanned')
+
+    data = xr.Dataset(coords={'x': [0.0, 1.0, 2.0], 'y': [0.0, 1.0]})
+    monkeypatch.setattr(nam, '_scan_catalog', scan)
+    monkeypatch.setattr(nam, '_compute_slice_indices', lambda *args: (0, 2, 0, 1))
+    assert nam.slice_indices(data, (33.0, -83.0), 1.0) == {'x': slice(0, 2), 'y': slice(0, 1)}
+
+    # The window is persisted and reused by a fresh process.
+    def compute(*args):
+        raise AssertionError('the window was recomputed')
+
+    monkeypatch.setattr(nam, '_slice_cache', {})
+    monkeypatch.setattr(nam, '_compute_slice_indices', compute)
+    assert nam.slice_indices(data, (33.0, -83.0), 1.0) == {'x': slice(0, 2), 'y': slice(0, 1)}
+
+    # The forecasts table is still built on first use of the catalog.
+    scans = []
+    monkeypatch.setattr(nam, '_scan_catalog', scans.append)
+    nam._connect_catalog().close()
+    nam._connect_catalog().close()
+    assert len(scans) == 1
+
+
+def test_download_writes_every_forecast_hour(apollo_data, monkeypatch, nam_forecast):
+    reftime = '2019-01-01T00:00'
+    monkeypatch.setattr(nam, '_download_forecast',
+        lambda reftime, forecast, **kwargs: nam_forecast(reftime, forecast))
+    nam.download(reftime, keep_gribs=True, max_workers=4)
+
+    with xr.open_dataset(nam.nc_path(reftime)) as ds:
+        assert ds.DSWRF_SFC.shape == (1, len(nam.FORECAST_PERIOD), 1, 3, 4)
+        for (i, forecast) in enumerate(nam.FORECAST_PERIOD):
+            expected = nam_forecast(reftime, forecast)
+            for name in ('DSWRF_SFC', 'TMP_ISBL'):
+                np.testing.assert_array_equal(ds[name][0, i], expected[name][0, 0])
+
+
+def test_netcdf_writes_hold_the_hdf5_lock(tmp_path, nam_forecast):
+    ds = nam_forecast('2019-01-01T00:00', 0)
+    done = threading.Event()
+
+    def write():
+        nc = nam._create_nc(tmp_path / 'forecast.nc', ds)
+        nam._write_nc(nc, ds, 0)
+        nam._close_nc(nc)
+        done.set()
+
+    with nam.HDF5_LOCK:
+        thread = threading.Thread(target=write)
+        thread.start()
+        assert not done.wait(0.2)
+    thread.join()
+    assert done.is_set()
+
+
+def _overlapping_forecasts(n_reftimes=4, nans=0.1, seed=0):
+    '''Build a dataset of forecasts whose valid times overlap.
+    '''
+    rng = np.random.RandomState(seed)
+    reftimes = np.datetime64('2018-01-01T00:00', 'ns') + np.arange(n_reftimes) * np.timedelta64(6, 'h')
+    forecasts = np.arange(36) * np.timedelta64(1, 'h')
+    data = rng.uniform(0, 100, (n_reftimes, 36, 2, 3))
+    data[rng.uniform(size=data.shape) < nans] = np.nan
+    return xr.Dataset(
+        data_vars={'DSWRF_SFC': (('reftime', 'forecast', 'y', 'x'), data)},
+        coords={'reftime': reftimes, 'forecast': forecasts},
+    )
+
+
+def _brute_force_select(ds, times, strategy):
+    '''Select forecasts one valid time and one source at a time.
+    '''
+    if strategy == 'best':
+        windows = None
+    elif isinstance(strategy, int):
+        windows = {strategy: 1.0}
+    else:
+        windows = strategy
+
+    values = {}
+    for t in times:
+        sources = [
+            (f, ds.DSWRF_SFC.sel(reftime=r, forecast=f).values)
+            for r in ds.reftime.values
+            for f in ds.forecast.values
+            if r + f == t
+        ]
+        if not sources: continue
+        if windows is None:
+            values[t] = min(sources, key=lambda s: s[0])[1]
+            continue
+        num = den = 0
+        selected = False
+        for (k, w) in windows.items():
+            lo, hi = np.timedelta64(6*k, 'h'), np.timedelta64(6*k + 6, 'h')
+            for (f, v) in sources:
+                if lo <= f < hi:
+                    selected = True
+                    ok = ~np.isnan(v)
+                    num = num + w * np.where(ok, v, 0)
+                    den = den + w * ok
+        if selected:
+            values[t] = num / den
+    return values
+
+
+@pytest.mark.parametrize('strategy', ['best', 0, 2, 5, {0: 1, 1: 1}, {0: 3, 4: 1}])
+def test_select_forecasts_matches_brute_force(strategy):
+    ds = _overlapping_forecasts()
+    times = np.datetime64('2017-12-31T18:00', 'ns') + np.arange(72) * np.timedelta64(1, 'h')
+    expected = _brute_force_select(ds, times, strategy)
+
+    with np.errstate(invalid='ignore'):
+        result = nam.select_forecasts(ds, times, strategy=strategy)
+    assert list(result.time.values) == sorted(expected)
+    for t in result.time.values:
+        np.testing.assert_allclose(result.DSWRF_SFC.sel(time=t).values, expected[t])
+
+
+def test_select_forecasts_rejects_unknown_strategy():
+    with pytest.raises(ValueError):
+        nam.select_forecasts(_overlapping_forecasts(), [], strategy=6)
@@ -0,0 +1,218 @@
+import pytest
+
+pytest.importorskip('xarray')
+pytest.importorskip('netCDF4')
+
+from apollo import nam
+
+
+DATA = bytes(range(256)) * 64
+
+
+def test_stream_download_fetches_whole_file(tmp_path, http_server):
+    http_server.files['/a.grib'] = DATA
+    path = tmp_path / 'a.grib'
+    nam._stream_download(http_server.url('/a.grib'), path, chunk_size=1000)
+    assert path.read_bytes() == DATA
+    assert http_server.requests == [('/a.grib', None)]
+
+
+def test_stream_download_resumes_partial_file(tmp_path, http_server):
+    http_server.files['/a.grib'] = DATA
+    path = tmp_path / 'a.grib'
+    path.write_bytes(DATA[:5000])
+    nam._stream_download(http_server.url('/a.grib'), path)
+    assert path.read_bytes() == DATA
+    assert http_server.requests == [('/a.grib', 'bytes=5000-')]
+
+
+def test_stream_download_restarts_when_range_is_ignored(tmp_path, http_server):
+    http_server.files['/a.grib'] = DATA
+    http_server.ranges = False
+    path = tmp_path / 'a.grib'
+    path.write_bytes(DATA[:5000])
+    nam._stream_download(http_server.url('/a.grib'), path)
+    assert path.read_bytes() == DATA
+
+
+def test_stream_download_discards_unresumable_file(tmp_path, http_server):
+    http_server.files['/a.grib'] = DATA
+    path = tmp_path / 'a.grib'
+    path.write_bytes(DATA + b'extra')
+    with pytest.raises(IOError):
+        nam._stream_download(http_server.url('/a.grib'), path)
+    assert not path.exists()
+
+
+def test_stream_download_raises_on_missing_file(tmp_path, http_server):
+    with pytest.raises(IOError):
+        nam._stream_download(http_server.url('/missing.grib'), tmp_path / 'a.grib')
+
+
+def _message(n):
+    '''A GRIB2 message with ``n`` bytes of payload.
+    '''
+    length = 16 + n
+    return b'GRIB\0\0\0\x02' + length.to_bytes(8, 'big') + bytes([n % 256]) * n
+
+
+def _grib(descs, listed=None):
+    '''Build a GRIB and its ``.idx`` inventory from message descriptions.
+
+    Only the first ``listed`` messages appear in the inventory.
+    '''
+    messages = [_message(100 + 10*i) for i in range(len(descs))]
+    lines = []
+    offset = 0
+    for (i, (desc, msg)) in enumerate(zip(descs, messages)):
+        lines.append(f'{i+1}:{offset}:d=2019010100:{desc}:')
+        offset += len(msg)
+    idx = '\n'.join(lines[:listed]) + '\n'
+    return messages, idx.encode('ascii')
+
+
+# Wanted messages are DSWRF at the surface, and every isobaric TMP.
+DESCS = [
+    'DSWRF:surface:anl',
+    'FOO:surface:anl',
+    'TMP:500 mb:anl',
+    'BAR:surface:anl',
+    'BAZ:surface:anl',
+]
+
+
+def _serve(http_server, descs, listed=None):
+    messages, idx = _grib(descs, listed)
+    http_server.files['/a.grib'] = b''.join(messages)
+    http_server.files['/a.grib.idx'] = idx
+    return messages
+
+
+def test_subset_download_single_range(tmp_path, http_server):
+    messages = _serve(http_server, ['FOO:surface:anl', 'DSWRF:surface:anl'])
+    path = tmp_path / 'a.grib'
+    assert nam._subset_download(http_server.url('/a.grib'), path)
+    assert path.read_bytes() == messages[1]
+
+
+def test_subset_download_multipart_ranges(tmp_path, http_server):
+    messages = _serve(http_server, DESCS)
+    path = tmp_path / 'a.grib'
+    assert nam._subset_download(http_server.url('/a.grib'), path)
+    assert path.read_bytes() == messages[0] + messages[2]
+
+
+def test_subset_download_whole_file_response(tmp_path, http_server):
+    messages = _serve(http_server, DESCS)
+    http_server.ranges = False
+    path = tmp_path / 'a.grib'
+    assert nam._subset_download(http_server.url('/a.grib'), path)
+    assert path.read_bytes() == messages[0] + messages[2]
+
+
+def test_subset_download_missing_inventory(tmp_path, http_server):
+    _serve(http_server, DESCS)
+    del http_server.files['/a.grib.idx']
+    assert not nam._subset_download(http_server.url('/a.grib'), tmp_path / 'a.grib')
+
+
+def test_subset_download_short_inventory(tmp_path, http_server):
+    # The inventory stops before the last message, which is wanted.
+    _serve(http_server, DESCS[:4] + ['DLWRF:surface:anl'], listed=4)
+    assert not nam._subset_download(http_server.url('/a.grib'), tmp_path / 'a.grib')
+
+
+def test_subset_download_inventory_without_wanted_messages(tmp_path, http_server):
+    _serve(http_server, ['FOO:surface:anl', 'BAR:surface:anl'])
+    assert not nam._subset_download(http_server.url('/a.grib'), tmp_path / 'a.grib')
+
+
+def test_subset_download_requires_content_range(tmp_path, http_server):
+    _serve(http_server, ['FOO:surface:anl', 'DSWRF:surface:anl'])
+    http_server.content_range = False
+    with pytest.raises(IOError):
+        nam._subset_download(http_server.url('/a.grib'), tmp_path / 'a.grib')
+
+
+@pytest.fixture
+def grib_source(apollo_data, http_server, monkeypatch):
+    '''Serve every GRIB from the local server and skip decoding them.
+    '''
+    monkeypatch.setattr(nam, 'grib_url', lambda reftime, forecast: http_server.url('/a.grib'))
+    monkeypatch.setattr(nam.xr, 'open_dataset', lambda path, **kwargs: path)
+    return http_server
+
+
+def test_download_grib_writes_subset_apart(grib_source):
+    messages = _serve(grib_source, DESCS)
+    path = nam._download_grib('2019-01-01T00:00', 0, subset=True)
+    assert path == nam.grib_path('2019-01-01T00:00', 0, subset=True)
+    assert path.read_bytes() == messages[0] + messages[2]
+    assert not nam.grib_path('2019-01-01T00:00', 0).exists()
+
+    # A full download does not reuse the subset.
+    path = nam._download_grib('2019-01-01T00:00', 0)
+    assert path == nam.grib_path('2019-01-01T00:00', 0)
+    assert path.read_bytes() == b''.join(messages)
+
+
+def test_download_grib_subset_reuses_full_file(grib_source):
+    _serve(grib_source, DESCS)
+    full = nam._download_grib('2019-01-01T00:00', 0)
+    n = len(grib_source.requests)
+    assert nam._download_grib('2019-01-01T00:00', 0, subset=True) == full
+    assert len(grib_source.requests) == n
+
+
+def test_download_grib_falls_back_to_full_file(grib_source):
+    messages = _serve(grib_source, DESCS)
+    del grib_source.files['/a.grib.idx']
+    path = nam._download_grib('2019-01-01T00:00', 0, subset=True)
+    assert path == nam.grib_path('2019-01-01T00:00', 0)
+    assert path.read_bytes() == b''.join(messages)
+
+
+def test_download_grib_retries_bad_range_response(grib_source, monkeypatch):
+    _serve(grib_source, ['FOO:surface:anl', 'DSWRF:surface:anl'])
+    grib_source.content_range = False
+    sleeps = []
+    monkeypatch.setattr(nam, 'sleep', sleeps.append)
+    with pytest.raises(IOError):
+        nam._download_grib('2019-01-01T00:00', 0, subset=True, max_tries=3)
+    assert sleeps == [1, 2]
+
+
+@pytest.fixture
+def fresh_session(monkeypatch):
+    '''Start without a shared HTTP session, and close the one created.
+    '''
+    monkeypatch.setattr(nam, '_http_session', None)
+    monkeypatch.setattr(nam, '_http_session_config', None)
+    yield
+    if nam._http_session is not None:
+        nam._http_session.close()
+
+
+def test_http_session_is_shared(fresh_session):
+    session = nam.http_session()
+    assert nam.http_session() is session
+    assert nam.http_session(pool_size=16) is session
+
+
+def test_http_session_is_replaced_when_configured(fresh_session):
+    session = nam.http_session()
+    replaced = nam.http_session(pool_size=4, max_retries=0)
+    assert replaced is not session
+    adapter = replaced.get_adapter('https://nomads.ncep.noaa.gov/')
+    assert adapter._pool_maxsize == 4
+    assert adapter.max_retries.total == 0
+
+    # Unspecified options keep their current value.
+    assert nam.http_session(backoff_factor=1.0).get_adapter('http://x/')._pool_maxsize == 4
+
+
+def test_downloads_reuse_connections(fresh_session, tmp_path, http_server):
+    http_server.files['/a.grib'] = DATA
+    for i in range(5):
+        nam._stream_download(http_server.url('/a.grib'), tmp_path / f'{i}.grib')
+    assert http_server.connections == 1
@@ -0,0 +1,182 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('sklearn')
+pytest.importorskip('pickle5')
+xr = pytest.importorskip('xarray')
+pytest.importorskip('netCDF4')
+pytest.importorskip('cartopy')
+
+import apollo
+from apollo import nam
+from apollo.models.nam_model import NamModel
+
+from conftest import make_forecast
+
+
+REFTIMES = ['2018-01-01T00:00', '2018-01-01T06:00']
+
+# The grid of the synthetic forecasts has 5x5 cells spaced 12 km apart.
+# The center of the model is the middle cell, and its area spans 3x3 cells.
+CENTER_XY = (25000.0, 22000.0)
+SHAPE = 36000
+
+
+@pytest.fixture
+def center():
+    '''The latitude and longitude of the middle cell of the synthetic grid.
+    '''
+    import cartopy.crs as ccrs
+    lon, lat = ccrs.PlateCarree().transform_point(*CENTER_XY, nam.NAM218)
+    return (lat, lon)
+
+
+def _store(reftime, seed=0, noise=0.0, hours=3):
+    '''Write a synthetic forecast into the netCDF store.
+
+    With ``noise``, the projected coordinates are shifted by that many meters.
+    '''
+    reftime = apollo.Timestamp(reftime)
+    ds = xr.concat([
+        make_forecast(reftime, f, nx=5, ny=5, seed=seed)
+        for f in range(hours)
+    ], dim='forecast')
+    ds['x'] = ds.x + noise
+    ds['y'] = ds.y - noise
+    path = nam.nc_path(reftime)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    nam.write_nc(ds, path)
+    return ds
+
+
+def _model(center, **kwargs):
+    kwargs.setdefault('features', ['DSWRF_SFC', 'TMP_ISBL'])
+    return NamModel(center=center, shape=SHAPE, **kwargs)
+
+
+def _index():
+    return pd.date_range('2018-01-01T00:00', '2018-01-01T08:00', freq='1h', tz='UTC')
+
+
+def test_load_data_names_columns_by_offset(apollo_data, center):
+    ds = _store(REFTIMES[0])
+    data = _model(center, feature_cache=False).load_data(_index()[:3])
+
+    columns = list(data.columns)
+    assert len(columns) == 9 + 18
+    assert columns[0] == ('DSWRF_SFC', 0.0, -1, -1)
+    assert columns[4] == ('DSWRF_SFC', 0.0, 0, 0)
+    assert columns[9] == ('TMP_ISBL', 50000.0, -1, -1)
+    assert columns[-1] == ('TMP_ISBL', 70000.0, 1, 1)
+
+    # The middle column is the cell at the center.
+    expected = ds.DSWRF_SFC.values[0, :, 0, 2, 2]
+    np.testing.assert_array_equal(data[('DSWRF_SFC', 0.0, 0, 0)].values, expected)
+
+
+def test_load_data_tolerates_grid_noise(apollo_data, center):
+    a = _store(REFTIMES[0], seed=0)
+    b = _store(REFTIMES[1], seed=1, noise=1e-3)
+    data = _model(center, feature_cache=False).load_data(_index())
+
+    assert list(data.index.hour) == [0, 1, 2, 6, 7, 8]
+    assert data.shape[1] == 27
+    np.testing.assert_array_equal(data.iloc[:3, 4].values, a.DSWRF_SFC.values[0, :, 0, 2, 2])
+    np.testing.assert_array_equal(data.iloc[3:, 4].values, b.DSWRF_SFC.values[0, :, 0, 2, 2])
+
+
+def test_load_data_recomputes_shards_of_older_layouts(apollo_data, center):
+    ds = _store(REFTIMES[0])
+    model = _model(center)
+    reftime = apollo.Timestamp(REFTIMES[0])
+
+    # Write a shard like those named by projected coordinates.
+    hours = ds.forecast.values.astype('timedelta64[ns]')
+    matrix = np.zeros((3, 27), dtype='float32')
+    columns = [('DSWRF_SFC', 0.0, 10000.0, 13000.0)] * 27
+    model._write_shard(reftime, hours, matrix, columns)
+    path = model._shard_path(reftime)
+    with np.load(path) as shard:
+        old = {k: shard[k] for k in shard.files if k != 'format'}
+    np.savez(path, **old)
+
+    data = model.load_data(_index()[:3])
+    assert data.columns[4] == ('DSWRF_SFC', 0.0, 0, 0)
+    np.testing.assert_array_equal(data.iloc[:, 4].values, ds.DSWRF_SFC.values[0, :, 0, 2, 2])
+    with np.load(path) as shard:
+        assert int(shard['format']) == 2
+
+
+def _forbid_open(monkeypatch):
+    '''Fail the test if any forecast is read from the NAM store.
+    '''
+    def open(*args, **kwargs):
+        raise AssertionError('the NAM store was read')
+    monkeypatch.setattr(nam, 'open', open)
+
+
+def test_feature_cache_hit(apollo_data, center, monkeypatch):
+    _store(REFTIMES[0])
+    model = _model(center)
+    expected = model.load_data(_index()[:3])
+    assert model._shard_path(REFTIMES[0]).exists()
+
+    # Another model with the same spec reads the same shards.
+    _forbid_open(monkeypatch)
+    data = _model(center).load_data(_index()[:3])
+    pd.testing.assert_frame_equal(data, expected)
+
+
+def test_feature_cache_miss(apollo_data, center):
+    _store(REFTIMES[0])
+    model = _model(center)
+    model.load_data(_index()[:3])
+
+    # The spec determines the cache directory.
+    other = _model(center, features=['DSWRF_SFC'])
+    assert other.feature_cache_dir != model.feature_cache_dir
+    assert not other._shard_path(REFTIMES[0]).exists()
+    data = other.load_data(_index()[:3])
+    assert data.shape == (3, 9)
+    assert other._shard_path(REFTIMES[0]).exists()
+
+    # Disabling the cache neither reads nor writes shards.
+    uncached = _model(center, feature_cache=False)
+    _store(REFTIMES[1])
+    uncached.load_data(_index())
+    assert not model._shard_path(REFTIMES[1]).exists()
+
+
+def test_feature_cache_is_invalidated_by_rewrites(apollo_data, center):
+    _store(REFTIMES[0], seed=0)
+    model = _model(center)
+    model.load_data(_index()[:3])
+
+    ds = _store(REFTIMES[0], seed=1)
+    data = model.load_data(_index()[:3])
+    np.testing.assert_array_equal(data.iloc[:, 4].values, ds.DSWRF_SFC.values[0, :, 0, 2, 2])
+
+    # Forecasts removed from the store are not served from the cache.
+    nam.nc_path(REFTIMES[0]).unlink()
+    with pytest.raises(nam.CacheMiss):
+        model.load_data(_index()[:3])
+
+
+@pytest.mark.parametrize('damage', ['corrupt', 'partial'])
+def test_feature_cache_recovers_from_damaged_shards(apollo_data, center, damage):
+    ds = _store(REFTIMES[0])
+    model = _model(center)
+    model.load_data(_index()[:3])
+
+    path = model._shard_path(REFTIMES[0])
+    raw = path.read_bytes()
+    if damage == 'corrupt':
+        path.write_bytes(b'\0' * len(raw))
+    else:
+        path.write_bytes(raw[:len(raw) // 2])
+    assert model._read_shard(REFTIMES[0]) is None
+
+    data = model.load_data(_index()[:3])
+    np.testing.assert_array_equal(data.iloc[:, 4].values, ds.DSWRF_SFC.values[0, :, 0, 2, 2])
+    assert model._read_shard(REFTIMES[0]) is not None
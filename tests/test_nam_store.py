@@ -0,0 +1,459 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+import pytest
+
+xr = pytest.importorskip('xarray')
+netCDF4 = pytest.importorskip('netCDF4')
+
+import apollo
+from apollo import nam
+
+from conftest import make_forecast
+
+
+REFTIME = '2018-01-01T00:00'
+
+
+def _forecast(reftime=REFTIME, hours=3, seed=0, **kwargs):
+    '''Build a synthetic forecast spanning several forecast hours.
+    '''
+    reftime = apollo.Timestamp(reftime)
+    parts = [make_forecast(reftime, f, seed=seed, **kwargs) for f in range(hours)]
+    return xr.concat(parts, dim='forecast')
+
+
+def _store(reftime=REFTIME, **kwargs):
+    '''Write a synthetic forecast into the local netCDF store.
+    '''
+    ds = _forecast(reftime, **kwargs)
+    path = nam.nc_path(apollo.Timestamp(reftime))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    nam.write_nc(ds, path)
+    return ds, path
+
+
+def _variable(path, name):
+    '''Read the on-disk type, chunking, and filters of a netCDF variable.
+    '''
+    with netCDF4.Dataset(path) as nc:
+        var = nc[name]
+        return var.dtype, var.chunking(), var.filters()
+
+
+def test_storage_encoding_chunks():
+    ds = _forecast(nx=40, ny=20)
+    encoding = nam.storage_encoding(ds, tile=16)
+
+    # Chunks span every forecast hour and are tiled along x and y.
+    assert set(encoding) == {'DSWRF_SFC', 'TMP_ISBL'}
+    assert encoding['DSWRF_SFC']['chunksizes'] == (1, 3, 1, 16, 16)
+    assert encoding['TMP_ISBL']['chunksizes'] == (1, 3, 1, 16, 16)
+    assert encoding['DSWRF_SFC']['dtype'] == 'float32'
+    assert encoding['DSWRF_SFC']['zlib']
+
+    # Tiles are clipped to small grids.
+    encoding = nam.storage_encoding(_forecast(), tile=16, complevel=0)
+    assert encoding['DSWRF_SFC']['chunksizes'] == (1, 3, 1, 3, 4)
+    assert not encoding['DSWRF_SFC']['zlib']
+
+
+def test_storage_encoding_int16_covers_the_data():
+    ds = _forecast()
+    encoding = nam.storage_encoding(ds, pack='int16')
+
+    for name, enc in encoding.items():
+        var = ds[name].values
+        assert enc['dtype'] == 'int16'
+        packed = np.round((var - enc['add_offset']) / enc['scale_factor'])
+        assert packed.min() >= -32767
+        assert packed.max() <= 32767
+
+
+def test_storage_encoding_rejects_unknown_packing():
+    with pytest.raises(ValueError):
+        nam.storage_encoding(_forecast(), pack='int8')
+
+
+@pytest.mark.parametrize('pack, tol', [('float32', 0), ('int16', 1e-2)])
+def test_write_nc_round_trip(apollo_data, pack, tol):
+    ds = _forecast()
+    path = nam.nc_path(apollo.Timestamp(REFTIME))
+    path.parent.mkdir(parents=True)
+    nam.write_nc(ds, path, pack=pack, tile=2)
+
+    dtype, chunking, filters = _variable(path, 'DSWRF_SFC')
+    assert dtype == np.dtype(pack)
+    assert chunking == [1, 3, 1, 2, 2]
+    assert filters['zlib'] and filters['shuffle']
+    assert not path.with_name(path.name + '.part').exists()
+
+    # Writing into the store catalogs the forecast.
+    assert list(nam.iter_available_forecasts()) == [apollo.Timestamp(REFTIME)]
+
+    data = nam.open(REFTIME, cache=False).load()
+    for name in ('DSWRF_SFC', 'TMP_ISBL'):
+        np.testing.assert_allclose(data[name].values, ds[name].values, atol=tol)
+
+
+def test_reencode_rewrites_in_place(apollo_data):
+    ds, path = _store()
+    assert _variable(path, 'TMP_ISBL')[0] == np.dtype('float32')
+
+    nam.reencode(path, pack='int16', complevel=1)
+    dtype, _, filters = _variable(path, 'TMP_ISBL')
+    assert dtype == np.dtype('int16')
+    assert filters['complevel'] == 1
+
+    data = nam.open(REFTIME, cache=False).load()
+    np.testing.assert_allclose(data.TMP_ISBL.values, ds.TMP_ISBL.values, atol=1e-2)
+
+
+def test_encode_cli_reencodes_selected_forecasts(apollo_data):
+    from apollo.cli.nam import encode
+
+    _, path = _store()
+    encode.main(['--pack', 'int16', '--dry-run'])
+    assert _variable(path, 'DSWRF_SFC')[0] == np.dtype('float32')
+
+    encode.main(['--pack', 'int16'])
+    assert _variable(path, 'DSWRF_SFC')[0] == np.dtype('int16')
+
+
+def test_iter_reftimes_modes(apollo_data):
+    from apollo.cli.nam import iter_reftimes
+
+    def args(reftime=None, range=None, count=None):
+        return argparse.Namespace(reftime=reftime, range=range, count=count)
+
+    t = apollo.Timestamp(REFTIME)
+    assert list(iter_reftimes(args(reftime=REFTIME))) == [t]
+
+    selected = list(iter_reftimes(args(range=[REFTIME, '2018-01-01T18:00'])))
+    assert len(selected) == 4
+    assert selected[0] == t
+
+    now = apollo.Timestamp('now').floor('6h')
+    selected = list(iter_reftimes(args(count=3)))
+    assert len(selected) == 3
+    assert selected[0] == now
+    assert list(iter_reftimes(args())) == [now]
+
+    # Subcommands without --reftime may default to every local forecast.
+    _store()
+    no_reftime = argparse.Namespace(range=None, count=None)
+    assert list(iter_reftimes(no_reftime, default='all')) == [t]
+
+
+@pytest.fixture
+def fake_download(monkeypatch):
+    '''Serve synthetic forecast hours to :func:`nam.download`.
+
+    The fixture is a dict whose ``seed`` picks the values of the next download.
+    '''
+    options = {'seed': 0}
+
+    def download_forecast(reftime, forecast, **kwargs):
+        return make_forecast(reftime, forecast, seed=options['seed'])
+
+    monkeypatch.setattr(nam, 'FORECAST_PERIOD', (0, 1, 2))
+    monkeypatch.setattr(nam, '_download_forecast', download_forecast)
+    return options
+
+
+def test_zarr_store_appends_reftimes(apollo_data, fake_download):
+    pytest.importorskip('zarr')
+    later, earlier = apollo.Timestamp('2018-01-01T06:00'), apollo.Timestamp(REFTIME)
+
+    assert not nam.zarr_path().exists()
+    nam.download(later, store='zarr')
+    nam.download(earlier, store='zarr')
+
+    # Reftimes are appended in the order they are written,
+    # but listed and opened in sorted order.
+    assert list(nam._zarr_reftimes()) == [later, earlier]
+    assert list(nam.iter_available_forecasts(store='zarr')) == [earlier, later]
+    assert not nam.nc_path(earlier).exists()
+    assert list(nam.iter_available_forecasts(store='netcdf')) == []
+
+    data = nam.open([earlier, later], store='zarr', cache=False).load()
+    assert list(data.reftime.values) == [earlier.tz_convert(None), later.tz_convert(None)]
+    expected = make_forecast(earlier, 1).DSWRF_SFC.values[0, 0]
+    np.testing.assert_array_equal(data.DSWRF_SFC.values[0, 1], expected)
+
+
+def test_zarr_store_overwrites_existing_reftime(apollo_data, fake_download):
+    pytest.importorskip('zarr')
+    reftime = apollo.Timestamp(REFTIME)
+    nam.download(reftime, store='zarr')
+
+    # Without force, the existing reftime is reused.
+    fake_download['seed'] = 1
+    data = nam.download(reftime, store='zarr').load()
+    expected = make_forecast(reftime, 0, seed=0).TMP_ISBL.values
+    np.testing.assert_array_equal(data.TMP_ISBL.values[:, :1], expected)
+
+    # With force, the region of that reftime is rewritten.
+    nam.download(reftime, store='zarr', force=True)
+    assert list(nam._zarr_reftimes()) == [reftime]
+    data = nam.open(reftime, store='zarr', cache=False).load()
+    expected = make_forecast(reftime, 0, seed=1).TMP_ISBL.values
+    np.testing.assert_array_equal(data.TMP_ISBL.values[:, :1], expected)
+
+
+def test_store_is_read_from_the_environment(apollo_data, fake_download, monkeypatch):
+    pytest.importorskip('zarr')
+    monkeypatch.setenv('APOLLO_NAM_STORE', 'zarr')
+    nam.download(REFTIME)
+    assert nam.zarr_path().exists()
+    assert list(nam.iter_available_forecasts()) == [apollo.Timestamp(REFTIME)]
+
+    monkeypatch.setenv('APOLLO_NAM_STORE', 'hdf5')
+    with pytest.raises(ValueError):
+        nam.open(REFTIME)
+
+
+def test_catalog_drops_files_removed_from_the_store(apollo_data):
+    earlier, later = apollo.Timestamp(REFTIME), apollo.Timestamp('2018-01-01T06:00')
+    _store(earlier)
+    _, path = _store(later)
+    nam.open(later).load()
+
+    path.unlink()
+    with pytest.raises(nam.CacheMiss):
+        nam.open(later)
+
+    data = nam.open([earlier, later], on_miss='skip')
+    assert list(data.reftime.values) == [earlier.tz_convert(None)]
+    assert list(nam.iter_available_forecasts()) == [earlier]
+    assert list(nam._catalog_reftimes()) == [earlier]
+
+
+def test_catalog_adopts_files_added_to_the_store(apollo_data):
+    earlier, later = apollo.Timestamp(REFTIME), apollo.Timestamp('2018-01-01T06:00')
+    _store(earlier)
+    assert list(nam.iter_available_forecasts()) == [earlier]
+
+    # Copy a forecast into the store without going through Apollo.
+    ds = _forecast(later, seed=1)
+    ds.to_netcdf(nam.nc_path(later))
+    assert list(nam._catalog_reftimes()) == [earlier]
+
+    data = nam.open(later, cache=False).load()
+    np.testing.assert_array_equal(data.DSWRF_SFC.values, ds.DSWRF_SFC.values)
+    assert list(nam.iter_available_forecasts()) == [earlier, later]
+
+
+@pytest.fixture
+def dataset_cache(monkeypatch):
+    '''Give each test an empty dataset cache of the default size.
+    '''
+    from collections import OrderedDict
+    monkeypatch.setattr(nam, '_dataset_cache', OrderedDict())
+    monkeypatch.setattr(nam, '_dataset_cache_maxsize', 16)
+    return nam._dataset_cache
+
+
+def test_dataset_cache_evicts_least_recently_used(apollo_data, dataset_cache):
+    reftimes = [apollo.Timestamp(REFTIME) + pd.Timedelta(6 * i, 'h') for i in range(3)]
+    for reftime in reftimes: _store(reftime)
+
+    nam.set_cache_options(maxsize=2)
+    nam.open(reftimes[0])
+    nam.open(reftimes[1])
+    nam.open(reftimes[0])  # Now more recent than reftimes[1].
+    nam.open(reftimes[2])
+    cached = [key[1] for key in dataset_cache]
+    assert cached == [(nam._hours(reftimes[0]),), (nam._hours(reftimes[2]),)]
+
+    nam.set_cache_options(maxsize=0)
+    assert len(dataset_cache) == 0
+    nam.open(reftimes[0])
+    assert len(dataset_cache) == 0
+
+
+def test_dataset_cache_is_invalidated_by_writes(apollo_data, dataset_cache):
+    earlier, later = apollo.Timestamp(REFTIME), apollo.Timestamp('2018-01-01T06:00')
+    _store(earlier)
+    _store(later)
+    nam.open(earlier)
+    nam.open(later)
+    nam.open([earlier, later])
+    assert len(dataset_cache) == 3
+
+    # Rewriting a forecast evicts every dataset containing it.
+    _, path = _store(later, seed=1)
+    assert len(dataset_cache) == 1
+    data = nam.open(later).load()
+    expected = _forecast(later, seed=1)
+    np.testing.assert_array_equal(data.DSWRF_SFC.values, expected.DSWRF_SFC.values)
+
+    nam.clear_cache(earlier)
+    assert [key[1] for key in dataset_cache] == [(nam._hours(later),)]
+    nam.clear_cache()
+    assert len(dataset_cache) == 0
+
+
+def test_dataset_cache_returns_independent_copies(apollo_data, dataset_cache):
+    _store()
+    a = nam.open(REFTIME)
+    a['extra'] = a.DSWRF_SFC * 2
+    b = nam.open(REFTIME)
+    assert 'extra' not in b
+    assert len(dataset_cache) == 1
+
+
+def test_align_bypasses_the_dataset_cache(apollo_data, dataset_cache):
+    from apollo.cli.nam import align
+
+    reftimes = [apollo.Timestamp(REFTIME) + pd.Timedelta(6 * i, 'h') for i in range(3)]
+    ds = _forecast(reftimes[0])
+    ds['x'] = ds.x + 0.5
+    path = nam.nc_path(reftimes[0])
+    path.parent.mkdir(parents=True)
+    nam.write_nc(ds, path)
+    _store(reftimes[1])
+    _store(reftimes[2])
+
+    # Align closes the files it opens,
+    # so none of them may be shared through the cache.
+    held = nam.open(reftimes[2])
+    align.main([])
+    assert [key[1] for key in dataset_cache] == [(nam._hours(reftimes[2]),)]
+    held.load()
+
+    data = nam.open(reftimes[0]).load()
+    np.testing.assert_array_equal(data.x.values, held.x.values)
+    np.testing.assert_array_equal(data.DSWRF_SFC.values, ds.DSWRF_SFC.values)
+
+
+def _store_several(n=3):
+    '''Write ``n`` consecutive forecasts into the store, returning their paths.
+    '''
+    reftimes = [apollo.Timestamp(REFTIME) + pd.Timedelta(6 * i, 'h') for i in range(n)]
+    return [_store(reftime, seed=i)[1] for (i, reftime) in enumerate(reftimes)]
+
+
+@pytest.mark.parametrize('parallel', [True, False])
+@pytest.mark.parametrize('aligned', [True, False])
+def test_open_dataset_combines_files(apollo_data, parallel, aligned):
+    paths = _store_several()
+    data = nam._open_dataset(paths, aligned=aligned, parallel=parallel).load()
+
+    assert data.DSWRF_SFC.shape == (3, 3, 1, 3, 4)
+    assert 'reftime' not in data.lat.dims
+    for (i, path) in enumerate(paths):
+        with xr.open_dataset(path) as ds:
+            np.testing.assert_array_equal(data.TMP_ISBL.values[i], ds.TMP_ISBL.values[0])
+
+
+def test_open_dataset_sorts_unaligned_files(apollo_data):
+    paths = _store_several()
+    data = nam._open_dataset(paths[::-1]).load()
+    assert (np.diff(data.reftime.values) > np.timedelta64(0)).all()
+
+
+def test_open_dataset_chunks(apollo_data):
+    paths = _store_several()
+
+    # The default is one chunk per file.
+    data = nam._open_dataset(paths)
+    assert data.DSWRF_SFC.chunks[0] == (1, 1, 1)
+    assert data.DSWRF_SFC.chunks[3:] == ((3,), (4,))
+
+    data = nam._open_dataset(paths, chunks={'x': 2, 'y': 2})
+    assert data.DSWRF_SFC.chunks[3:] == ((2, 1), (2, 2))
+
+    # Different chunks are cached separately by `open`.
+    a = nam.open(list(nam.iter_available_forecasts()), chunks={'x': 2})
+    b = nam.open(list(nam.iter_available_forecasts()))
+    assert a.DSWRF_SFC.chunks[4] == (2, 2)
+    assert b.DSWRF_SFC.chunks[4] == (4,)
+
+
+def test_open_selects_variables_and_region(apollo_data, dataset_cache):
+    _store_several()
+    reftimes = list(nam.iter_available_forecasts())
+    full = nam.open(reftimes).load()
+
+    data = nam.open(reftimes, variables=['TMP_ISBL'], region={'x': slice(1, 3), 'y': slice(0, 2)})
+    assert list(data.data_vars) == ['TMP_ISBL']
+    assert 'time' in data.coords
+    expected = full.TMP_ISBL.isel(x=slice(1, 3), y=slice(0, 2))
+    xr.testing.assert_equal(data.TMP_ISBL.load(), expected)
+
+    # Each selection is cached separately.
+    assert len(dataset_cache) == 2
+    nam.open(reftimes, variables=['TMP_ISBL'])
+    assert len(dataset_cache) == 3
+    again = nam.open(reftimes, variables=['TMP_ISBL'], region={'x': slice(1, 3), 'y': slice(0, 2)})
+    assert len(dataset_cache) == 3
+    xr.testing.assert_equal(again.TMP_ISBL.load(), expected)
+
+
+def test_open_selects_geographic_region(apollo_data):
+    ccrs = pytest.importorskip('cartopy.crs')
+    _store_several()
+    reftimes = list(nam.iter_available_forecasts())
+    full = nam.open(reftimes, cache=False).load()
+
+    # A window of 3x3 cells centered on the third column and second row.
+    lon, lat = ccrs.PlateCarree().transform_point(25000.0, 10000.0, nam.NAM218)
+    data = nam.open(reftimes, cache=False, region=((lat, lon), 24000)).load()
+    assert list(data.x.values) == [13000.0, 25000.0, 37000.0]
+    assert list(data.y.values) == [-2000.0, 10000.0, 22000.0]
+    xr.testing.assert_equal(data, full.sel(x=data.x, y=data.y))
+
+
+def test_open_selects_from_the_zarr_store(apollo_data, fake_download):
+    pytest.importorskip('zarr')
+    nam.download(REFTIME, store='zarr')
+    full = nam.open(REFTIME, store='zarr', cache=False).load()
+    data = nam.open(REFTIME, store='zarr', cache=False,
+        variables=['DSWRF_SFC'], region={'x': slice(0, 2), 'y': slice(1, 3)})
+    assert list(data.data_vars) == ['DSWRF_SFC']
+    expected = full.DSWRF_SFC.isel(x=slice(0, 2), y=slice(1, 3))
+    xr.testing.assert_equal(data.DSWRF_SFC.load(), expected)
+
+
+def test_extract_sites_matches_each_site(apollo_data):
+    ccrs = pytest.importorskip('cartopy.crs')
+    reftimes = [apollo.Timestamp(REFTIME) + pd.Timedelta(6 * i, 'h') for i in range(2)]
+    for (i, reftime) in enumerate(reftimes):
+        _store(reftime, seed=i, nx=6, ny=5)
+
+    # Two sites, centered on different cells, with 3x3 neighborhoods.
+    cells = [(25000.0, 22000.0), (37000.0, 10000.0)]
+    sites = [ccrs.PlateCarree().transform_point(x, y, nam.NAM218) for (x, y) in cells]
+    lons, lats = zip(*sites)
+    times = pd.date_range('2018-01-01T00:00', '2018-01-01T08:00', freq='1h', tz='UTC')
+    array, index, columns = nam.extract_sites(times, lats, lons, shape=24000,
+        variables=['DSWRF_SFC', 'TMP_ISBL'])
+
+    assert array.shape == (2, 6, 27)
+    assert list(index.hour) == [0, 1, 2, 6, 7, 8]
+    assert columns[4] == ('DSWRF_SFC', 0.0, 0, 0)
+    assert columns[-1] == ('TMP_ISBL', 70000.0, 1, 1)
+
+    # Each site matches selecting forecasts from its own window.
+    ds = nam.open(reftimes, cache=False).load()
+    for (site, (x, y)) in enumerate(cells):
+        window = ds.sel(x=slice(x - 12000, x + 12000), y=slice(y - 12000, y + 12000))
+        expected = nam.select_forecasts(window, times)
+        matrix, names = nam.feature_matrix(expected[['DSWRF_SFC', 'TMP_ISBL']])
+        np.testing.assert_array_equal(array[site], matrix)
+        assert [n[:-2] for n in names] == [c[:-2] for c in columns]
+
+
+def test_extract_sites_rejects_clipped_neighborhoods(apollo_data):
+    ccrs = pytest.importorskip('cartopy.crs')
+    _store(nx=6, ny=5)
+    corner = ccrs.PlateCarree().transform_point(1000.0, -2000.0, nam.NAM218)
+    middle = ccrs.PlateCarree().transform_point(25000.0, 22000.0, nam.NAM218)
+    lons, lats = zip(corner, middle)
+    times = pd.date_range(REFTIME, periods=3, freq='1h', tz='UTC')
+    with pytest.raises(ValueError):
+        nam.extract_sites(times, lats, lons, shape=24000, variables=['DSWRF_SFC'])
+    with pytest.raises(ValueError):
+        nam.extract_sites(times, [33.0, 34.0], [-84.0])
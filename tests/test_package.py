@@ -0,0 +1,54 @@
+import importlib
+import inspect
+import subprocess
+import sys
+
+import pytest
+
+import apollo
+
+
+def _public_names(module):
+    '''The public functions, classes, and constants defined by a module.
+    '''
+    names = set()
+    for (name, value) in vars(module).items():
+        if name.startswith('_'): continue
+        if inspect.ismodule(value): continue
+        if inspect.isfunction(value) or inspect.isclass(value):
+            if value.__module__ != module.__name__: continue
+        elif not name.isupper():
+            continue
+        names.add(name)
+    return names
+
+
+@pytest.mark.parametrize('name, requires', [
+    ('time', ['pandas']),
+    ('viz', ['pandas', 'matplotlib', 'cartopy']),
+])
+def test_lazy_attributes_match_public_names(name, requires):
+    for module in requires:
+        pytest.importorskip(module)
+
+    module = importlib.import_module(f'apollo.{name}')
+    lazy = {attr for (attr, mod) in apollo._LAZY_ATTRS.items() if mod == name}
+    assert lazy == set(module.__all__)
+    assert _public_names(module) <= set(module.__all__)
+    for attr in module.__all__:
+        assert getattr(apollo, attr) is getattr(module, attr)
+
+
+def test_lazy_attributes_are_listed():
+    assert set(apollo._LAZY_ATTRS) <= set(dir(apollo))
+    with pytest.raises(AttributeError):
+        apollo.not_an_attribute
+
+
+def test_import_does_not_load_heavy_dependencies():
+    code = (
+        'import sys, apollo; '
+        'print(" ".join(m for m in ("pandas", "matplotlib", "cartopy") if m in sys.modules))'
+    )
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == ''
@@ -0,0 +1,120 @@
+import io
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('sklearn')
+pytest.importorskip('pickle5')
+
+from apollo import nam
+from apollo.cli import serve
+from apollo.models.base import IrradianceModel
+
+
+class _Model(IrradianceModel):
+    '''A model whose features are the hour of each time.
+
+    Times in ``missing`` raise :class:`apollo.nam.CacheMiss`.
+    '''
+    def __init__(self, missing=(), **kwargs):
+        super().__init__(estimator='sklearn.linear_model.LinearRegression',
+            add_time_of_day=False, add_time_of_year=False, **kwargs)
+        self.missing = list(missing)
+
+    def load_data(self, index):
+        if any(str(t.date()) in self.missing for t in index):
+            raise nam.CacheMiss('no data')
+        return pd.DataFrame({'hour': index.hour.astype('float64')}, index=index)
+
+
+def _save(name, scale=1.0, **kwargs):
+    '''Train a model predicting ``scale`` times the hour, and save it by name.
+    '''
+    index = pd.date_range('2019-01-01', periods=48, freq='1h', tz='UTC')
+    targets = pd.DataFrame({'ghi': scale * index.hour.astype('float64')}, index=index)
+    model = _Model(name=name, **kwargs).fit(targets)
+    return model.save()
+
+
+@pytest.fixture
+def server(apollo_data):
+    '''Serve the Apollo database on an ephemeral port.
+
+    The fixture is a function returning the status, content type, and body of
+    a GET request.
+    '''
+    args = serve.parse_args(['--port', '0'])
+    registry = serve.ModelRegistry()
+    httpd = serve.make_server(args, registry)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    (host, port) = httpd.server_address[:2]
+
+    def get(path):
+        try:
+            with urllib.request.urlopen(f'http://{host}:{port}{path}') as r:
+                return r.status, r.headers['Content-Type'], r.read().decode()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers['Content-Type'], e.read().decode()
+
+    yield get
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_serve_lists_models(server):
+    assert server('/models') == (200, 'application/json', '[]')
+    _save('b')
+    _save('a')
+    (status, _, body) = server('/models')
+    assert status == 200
+    assert json.loads(body) == ['a', 'b']
+
+
+def test_serve_predicts_csv_and_json(server):
+    _save('linear', scale=2.0)
+
+    (status, content_type, body) = server('/predict/linear?start=2019-02-01T03:00&stop=2019-02-01T05:00')
+    assert (status, content_type) == (200, 'text/csv')
+    predictions = pd.read_csv(io.StringIO(body), index_col=0)
+    assert list(predictions.columns) == ['ghi']
+    np.testing.assert_allclose(predictions.ghi.values, [6, 8, 10], atol=1e-6)
+
+    (status, content_type, body) = server('/predict/linear?start=2019-02-01T03:00&format=json')
+    assert (status, content_type) == (200, 'application/json')
+    predictions = json.loads(body)
+    assert predictions['columns'] == ['ghi']
+    assert len(predictions['index']) == 1
+    np.testing.assert_allclose(predictions['data'], [[6]], atol=1e-6)
+
+
+def test_serve_reloads_changed_models(server):
+    path = _save('linear', scale=1.0)
+    url = '/predict/linear?start=2019-02-01T04:00&format=json'
+    np.testing.assert_allclose(json.loads(server(url)[2])['data'], [[4]], atol=1e-6)
+
+    _save('linear', scale=3.0)
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    np.testing.assert_allclose(json.loads(server(url)[2])['data'], [[12]], atol=1e-6)
+
+
+@pytest.mark.parametrize('path, status', [
+    ('/predict/linear?start=2019-02-01&format=xml', 400),
+    ('/predict/linear', 400),
+    ('/predict/linear?start=yesterday-ish', 400),
+    ('/predict/unknown?start=2019-02-01', 404),
+    ('/predict/linear?start=2019-03-01', 404),
+    ('/nothing/here', 404),
+])
+def test_serve_reports_errors_as_json(server, path, status):
+    _save('linear', missing=['2019-03-01'])
+    (code, content_type, body) = server(path)
+    assert (code, content_type) == (status, 'application/json')
+    assert 'error' in json.loads(body)
@@ -0,0 +1,129 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('sklearn')
+pytest.importorskip('pickle5')
+pytest.importorskip('threadpoolctl')
+
+from apollo.cli import sweep
+from apollo.models.base import IrradianceModel
+
+
+class _Model(IrradianceModel):
+    '''A model whose features are derived from the index.
+
+    Models with the same ``spec`` share their feature data. The parent process
+    records every spec it loads features for, and models with ``fail`` raise
+    when they are fit.
+    '''
+    loaded = []
+
+    def __init__(self, spec=None, fail=False, **kwargs):
+        super().__init__(estimator='sklearn.linear_model.LinearRegression', **kwargs)
+        self.spec = spec
+        self.fail = fail
+
+    @property
+    def data_spec(self):
+        return self.spec
+
+    def load_data(self, index):
+        type(self).loaded.append((os.getpid(), self.spec))
+        x = np.arange(len(index), dtype='float64')
+        return pd.DataFrame({'x': x}, index=index)
+
+    def fit(self, targets, **kwargs):
+        if self.fail:
+            raise RuntimeError('cannot fit')
+        return super().fit(targets, **kwargs)
+
+
+@pytest.fixture
+def templates(tmp_path):
+    '''Write template files, returning their paths.
+    '''
+    def write(**templates):
+        paths = []
+        for (stem, template) in templates.items():
+            path = tmp_path / f'{stem}.json'
+            path.write_text(json.dumps({'_cls': f'{__name__}._Model', **template}))
+            paths.append(str(path))
+        return paths
+    return write
+
+
+@pytest.fixture
+def data(tmp_path):
+    index = pd.date_range('2019-01-01', periods=48, freq='1h', tz='UTC')
+    targets = pd.DataFrame({'ghi': np.arange(48.0)}, index=index)
+    path = tmp_path / 'train.csv'
+    targets.to_csv(path)
+    return str(path)
+
+
+def _run(argv, capsys):
+    '''Run the sweep, returning its exit code and the printed paths.
+    '''
+    try:
+        sweep.main(argv)
+        code = 0
+    except SystemExit as e:
+        code = e.code
+    out = capsys.readouterr().out
+    return code, sorted(os.path.basename(line) for line in out.split())
+
+
+def test_sweep_collects_every_model(tmp_path, templates, data, capsys):
+    from apollo.models import load_model
+
+    _Model.loaded.clear()
+    paths = templates(
+        a={'spec': 'shared'},
+        b={'spec': 'shared', 'name': 'named'},
+        c={},
+    )
+    dest = tmp_path / 'models'
+    code, printed = _run(['-j', '2', '-o', str(dest), '-d', data, *paths], capsys)
+
+    assert code == 0
+    assert printed == ['a.model', 'c.model', 'named.model']
+    assert sorted(p.name for p in dest.iterdir()) == printed
+
+    # The shared spec is loaded once in this process.
+    # The model without a spec loads its own data in a worker.
+    assert _Model.loaded == [(os.getpid(), 'shared')]
+    model = load_model(dest / 'named.model')
+    assert model.name == 'named'
+    assert model.predict(pd.date_range('2019-01-03', periods=3, freq='1h', tz='UTC')).shape == (3, 1)
+
+
+def test_sweep_reports_failed_models(tmp_path, templates, data, capsys):
+    paths = templates(good={}, bad={'fail': True})
+    dest = tmp_path / 'models'
+    code, printed = _run(['-j', '2', '-o', str(dest), '-d', data, *paths], capsys)
+
+    assert code == 1
+    assert printed == ['good.model']
+    assert [p.name for p in dest.iterdir()] == ['good.model']
+
+
+def test_sweep_rejects_duplicate_names(tmp_path, templates, data, capsys):
+    paths = templates(a={'name': 'same'}, b={'name': 'same'})
+    dest = tmp_path / 'models'
+    code, printed = _run(['-o', str(dest), '-d', data, *paths], capsys)
+
+    assert code == 1
+    assert printed == []
+    assert not dest.exists()
+
+
+def test_sweep_workers_train_on_one_thread():
+    from threadpoolctl import threadpool_info, threadpool_limits
+
+    with threadpool_limits():
+        sweep._init_worker(None)
+        assert all(pool['num_threads'] == 1 for pool in threadpool_info())
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import apollo
+from apollo import time
+
+
+# Published sunrise and sunset times, in UTC, rounded to the minute.
+# Each row is ``(lat, lon, date, sunrise, sunset)``.
+SUN_EVENTS = [
+    (51.4779, 0.0, '2019-06-21', '2019-06-21T03:43', '2019-06-21T20:21'),  # Greenwich
+    (40.7128, -74.0060, '2019-06-21', '2019-06-21T09:25', '2019-06-22T00:31'),  # New York
+    (64.1466, -21.9426, '2019-06-21', '2019-06-21T02:55', '2019-06-22T00:03'),  # Reykjavik
+    (-33.8688, 151.2093, '2019-12-21', '2019-12-20T18:41', '2019-12-21T09:05'),  # Sydney
+]
+
+TROMSO = (69.6492, 18.9553)
+MCMURDO = (-77.8419, 166.6863)
+
+
+def _day(date):
+    return (pd.Timestamp(date) - pd.Timestamp('1970-01-01')) // pd.Timedelta(1, 'D')
+
+
+def _minutes(timestamp):
+    return (pd.Timestamp(timestamp) - pd.Timestamp('1970-01-01')) / pd.Timedelta(1, 'min')
+
+
+@pytest.mark.parametrize('lat, lon, date, sunrise, sunset', SUN_EVENTS)
+def test_sun_events_match_published_times(lat, lon, date, sunrise, sunset):
+    (rise, set_, polar_day) = time._compute_sun_events([_day(date)], lat, lon)
+    assert abs(rise[0] - _minutes(sunrise)) <= 2
+    assert abs(set_[0] - _minutes(sunset)) <= 2
+    assert not polar_day[0]
+
+
+@pytest.mark.parametrize('lat, lon, date, polar_day', [
+    (*TROMSO, '2019-06-21', True),
+    (*TROMSO, '2019-12-21', False),
+    (*MCMURDO, '2019-12-21', True),
+    (*MCMURDO, '2019-06-21', False),
+])
+def test_sun_events_in_polar_day_and_night(lat, lon, date, polar_day):
+    (rise, set_, is_polar_day) = time._compute_sun_events([_day(date)], lat, lon)
+    assert np.isinf(rise[0]) and np.isinf(set_[0])
+    assert is_polar_day[0] == polar_day
+
+
+def test_is_daylight_around_sunrise_and_sunset():
+    (lat, lon) = SUN_EVENTS[0][:2]
+    times = pd.date_range('2019-06-21T00:00', '2019-06-21T23:00', freq='1h', tz='UTC')
+    daylight = apollo.is_daylight(times, lat, lon)
+
+    # Sunrise at 03:43 and sunset at 20:21, with an hour of leeway before each.
+    expected = (2 < times.hour) & (times.hour < 21)
+    assert list(daylight.values) == list(expected)
+    assert daylight.name == 'daylight'
+
+
+@pytest.mark.parametrize('lat, lon, month, expected', [
+    (*TROMSO, 6, True),
+    (*TROMSO, 12, False),
+    (*MCMURDO, 12, True),
+    (*MCMURDO, 6, False),
+])
+def test_is_daylight_in_polar_day_and_night(lat, lon, month, expected):
+    times = pd.date_range(f'2019-{month:02d}-20', periods=72, freq='1h', tz='UTC')
+    daylight = apollo.is_daylight(times, lat, lon)
+    assert (daylight == expected).all()
+
+
+def test_is_daylight_memoizes_sun_events():
+    times = pd.date_range('2019-01-01', periods=24*30, freq='1h', tz='UTC')
+    expected = apollo.is_daylight(times, 33.9, -83.4)
+    hits = time._sun_events.cache_info().hits
+    daylight = apollo.is_daylight(times, 33.9, -83.4)
+    assert time._sun_events.cache_info().hits == hits + 1
+    pd.testing.assert_series_equal(daylight, expected)
+
+    # The memoized arrays are shared, so they cannot be modified.
+    (sunrise, _, _) = time._sun_events(17897, 17927, 33.9, -83.4)
+    with pytest.raises(ValueError):
+        sunrise[0] = 0